@@ -0,0 +1,1170 @@
+// Script do player e das listas (base.html). Os dados da página chegam em
+// window.SPOTI, definido inline no template.
+$(document).ready(function () {
+  const allMusicas = SPOTI.musicas;
+  const allFavoritos = SPOTI.favoritos;
+  let musicaAtual = SPOTI.musicaSelecionada;
+  let isRepeatEnabled = false;
+  let isShowingFavorites = false;
+  let isShowingPlaylist = false;
+  let currentCustomListName = null;  // Nome da playlist customizada atualmente exibida
+  let rightClickedMusic = null;      // Música clicada com botão direito
+  let rightClickedPlaylist = null;   // Playlist clicada com botão direito
+
+  let currentPlaylistId = null; // ID da playlist atualmente selecionada para editar ou excluir
+
+  // Aqui armazenaremos as playlists do usuário vindas do servidor:
+  // userPlaylists = [ { id: 1, name: 'Rock', musicas: [...] }, ... ]
+  let userPlaylists = [];
+
+  // A lista vem do cache de fragmentos sem seleção; marca a música atual
+  if (musicaAtual) {
+    $('#music-list li')
+      .filter((i, el) => $(el).data('musica') === musicaAtual)
+      .addClass('selected')
+      .find('.song-link').removeClass('text-light');
+  }
+
+  // Armazenar o HTML inicial da lista de músicas
+  const initialMusicListHTML = $('.music-list').html();
+
+  // ------------------------
+  // 1) Carrega do servidor a lista de playlists do usuário
+  //    quando abrir o painel de playlists
+  // ------------------------
+  function fetchUserPlaylists() {
+    return $.ajax({
+      url: SPOTI.urls.user_playlists,
+      method: "GET",
+      success: function(data) {
+        // data: [ {id: 1, nome: 'Rock'}, ... ]
+        userPlaylists = data.map(pl => ({
+          id: pl.id,
+          name: pl.nome,
+          musicas: [] // carregamos músicas depois
+        }));
+      },
+      error: function(err) {
+        console.error("Erro ao buscar playlists:", err);
+      }
+    });
+  }
+
+  // 2) Ao clicar numa playlist item, carrega músicas do servidor
+  //    e mostra no lugar da .music-list
+  function fetchAndShowPlaylist(playlistId, playlistName) {
+    $.ajax({
+      url: "/get_playlist_songs/" + playlistId,
+      method: "GET",
+      success: function(songs) {
+        // 'songs' é um array de strings (nomes de arquivos)
+        // Atualiza local userPlaylists
+        let p = userPlaylists.find(pl => pl.id === playlistId);
+        if (p) {
+          p.musicas = songs;
+        }
+        showCustomPlaylist(playlistName);
+      },
+      error: function(err) {
+        console.error("Erro ao buscar músicas da playlist:", err);
+      }
+    });
+  }
+
+  // Cria nova playlist no servidor
+  function createNewPlaylist(playlistName) {
+    if (!playlistName.trim()) return;
+    // Faz requisição AJAX para criar a playlist
+    $.ajax({
+      url: SPOTI.urls.create_playlist_route,
+      method: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({ playlistName: playlistName }),
+      success: function(resp) {
+        if (resp.status === "success") {
+          // Depois de criar, atualiza lista de playlists no cliente
+          fetchUserPlaylists().then(() => {
+            renderUserPlaylists();
+            // Se foi criado via menu de contexto, iremos adicionar a música
+            if (rightClickedMusic) {
+              addMusicToPlaylist(playlistName, rightClickedMusic);
+            }
+          });
+        } else {
+          alert("Não foi possível criar playlist. Motivo: " + resp.message);
+        }
+      },
+      error: function(err) {
+        alert("Erro ao criar playlist: " + err.responseText);
+      }
+    });
+  }
+
+  // Adiciona uma música à playlist no servidor
+  function addMusicToPlaylist(playlistName, musica) {
+    // Encontrar ID da playlist local
+    let p = userPlaylists.find(pl => pl.name === playlistName);
+    if (!p) {
+      alert("Playlist não encontrada localmente: " + playlistName);
+      return;
+    }
+    $.ajax({
+      url: SPOTI.urls.add_to_playlist,
+      method: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({
+        playlistName: playlistName,
+        musica: musica
+      }),
+      success: function(resp) {
+        if (resp.status === "success") {
+          // Atualizar local
+          if (!p.musicas.includes(musica)) {
+            p.musicas.push(musica);
+          }
+          // Se já estiver exibindo essa playlist, atualiza
+          if (currentCustomListName === playlistName) {
+            showCustomPlaylist(playlistName);
+          }
+          alert('Música adicionada à playlist com sucesso!');
+        } else {
+          console.error("Erro ao adicionar música na playlist:", resp.message);
+          alert("Erro ao adicionar música na playlist: " + resp.message);
+        }
+      },
+      error: function(err) {
+        console.error("Erro ao adicionar música na playlist:", err.responseText);
+        alert("Erro ao adicionar música na playlist: " + err.responseText);
+      }
+    });
+  }
+
+  // Renderiza a UI do painel de playlists
+  function renderUserPlaylists() {
+    $('#user-playlists').empty();
+    userPlaylists.forEach(pl => {
+      $('#user-playlists').append(
+        `<li 
+          class="list-group-item py-1 px-2 text-truncate playlist-item" 
+          data-playlist-id="${pl.id}" 
+          data-playlist-name="${pl.name}"
+        >
+          ${pl.name}
+        </li>`
+      );
+    });
+  }
+
+  // ------------------------
+  //  Botão Adicionar à Playlist
+  // ------------------------
+  $(document).on('click', '#add-to-playlist-button', function() {
+    if (!musicaAtual) {
+      alert('Nenhuma música selecionada para adicionar à playlist.');
+      return;
+    }
+    
+    // Abre o modal para selecionar a playlist
+    $('#addToPlaylistModal').modal('show');
+  });
+
+  // Preencher a lista de playlists no modal "Adicionar à Playlist"
+  function populateAddToPlaylistModal() {
+    $('#add-to-playlist-list').empty();
+    if (userPlaylists.length === 0) {
+      $('#add-to-playlist-list').append('<li class="list-group-item text-center text-muted">Nenhuma playlist disponível.</li>');
+    } else {
+      userPlaylists.forEach(pl => {
+        $('#add-to-playlist-list').append(
+          `<li class="list-group-item list-group-item-action choose-add-playlist" data-playlist-name="${pl.name}">
+            ${pl.name}
+          </li>`
+        );
+      });
+    }
+  }
+
+  // Ao abrir o modal, preencher a lista
+  $('#addToPlaylistModal').on('show.bs.modal', function () {
+    populateAddToPlaylistModal();
+  });
+
+  // Clique na playlist dentro do modal para adicionar a música
+  $(document).on('click', '.choose-add-playlist', function() {
+    const playlistName = $(this).data('playlist-name');
+    addMusicToPlaylist(playlistName, musicaAtual);
+    $('#addToPlaylistModal').modal('hide');
+  });
+
+  // ------------------------
+  //  Botão Excluir Música
+  // ------------------------
+  $(document).on('click', '#delete-music-button', function() {
+    if (!musicaAtual) {
+      alert('Nenhuma música selecionada para excluir.');
+      return;
+    }
+    
+    if (confirm(`Tem certeza que deseja excluir a música "${musicaAtual}"? Isso removerá a música de todas as playlists e favoritos.`)) {
+      // Chamar a função para excluir a música no servidor
+      deleteMusicFromServer(musicaAtual);
+    }
+  });
+
+  // Exibe a playlist customizada (já temos as músicas em userPlaylists)
+  function showCustomPlaylist(playlistName) {
+    currentCustomListName = playlistName;
+    isShowingFavorites = false;
+    $('.music-list').hide();
+    $('.favorites-list').hide();
+    $('.search-results').hide();
+
+    // Achar no array
+    const p = userPlaylists.find(pl => pl.name === playlistName);
+    if (!p) return;
+
+    // Monta HTML dinâmico
+    let html = `<h4 class="mb-3">Lista: ${playlistName}</h4><ul class="list-group">`;
+    if (p.musicas.length === 0) {
+      html += '<li class="list-group-item text-center text-muted">Lista vazia.</li>';
+    } else {
+      p.musicas.forEach(m => {
+        const selClass = (m === musicaAtual) ? 'selected' : '';
+        html += 
+          `<li class="list-group-item ${selClass}" data-musica="${m}">
+            <div class="d-flex justify-content-between align-items-center w-100">
+              <a
+                href="#"
+                class="text-decoration-none song-link text-light"
+                data-musica="${m}"
+                data-artista="Artista Desconhecido"
+                data-url="/play/${m}"
+              >
+                ${m}
+              </a>
+              <span class="favorite" data-musica="${m}">
+                <i class="bi bi-heart"></i>
+              </span>
+            </div>
+          </li>`;
+      });
+    }
+    html += '</ul>';
+    $('.music-list').html(html).show();
+    atualizarPrevNext();
+  }
+
+  // Lógica de favoritos / playlist / pesquisa
+  function getActivePlaylist() {
+    // Se estiver mostrando favoritos, retorna favorites
+    if (isShowingFavorites) {
+      return allFavoritos;
+    }
+    // Se estiver mostrando uma playlist customizada
+    if (currentCustomListName) {
+      const p = userPlaylists.find(pl => pl.name === currentCustomListName);
+      if (p) {
+        return p.musicas;
+      }
+    }
+    // Se estiver mostrando resultados de pesquisa
+    if ($('.search-results').is(':visible')) {
+      return SPOTI.matchingMusicas;
+    }
+    // Caso contrário, retorna lista completa
+    return allMusicas;
+  }
+
+  // ------------------------
+  //  Forma de onda (picos pré-calculados no servidor)
+  // ------------------------
+  const waveformCanvas = document.getElementById('waveform-canvas');
+  let picosAtuais = null;
+  let musicaDosPicos = null;
+
+  function carregarFormaDeOnda(musica) {
+    picosAtuais = null;
+    musicaDosPicos = musica;
+    $('.waveform-container').removeClass('has-waveform');
+    fetch('/peaks/' + encodeURIComponent(musica))
+      .then(resp => resp.ok ? resp.arrayBuffer() : null)
+      .then(buffer => {
+        if (!buffer || musicaDosPicos !== musica) return;
+        // Cabeçalho: 'STPK', versão, reservado, pares (uint16), duração em ms (uint32)
+        const cabecalho = new DataView(buffer, 0, 12);
+        const pares = cabecalho.getUint16(6, true);
+        picosAtuais = new Int8Array(buffer, 12, pares * 2);
+        $('.waveform-container').addClass('has-waveform');
+        desenharFormaDeOnda();
+      })
+      .catch(() => {});
+  }
+
+  function desenharFormaDeOnda() {
+    if (!picosAtuais) return;
+    const largura = waveformCanvas.clientWidth;
+    const altura = waveformCanvas.clientHeight;
+    const escala = window.devicePixelRatio || 1;
+    if (waveformCanvas.width !== largura * escala || waveformCanvas.height !== altura * escala) {
+      waveformCanvas.width = largura * escala;
+      waveformCanvas.height = altura * escala;
+    }
+    const ctx = waveformCanvas.getContext('2d');
+    ctx.setTransform(escala, 0, 0, escala, 0, 0);
+    ctx.clearRect(0, 0, largura, altura);
+
+    const pares = picosAtuais.length / 2;
+    const audio = $('#audio-player')[0];
+    const progresso = audio.duration ? audio.currentTime / audio.duration : 0;
+    const meio = altura / 2;
+    for (let x = 0; x < largura; x++) {
+      // Agrupa os pares que caem em cada coluna de pixel
+      const inicio = Math.floor(x * pares / largura);
+      const fim = Math.max(inicio + 1, Math.floor((x + 1) * pares / largura));
+      let min = 0, max = 0;
+      for (let i = inicio; i < fim && i < pares; i++) {
+        min = Math.min(min, picosAtuais[2 * i]);
+        max = Math.max(max, picosAtuais[2 * i + 1]);
+      }
+      ctx.fillStyle = x / largura < progresso ? '#1db954' : '#535353';
+      ctx.fillRect(x, meio - (max / 128) * meio, 1, Math.max(1, ((max - min) / 128) * meio));
+    }
+  }
+
+  $(window).on('resize', desenharFormaDeOnda);
+
+  // Qualidade do streaming escolhida (salva no navegador)
+  function qualidadeStream() {
+    return localStorage.getItem('streamQuality') || 'original';
+  }
+
+  // Contêineres de remux que nem todo navegador toca (ex.: Opus no Safari antigo)
+  const tiposPorExtensao = {
+    opus: 'audio/ogg; codecs="opus"',
+    ogg: 'audio/ogg',
+    webm: 'audio/webm; codecs="opus"',
+  };
+
+  function navegadorTocaOriginal(audioUrl) {
+    const extensao = audioUrl.split('?')[0].split('.').pop().toLowerCase();
+    const tipo = tiposPorExtensao[extensao];
+    return !tipo || $('#audio-player')[0].canPlayType(tipo) !== '';
+  }
+
+  function urlComQualidade(audioUrl) {
+    let qualidade = qualidadeStream();
+    if (audioUrl && qualidade === 'original' && !navegadorTocaOriginal(audioUrl)) {
+      qualidade = 'aac-medium';
+    }
+    if (!audioUrl || qualidade === 'original') return audioUrl;
+    return audioUrl + (audioUrl.includes('?') ? '&' : '?') + 'quality=' + encodeURIComponent(qualidade);
+  }
+
+  $('#quality-select').val(qualidadeStream()).on('change', function () {
+    localStorage.setItem('streamQuality', $(this).val());
+    if (musicaAtual) {
+      atualizarPlayer(musicaAtual);
+    }
+  });
+
+  // Atualizar o player
+  function atualizarPlayer(musica) {
+    musicaAtual = musica;
+    const $link = $('.song-link').filter((i, el) => $(el).data('musica') === musica);
+    if (!$link.length) return;
+    const artista = $link.data('artista');
+    const audioUrl = $link.data('url');
+
+    $('#player-song-title').text(musica);
+    $('#player-artist').text(artista);
+    $('#audio-player source').attr('src', urlComQualidade(audioUrl));
+    carregarFormaDeOnda(musica);
+    $('#audio-player')[0].load();
+    $('#audio-player')[0].play();
+
+    $('#download-button').attr('href', audioUrl);
+    $('#download-button').attr('download', musica);
+
+    $('.list-group-item').removeClass('selected');
+    $link.closest('.list-group-item').addClass('selected');
+
+    // Atualizar o ícone de favorito no player
+    updateFavoriteButton(musica);
+
+    // Atualizar a barra de volume para refletir o volume atual
+    const currentVolume = $('#volume-bar').val();
+    $('#audio-player')[0].volume = currentVolume / 100;
+  }
+
+  // Atualizar o ícone de favorito no botão do player
+  function updateFavoriteButton(musica) {
+    const favoriteButton = $('#favorite-button i');
+    if (allFavoritos.includes(musica)) {
+      favoriteButton.removeClass('bi-heart').addClass('bi-heart-fill');
+    } else {
+      favoriteButton.removeClass('bi-heart-fill').addClass('bi-heart');
+    }
+  }
+
+  function atualizarPrevNext() {
+    const playlist = getActivePlaylist();
+    const index = playlist.indexOf(musicaAtual);
+
+    if (!playlist.length) return;
+
+    const prevFile = index > 0 ? playlist[index - 1] : playlist[playlist.length - 1];
+    const nextFile = (index < playlist.length - 1) ? playlist[index + 1] : playlist[0];
+
+    $('#prev-button').removeClass('disabled').attr('data-prev', prevFile);
+    $('#next-button').removeClass('disabled').attr('data-next', nextFile);
+  }
+
+  // Início: se já temos uma música selecionada
+  if (musicaAtual) {
+    atualizarPlayer(musicaAtual);
+    atualizarPrevNext();
+  }
+
+  // ------------------------
+  //  Eventos de clique de favorito
+  // ------------------------
+  function toggleFavoriteInServer(musica, icon, button) {
+    $.ajax({
+      url: SPOTI.urls.toggle_favorite,
+      type: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({ musica: musica }),
+      success: function (response) {
+        if (response.status === "added") {
+          icon.removeClass("bi-heart").addClass("bi-heart-fill");
+          button.addClass("favorited");
+          // Adiciona localmente aos favoritos
+          if (!$('.favorites-list').find(`.song-link[data-musica="${musica}"]`).length) {
+            const $linkOriginal = $(`.song-link[data-musica="${musica}"]`).first();
+            const artista = $linkOriginal.data('artista');
+            const audioUrl = $linkOriginal.data('url');
+
+            $('.favorites-list').find('.text-center.text-muted').remove();
+            $('.favorites-list').append(
+              `<li class="list-group-item d-flex justify-content-between align-items-center" data-musica="${musica}">
+                <a
+                  href="#"
+                  class="text-decoration-none text-light song-link"
+                  data-musica="${musica}"
+                  data-artista="${artista}"
+                  data-url="${audioUrl}"
+                >
+                  ${musica}
+                </a>
+                <span class="favorite favorited" data-musica="${musica}">
+                  <i class="bi bi-heart-fill"></i>
+                </span>
+              </li>`
+            );
+            allFavoritos.push(musica);
+          }
+        } else if (response.status === "removed") {
+          icon.removeClass("bi-heart-fill").addClass("bi-heart");
+          button.removeClass("favorited");
+          $('.favorites-list').find(`.song-link[data-musica="${musica}"]`).closest('li').remove();
+          const idx = allFavoritos.indexOf(musica);
+          if (idx > -1) {
+            allFavoritos.splice(idx, 1);
+          }
+          if ($('.favorites-list').find('li').length === 0) {
+            $('.favorites-list').append(
+              `<li class="list-group-item text-center text-muted">Nenhum favorito adicionado.</li>`
+            );
+          }
+        }
+        atualizarPrevNext();
+        updateFavoriteButton(musica);
+        updatePlayerFavoriteButton();
+      },
+      error: function (xhr) {
+        alert("Erro ao alternar favorito: " + xhr.responseText);
+      }
+    });
+  }
+
+  // Clique no ícone de favorito na lista de músicas ou favoritos
+  $(document).on('click', '.favorite', function () {
+    const musica = $(this).data('musica');
+    const icon = $(this).find('i');
+    const button = $(this);
+    toggleFavoriteInServer(musica, icon, button);
+  });
+
+  // ------------------------
+  //  Clique no botão de favorito no player
+  // ------------------------
+  $(document).on('click', '#favorite-button', function () {
+    if (!musicaAtual) return;
+    const musica = musicaAtual;
+    const icon = $(this).find('i');
+    const button = $(this);
+    toggleFavoriteInServer(musica, icon, button);
+  });
+
+  // ------------------------
+  //  Clique no botão Play/Pause no player
+  // ------------------------
+  $(document).on('click', '#play-pause-button', function () {
+    const audio = $('#audio-player')[0];
+    const icon = $(this).find('i');
+    if (audio.paused) {
+      audio.play();
+      icon.removeClass("bi-play-fill").addClass("bi-pause-fill");
+    } else {
+      audio.pause();
+      icon.removeClass("bi-pause-fill").addClass("bi-play-fill");
+    }
+  });
+
+  // ------------------------
+  //  Clique em música
+  // ------------------------
+  $(document).on('click', '.song-link', function (e) {
+    e.preventDefault();
+    const musica = $(this).data('musica');
+    atualizarPlayer(musica);
+    atualizarPrevNext();
+    // Atualizar o botão Play/Pause para mostrar Pause
+    $('#play-pause-button i').removeClass("bi-play-fill").addClass("bi-pause-fill");
+  });
+
+  // ------------------------
+  //  Botão prev/next
+  // ------------------------
+  $('#prev-button').click(function () {
+    if (!$(this).hasClass('disabled')) {
+      const prevFile = $(this).attr('data-prev');
+      if (prevFile) {
+        atualizarPlayer(prevFile);
+        atualizarPrevNext();
+        // Atualizar o botão Play/Pause para mostrar Pause
+        $('#play-pause-button i').removeClass("bi-play-fill").addClass("bi-pause-fill");
+      }
+    }
+  });
+
+  $('#next-button').click(function () {
+    if (!$(this).hasClass('disabled')) {
+      const nextFile = $(this).attr('data-next');
+      if (nextFile) {
+        atualizarPlayer(nextFile);
+        atualizarPrevNext();
+        // Atualizar o botão Play/Pause para mostrar Pause
+        $('#play-pause-button i').removeClass("bi-play-fill").addClass("bi-pause-fill");
+      }
+    }
+  });
+
+  // Shuffle
+  $('#shuffle-button').click(function () {
+    const active = getActivePlaylist();
+    if (!active.length) return;
+    const randomIndex = Math.floor(Math.random() * active.length);
+    const randomSong = active[randomIndex];
+    atualizarPlayer(randomSong);
+    atualizarPrevNext();
+    // Atualizar o botão Play/Pause para mostrar Pause
+    $('#play-pause-button i').removeClass("bi-play-fill").addClass("bi-pause-fill");
+  });
+
+  // Repeat
+  $('#repeat-button').click(function () {
+    isRepeatEnabled = !isRepeatEnabled;
+    $(this).toggleClass('btn-success btn-secondary btn-repeat-active');
+
+    // Atualizar título do botão para acessibilidade
+    if (isRepeatEnabled) {
+      $(this).attr('title', 'Repetição Automática Ativada');
+    } else {
+      $(this).attr('title', 'Repetição Automática Desativada');
+    }
+  });
+
+  // Quando a música termina
+  $('#audio-player').on('ended', function () {
+    if (isRepeatEnabled) {
+      this.currentTime = 0;
+      this.play();
+    } else {
+      const nextFile = $('#next-button').attr('data-next');
+      if (nextFile) {
+        atualizarPlayer(nextFile);
+        atualizarPrevNext();
+        // Atualizar o botão Play/Pause para mostrar Pause
+        $('#play-pause-button i').removeClass("bi-play-fill").addClass("bi-pause-fill");
+      }
+    }
+  });
+
+  // ------------------------
+  //  Botão Favoritos
+  // ------------------------
+  $('#toggle-favorites').click(function() {
+    // Fecha painel de playlists se estiver aberto
+    $('#playlist-panel').hide();
+    isShowingPlaylist = false;
+
+    currentCustomListName = null;
+    isShowingFavorites = !isShowingFavorites;
+    if (isShowingFavorites) {
+      $('.music-list').hide();
+      $('.favorites-list').show();
+      $('.search-results').hide();
+    } else {
+      $('.favorites-list').hide();
+      $('.music-list').show();
+    }
+    atualizarPrevNext();
+  });
+
+  // ------------------------
+  //  Botão Musicas
+  // ------------------------
+  $('#toggle-musicas').click(function() {
+    // Fecha o painel de playlists e favoritos se estiverem abertos
+    $('#playlist-panel').hide();
+    $('.favorites-list').hide();
+    $('.search-results').hide();
+    isShowingFavorites = false;
+    isShowingPlaylist = false;
+
+    // Mostra a lista inicial de músicas
+    currentCustomListName = null;
+    $('.music-list').html(initialMusicListHTML).show();
+
+    // Atualiza os botões de navegação do player
+    atualizarPrevNext();
+  });
+
+  // ------------------------
+  //  Botão Playlists (abrir/fechar painel)
+  // ------------------------
+  $('#toggle-playlists').click(function() {
+    isShowingFavorites = false;
+    $('.favorites-list').hide();
+    $('.search-results').hide();
+
+    if (!isShowingPlaylist) {
+      // Carrega playlists do servidor
+      fetchUserPlaylists().then(() => {
+        renderUserPlaylists();
+        const offset = $(this).offset();
+        $('#playlist-panel')
+          .css({ top: 56, left: offset.left })
+          .show();
+        isShowingPlaylist = true;
+      });
+    } else {
+      $('#playlist-panel').hide();
+      isShowingPlaylist = false;
+    }
+    currentCustomListName = null;
+    atualizarPrevNext();
+  });
+
+  // Clique numa playlist no painel => buscar músicas e exibir
+  $(document).on('click', '.playlist-item', function() {
+    const playlistId = parseInt($(this).data('playlist-id'));
+    const playlistName = $(this).data('playlist-name');
+    $('#playlist-panel').hide();
+    isShowingPlaylist = false;
+    // Busca músicas no servidor, depois mostra
+    fetchAndShowPlaylist(playlistId, playlistName);
+  });
+
+  // ------------------------
+  //  Menu de contexto (botão direito) para músicas
+  // ------------------------
+  $(document).on('contextmenu', '.list-group-item', function(e) {
+    e.preventDefault();
+    const isPlaylistItem = $(this).hasClass('playlist-item');
+    if (isPlaylistItem) {
+      // Não faz nada aqui para item de playlist
+      return;
+    }
+    rightClickedMusic = $(this).data('musica');
+
+    // Carrega as playlists do servidor ANTES de exibir o menu
+    fetchUserPlaylists().then(() => {
+      // Atualiza o menu de contexto para músicas
+      const menu = $('#context-menu');
+      menu.empty(); // Limpa opções anteriores
+      // Verifica se estamos visualizando uma playlist
+      if (currentCustomListName) {
+        menu.append(
+          `<a href="#" id="remove-music-option">Remover da lista</a>`
+        );
+      } else {
+        menu.append(
+          `<a href="#" id="create-playlist-option">Criar nova lista</a>
+           <a href="#" id="add-to-playlist-option">Adicionar a lista existente</a>
+           <a href="#" id="delete-music-option">Excluir música</a>`
+        );
+      }
+      menu.finish().show().css({
+        top: e.pageY + 'px',
+        left: e.pageX + 'px'
+      });
+    });
+  });
+
+  // Ocultar menu se clicar em outro lugar
+  $(document).bind('mousedown', function(e) {
+    if(!$(e.target).parents('#context-menu').length > 0) {
+      $('#context-menu').hide();
+    }
+  });
+
+  // Opção do menu: Criar nova lista
+  $(document).on('click', '#create-playlist-option', function(e) {
+    e.preventDefault();
+    $('#context-menu').hide();
+    $('#new-playlist-name').val('');
+    $('#createPlaylistModal').modal('show');
+  });
+
+  // Botão "Criar" no modal de nova playlist
+  $('#create-playlist-btn').click(function() {
+    const newName = $('#new-playlist-name').val().trim();
+    if (!newName) {
+      alert('O nome da playlist não pode estar vazio.');
+      return;
+    }
+    createNewPlaylist(newName);
+    $('#createPlaylistModal').modal('hide');
+  });
+
+  // Opção do menu: Adicionar a lista existente
+  $(document).on('click', '#add-to-playlist-option', function(e) {
+    e.preventDefault();
+    $('#context-menu').hide();
+
+    $('#existing-playlists').empty();
+    if (!userPlaylists.length) {
+      $('#existing-playlists').append('<li class="list-group-item text-center text-muted">Nenhuma lista criada.</li>');
+    } else {
+      userPlaylists.forEach(pl => {
+        $('#existing-playlists').append(
+          `<li class="list-group-item py-1 px-2 text-truncate choose-playlist" data-playlist-name="${pl.name}">
+            ${pl.name}
+          </li>`
+        );
+      });
+    }
+    $('#choosePlaylistModal').modal('show');
+  });
+
+  // Clique na escolha de playlist dentro do modal
+  $(document).on('click', '.choose-playlist', function() {
+    const pname = $(this).data('playlist-name');
+    if (rightClickedMusic) {
+      addMusicToPlaylist(pname, rightClickedMusic);
+    }
+    $('#choosePlaylistModal').modal('hide');
+  });
+
+  // ------------------------
+  //  Eventos de Contexto para Playlists: Editar e Excluir
+  // ------------------------
+  $(document).on('contextmenu', '.playlist-item', function(e) {
+    e.preventDefault();
+    const playlistId = $(this).data('playlist-id');
+    const playlistName = $(this).data('playlist-name');
+    currentPlaylistId = playlistId;
+
+    // Atualizar o menu de contexto com opções de Editar e Excluir
+    const menu = $('#context-menu');
+    menu.empty();
+    menu.append(
+      `<a href="#" id="edit-playlist-option">Editar</a>
+       <a href="#" id="delete-playlist-option">Excluir</a>`
+    );
+    menu.finish().show().css({
+      top: e.pageY + 'px',
+      left: e.pageX + 'px'
+    });
+  });
+
+  // Clique na opção "Editar" do menu de contexto de playlists
+  $(document).on('click', '#edit-playlist-option', function(e) {
+    e.preventDefault();
+    $('#context-menu').hide();
+
+    const playlistItem = $(`.playlist-item[data-playlist-id="${currentPlaylistId}"]`);
+    const currentName = playlistItem.data('playlist-name');
+    $('#edit-playlist-name').val(currentName);
+
+    // Mostrar o modal de edição
+    $('#editPlaylistModal').modal('show');
+  });
+
+  // Salvar a edição da playlist
+  $('#save-edit-playlist-btn').click(function() {
+    const newName = $('#edit-playlist-name').val().trim();
+    if (!newName) {
+      alert('O nome da playlist não pode estar vazio.');
+      return;
+    }
+
+    $.ajax({
+      url: SPOTI.urls.edit_playlist,
+      method: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({
+        playlist_id: currentPlaylistId,
+        new_name: newName
+      }),
+      success: function(response) {
+        if (response.status === 'success') {
+          // Atualizar o nome na interface
+          const playlistItem = $(`.playlist-item[data-playlist-id="${currentPlaylistId}"]`);
+          playlistItem.data('playlist-name', newName).text(newName);
+          $('#editPlaylistModal').modal('hide');
+          alert(response.message);
+        } else {
+          alert("Erro: " + response.message);
+        }
+      },
+      error: function(xhr) {
+        alert("Erro ao editar playlist: " + xhr.responseText);
+      }
+    });
+  });
+
+  // Clique na opção "Excluir" do menu de contexto de playlists
+  $(document).on('click', '#delete-playlist-option', function(e) {
+    e.preventDefault();
+    $('#context-menu').hide();
+
+    const playlistItem = $(`.playlist-item[data-playlist-id="${currentPlaylistId}"]`);
+    const playlistName = playlistItem.data('playlist-name');
+    $('#playlist-to-delete-name').text(playlistName);
+
+    // Mostrar o modal de confirmação
+    $('#confirmDeletePlaylistModal').modal('show');
+  });
+
+  // Confirmar exclusão da playlist
+  $('#confirm-delete-playlist-btn').click(function() {
+    $.ajax({
+      url: SPOTI.urls.delete_playlist,
+      method: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({
+        playlist_id: currentPlaylistId
+      }),
+      success: function(response) {
+        if (response.status === 'success') {
+          $(`.playlist-item[data-playlist-id="${currentPlaylistId}"]`).remove();
+          $('.music-list').hide();
+          currentCustomListName = null;
+          $('#confirmDeletePlaylistModal').modal('hide');
+          alert(response.message);
+        } else {
+          alert("Erro: " + response.message);
+        }
+      },
+      error: function(xhr) {
+        alert("Erro ao excluir playlist: " + xhr.responseText);
+      }
+    });
+  });
+
+  // ------------------------
+  //  Eventos de Contexto para Músicas: Excluir ou Remover
+  // ------------------------
+  $(document).on('click', '#delete-music-option', function(e) {
+    e.preventDefault();
+    $('#context-menu').hide();
+
+    if (!rightClickedMusic) {
+      alert("Nenhuma música selecionada para exclusão.");
+      return;
+    }
+
+    $('#music-to-delete-name').text(rightClickedMusic);
+    $('#confirmDeleteMusicModal').modal('show');
+  });
+
+  $(document).on('click', '#remove-music-option', function(e) {
+    e.preventDefault();
+    $('#context-menu').hide();
+
+    if (!rightClickedMusic) {
+      alert("Nenhuma música selecionada para remoção.");
+      return;
+    }
+
+    $('#music-to-remove-name').text(rightClickedMusic);
+    $('#confirmRemoveMusicModal').modal('show');
+  });
+
+  // Confirmar exclusão física da música
+  $('#confirm-delete-music-btn').click(function() {
+    $.ajax({
+      url: SPOTI.urls.delete_music,
+      method: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({
+        musica: rightClickedMusic
+      }),
+      success: function(response) {
+        if (response.status === 'success') {
+          $(`.list-group-item[data-musica="${rightClickedMusic}"]`).remove();
+          if (musicaAtual === rightClickedMusic) {
+            musicaAtual = null;
+            $('#player-song-title').text('Nenhuma música selecionada');
+            $('#player-artist').text('');
+            $('#audio-player source').attr('src', '');
+            $('#audio-player')[0].load();
+            $('#audio-player')[0].pause();
+            $('#download-button').attr('href', '#').attr('download', '');
+            $('.list-group-item').removeClass('selected');
+            updatePlayerFavoriteButton();
+            $('#play-pause-button i').removeClass("bi-pause-fill").addClass("bi-play-fill");
+          }
+          const favIndex = allFavoritos.indexOf(rightClickedMusic);
+          if (favIndex > -1) {
+            allFavoritos.splice(favIndex, 1);
+            $('.favorites-list').find(`.song-link[data-musica="${rightClickedMusic}"]`).closest('li').remove();
+            if ($('.favorites-list').find('li').length === 0) {
+              $('.favorites-list').append(
+                `<li class="list-group-item text-center text-muted">Nenhum favorito adicionado.</li>`
+              );
+            }
+          }
+          userPlaylists.forEach(pl => {
+            const musicIndex = pl.musicas.indexOf(rightClickedMusic);
+            if (musicIndex > -1) {
+              pl.musicas.splice(musicIndex, 1);
+            }
+          });
+          $('#confirmDeleteMusicModal').modal('hide');
+          alert(response.message);
+        } else {
+          alert("Erro: " + response.message);
+        }
+      },
+      error: function(xhr) {
+        alert("Erro ao excluir música: " + xhr.responseText);
+      }
+    });
+  });
+
+  // Confirmar remoção da música das listas
+  $('#confirm-remove-music-btn').click(function() {
+    $.ajax({
+      url: SPOTI.urls.remove_music_from_list,
+      method: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({
+        musica: rightClickedMusic
+      }),
+      success: function(response) {
+        if (response.status === 'success') {
+          $(`.list-group-item[data-musica="${rightClickedMusic}"]`).remove();
+          if (musicaAtual === rightClickedMusic) {
+            musicaAtual = null;
+            $('#player-song-title').text('Nenhuma música selecionada');
+            $('#player-artist').text('');
+            $('#audio-player source').attr('src', '');
+            $('#audio-player')[0].load();
+            $('#audio-player')[0].pause();
+            $('#download-button').attr('href', '#').attr('download', '');
+            $('.list-group-item').removeClass('selected');
+            updatePlayerFavoriteButton();
+            $('#play-pause-button i').removeClass("bi-pause-fill").addClass("bi-play-fill");
+          }
+          const favIndex = allFavoritos.indexOf(rightClickedMusic);
+          if (favIndex > -1) {
+            allFavoritos.splice(favIndex, 1);
+            $('.favorites-list').find(`.song-link[data-musica="${rightClickedMusic}"]`).closest('li').remove();
+            if ($('.favorites-list').find('li').length === 0) {
+              $('.favorites-list').append(
+                `<li class="list-group-item text-center text-muted">Nenhum favorito adicionado.</li>`
+              );
+            }
+          }
+          userPlaylists.forEach(pl => {
+            const musicIndex = pl.musicas.indexOf(rightClickedMusic);
+            if (musicIndex > -1) {
+              pl.musicas.splice(musicIndex, 1);
+            }
+          });
+          $('#confirmRemoveMusicModal').modal('hide');
+          alert(response.message);
+        } else {
+          alert("Erro: " + response.message);
+        }
+      },
+      error: function(xhr) {
+        alert("Erro ao remover música: " + xhr.responseText);
+      }
+    });
+  });
+
+  // ------------------------
+  //  Função para deletar música no servidor
+  // ------------------------
+  function deleteMusicFromServer(musica) {
+    $.ajax({
+      url: SPOTI.urls.delete_music,
+      method: "POST",
+      contentType: "application/json",
+      data: JSON.stringify({ musica: musica }),
+      success: function(response) {
+        if (response.status === 'success') {
+          $(`.list-group-item[data-musica="${musica}"]`).remove();
+          if (musicaAtual === musica) {
+            musicaAtual = null;
+            $('#player-song-title').text('Nenhuma música selecionada');
+            $('#player-artist').text('');
+            $('#audio-player source').attr('src', '');
+            $('#audio-player')[0].load();
+            $('#audio-player')[0].pause();
+            $('#download-button').attr('href', '#').attr('download', '');
+            $('.list-group-item').removeClass('selected');
+            updatePlayerFavoriteButton();
+            $('#play-pause-button i').removeClass("bi-pause-fill").addClass("bi-play-fill");
+          }
+          const favIndex = allFavoritos.indexOf(musica);
+          if (favIndex > -1) {
+            allFavoritos.splice(favIndex, 1);
+            $('.favorites-list').find(`.song-link[data-musica="${musica}"]`).closest('li').remove();
+            if ($('.favorites-list').find('li').length === 0) {
+              $('.favorites-list').append(
+                `<li class="list-group-item text-center text-muted">Nenhum favorito adicionado.</li>`
+              );
+            }
+          }
+          userPlaylists.forEach(pl => {
+            const musicIndex = pl.musicas.indexOf(musica);
+            if (musicIndex > -1) {
+              pl.musicas.splice(musicIndex, 1);
+            }
+          });
+          alert(response.message);
+        } else {
+          alert("Erro: " + response.message);
+        }
+      },
+      error: function(xhr) {
+        alert("Erro ao excluir música: " + xhr.responseText);
+      }
+    });
+  }
+
+  // ------------------------
+  //  Função para Atualizar o Botão de Favorito no Player
+  // ------------------------
+  function updatePlayerFavoriteButton() {
+    if (!musicaAtual) {
+      $('#favorite-button i').removeClass('bi-heart-fill').addClass('bi-heart');
+      return;
+    }
+    if (allFavoritos.includes(musicaAtual)) {
+      $('#favorite-button i').removeClass('bi-heart').addClass('bi-heart-fill');
+    } else {
+      $('#favorite-button i').removeClass('bi-heart-fill').addClass('bi-heart');
+    }
+  }
+
+  // Atualizar o botão de favorito ao inicializar
+  updatePlayerFavoriteButton();
+
+  // ------------------------
+  //  Barra de Progresso
+  // ------------------------
+  const audioPlayerElement = $('#audio-player')[0];
+  const progressBar = $('#progress-bar');
+  const currentTimeElement = $('#current-time');
+  const totalDurationElement = $('#total-duration');
+  const playPauseButton = $('#play-pause-button');
+  const playPauseIcon = playPauseButton.find('i');
+
+  audioPlayerElement.addEventListener('timeupdate', () => {
+    if (audioPlayerElement.duration) {
+      const currentTime = audioPlayerElement.currentTime;
+      const duration = audioPlayerElement.duration;
+
+      progressBar.val((currentTime / duration) * 100);
+      desenharFormaDeOnda();
+      currentTimeElement.text(formatTime(currentTime));
+      totalDurationElement.text(formatTime(duration));
+    }
+  });
+
+  progressBar.on('input', function() {
+    const progress = $(this).val();
+    const duration = audioPlayerElement.duration;
+    audioPlayerElement.currentTime = (progress / 100) * duration;
+  });
+
+  audioPlayerElement.addEventListener('play', () => {
+    playPauseIcon.removeClass('bi-play-fill').addClass('bi-pause-fill');
+  });
+
+  audioPlayerElement.addEventListener('pause', () => {
+    playPauseIcon.removeClass('bi-pause-fill').addClass('bi-play-fill');
+  });
+
+  function formatTime(seconds) {
+    if (isNaN(seconds)) return '0:00';
+    const minutes = Math.floor(seconds / 60);
+    const secs = Math.floor(seconds % 60);
+    return `${minutes}:${secs < 10 ? "0" : ""}${secs}`;
+  }
+
+  // ------------------------
+  //  Controle de Volume
+  // ------------------------
+  const volumeBar = $('#volume-bar');
+  volumeBar.val(100);
+  audioPlayerElement.volume = 1.0;
+
+  volumeBar.on('input', function() {
+    const volume = $(this).val();
+    audioPlayerElement.volume = volume / 100;
+  });
+
+  // -----------------------------------------------------
+  // Botão "Baixar toda a lista"
+  // -----------------------------------------------------
+  $('#download-all-button').click(function(){
+    if (isShowingFavorites) {
+      // Está nos favoritos
+      window.location.href = "/download_all?context=favorites";
+    } else if (currentCustomListName) {
+      // Está em uma playlist
+      window.location.href = "/download_all?context=playlist&playlistName=" + encodeURIComponent(currentCustomListName);
+    } else {
+      // Lista de músicas normal (todas)
+      window.location.href = "/download_all?context=all";
+    }
+  });
+
+  // -----------------------------------------------------
+  // Se a .favorites-list estiver visível (rota /favorites),
+  // define isShowingFavorites como true ao carregar:
+  // -----------------------------------------------------
+  if ($('.favorites-list').is(':visible')) {
+    isShowingFavorites = true;
+  }
+});
+
+function updatePlayerFavoriteButton() {
+  if (!musicaAtual) {
+    $('#favorite-button i').removeClass('bi-heart-fill').addClass('bi-heart');
+    return;
+  }
+  if (allFavoritos.includes(musicaAtual)) {
+    $('#favorite-button i').removeClass('bi-heart').addClass('bi-heart-fill');
+  } else {
+    $('#favorite-button i').removeClass('bi-heart-fill').addClass('bi-heart');
+  }
+}
@@ -41,10 +41,12 @@ CREATE TABLE IF NOT EXISTS `config` (
 CREATE TABLE IF NOT EXISTS `favorites` (
   `id` int NOT NULL AUTO_INCREMENT,
   `usuario` varchar(50) NOT NULL,
-  `musica` varchar(255) NOT NULL,
+  `track_id` int NOT NULL,
   PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_favorites_usuario_track` (`usuario`,`track_id`),
   KEY `idx_usuario` (`usuario`),
-  KEY `idx_musica` (`musica`)
+  KEY `fk_favorites_track` (`track_id`),
+  CONSTRAINT `fk_favorites_track` FOREIGN KEY (`track_id`) REFERENCES `track` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=810 DEFAULT CHARSET=utf8mb3;
 
 -- Exportação de dados foi desmarcado.
@@ -55,11 +57,71 @@ CREATE TABLE IF NOT EXISTS `fila` (
   `usuario` varchar(50) NOT NULL,
   `caminho` varchar(255) NOT NULL,
   `status` varchar(50) NOT NULL,
-  PRIMARY KEY (`id`)
+  `prioridade` int NOT NULL DEFAULT '0',
+  `tamanho` int DEFAULT NULL,
+  `criado_em` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  `tentativas` int NOT NULL DEFAULT '0',
+  `proxima_tentativa` datetime DEFAULT NULL,
+  `atualizado_em` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_fila_status` (`status`,`id`),
+  KEY `idx_fila_usuario` (`usuario`,`id`),
+  KEY `idx_fila_agenda` (`status`,`usuario`,`prioridade` DESC,`tamanho`,`id`),
+  KEY `idx_fila_usuario_status` (`usuario`,`status`,`id`),
+  KEY `idx_fila_status_atualizado` (`status`,`atualizado_em`)
 ) ENGINE=InnoDB AUTO_INCREMENT=25 DEFAULT CHARSET=utf8mb3;
 
 -- Exportação de dados foi desmarcado.
 
+-- Copiando estrutura para tabela usuario.fila_entrada
+CREATE TABLE IF NOT EXISTS `fila_entrada` (
+  `fila_id` int NOT NULL,
+  `source_id` varchar(64) NOT NULL,
+  `posicao` int NOT NULL,
+  `status` varchar(20) NOT NULL DEFAULT 'pendente',
+  `tentativas` int NOT NULL DEFAULT '0',
+  PRIMARY KEY (`fila_id`,`source_id`),
+  CONSTRAINT `fk_fila_entrada_fila` FOREIGN KEY (`fila_id`) REFERENCES `fila` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- Exportação de dados foi desmarcado.
+
+-- Copiando estrutura para tabela usuario.fila_historico
+CREATE TABLE IF NOT EXISTS `fila_historico` (
+  `id` int NOT NULL,
+  `usuario` varchar(50) NOT NULL,
+  `caminho` varchar(255) NOT NULL,
+  `status` varchar(50) NOT NULL,
+  `prioridade` int NOT NULL DEFAULT '0',
+  `tamanho` int DEFAULT NULL,
+  `tentativas` int NOT NULL DEFAULT '0',
+  `criado_em` timestamp NULL DEFAULT NULL,
+  `concluido_em` timestamp NULL DEFAULT NULL,
+  `arquivado_em` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  KEY `idx_fila_historico_usuario` (`usuario`,`id`),
+  KEY `idx_fila_historico_usuario_status` (`usuario`,`status`,`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- Exportação de dados foi desmarcado.
+
+-- Copiando estrutura para tabela usuario.media_store
+CREATE TABLE IF NOT EXISTS `media_store` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `source_id` varchar(64) NOT NULL,
+  `perfil` varchar(32) NOT NULL,
+  `arquivo` varchar(512) NOT NULL,
+  `capa` varchar(512) DEFAULT NULL,
+  `nome_arquivo` varchar(255) NOT NULL,
+  `size` bigint DEFAULT NULL,
+  `metadados` text,
+  `criado_em` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_media_source_perfil` (`source_id`,`perfil`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- Exportação de dados foi desmarcado.
+
 -- Copiando estrutura para tabela usuario.playlist
 CREATE TABLE IF NOT EXISTS `playlist` (
   `id` int NOT NULL AUTO_INCREMENT,
@@ -67,6 +129,7 @@ CREATE TABLE IF NOT EXISTS `playlist` (
   `nome` varchar(255) NOT NULL,
   PRIMARY KEY (`id`),
   KEY `fk_playlist_usuario` (`usuario`),
+  KEY `idx_playlist_usuario_nome` (`usuario`,`nome`),
   CONSTRAINT `fk_playlist_usuario` FOREIGN KEY (`usuario`) REFERENCES `usuario` (`usuario`) ON DELETE CASCADE ON UPDATE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=8 DEFAULT CHARSET=utf8mb3;
 
@@ -76,14 +139,61 @@ CREATE TABLE IF NOT EXISTS `playlist` (
 CREATE TABLE IF NOT EXISTS `playlist_musica` (
   `id` int NOT NULL AUTO_INCREMENT,
   `playlist_id` int NOT NULL,
-  `musica` varchar(255) NOT NULL,
+  `track_id` int NOT NULL,
   PRIMARY KEY (`id`),
-  KEY `fk_playlist_musica_playlist` (`playlist_id`),
-  CONSTRAINT `fk_playlist_musica_playlist` FOREIGN KEY (`playlist_id`) REFERENCES `playlist` (`id`) ON DELETE CASCADE ON UPDATE CASCADE
+  UNIQUE KEY `uq_playlist_musica_track` (`playlist_id`,`track_id`),
+  KEY `fk_playlist_musica_track` (`track_id`),
+  CONSTRAINT `fk_playlist_musica_playlist` FOREIGN KEY (`playlist_id`) REFERENCES `playlist` (`id`) ON DELETE CASCADE ON UPDATE CASCADE,
+  CONSTRAINT `fk_playlist_musica_track` FOREIGN KEY (`track_id`) REFERENCES `track` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=21 DEFAULT CHARSET=utf8mb3;
 
 -- Exportação de dados foi desmarcado.
 
+-- Copiando estrutura para tabela usuario.schema_migrations
+CREATE TABLE IF NOT EXISTS `schema_migrations` (
+  `version` int NOT NULL,
+  `nome` varchar(255) NOT NULL,
+  `aplicada_em` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`version`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- Exportação de dados foi desmarcado.
+
+-- Copiando estrutura para tabela usuario.track
+CREATE TABLE IF NOT EXISTS `track` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `usuario` varchar(255) NOT NULL,
+  `filename` varchar(255) NOT NULL,
+  `size` bigint DEFAULT NULL,
+  `mtime` double DEFAULT NULL,
+  `duration` float DEFAULT NULL,
+  `title` varchar(255) DEFAULT NULL,
+  `artist` varchar(255) DEFAULT NULL,
+  `album` varchar(255) DEFAULT NULL,
+  `track_number` int DEFAULT NULL,
+  `year` smallint DEFAULT NULL,
+  `source_id` varchar(64) DEFAULT NULL,
+  `metadata_mtime` double DEFAULT NULL,
+  `media_id` int DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uq_track_usuario_filename` (`usuario`,`filename`),
+  KEY `idx_track_usuario_album` (`usuario`,`album`),
+  KEY `idx_track_usuario_artist` (`usuario`,`artist`),
+  KEY `idx_track_media` (`media_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- Exportação de dados foi desmarcado.
+
+-- Copiando estrutura para tabela usuario.uso_armazenamento
+CREATE TABLE IF NOT EXISTS `uso_armazenamento` (
+  `usuario` varchar(255) NOT NULL,
+  `bytes` bigint NOT NULL DEFAULT '0',
+  `reconciliado_em` timestamp NULL DEFAULT NULL,
+  PRIMARY KEY (`usuario`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb3;
+
+-- Exportação de dados foi desmarcado.
+
 -- Copiando estrutura para tabela usuario.usuario
 CREATE TABLE IF NOT EXISTS `usuario` (
   `id` int NOT NULL AUTO_INCREMENT,
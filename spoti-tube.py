@@ -1,27 +1,82 @@
 import os
+import argparse
 import json
+import atexit
 import random
+import sys
 import time
 import threading
 import mysql.connector
 import yt_dlp
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from yt_dlp.postprocessor import PostProcessor, MetadataParserPP
+from yt_dlp.extractor.common import InfoExtractor
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 from flask import (
     Flask, render_template, request, redirect,
-    url_for, session, flash, send_from_directory, jsonify, send_file
+    url_for, session, flash, send_from_directory, jsonify, send_file,
+    Response, stream_with_context, abort, make_response,
+    before_render_template, template_rendered
 )
+from markupsafe import Markup
+from jinja2 import pass_context
+from werkzeug.security import safe_join
 import logging
+import logging.handlers
 import queue
 import requests  # Para enviar requisições HTTP para desligar o Flask
 from io import BytesIO
 import zipfile
+import hashlib
+import cProfile
+import marshal
+import mmap
+import zlib
+import mimetypes
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import wave
+import http.server
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial, lru_cache
+from contextlib import contextmanager
+import numpy as np
+import gzip
+try:
+    import brotli  # opcional: sem ele, só gzip
+except ImportError:
+    brotli = None
+try:
+    import fcntl  # opcional: sem ele (Windows), o cache compartilhado fica desativado
+except ImportError:
+    fcntl = None
 
 #############################################################################
 #                         CONFIGURAÇÃO DE LOG
 #############################################################################
 
-log_queue = queue.Queue()
+LOG_QUEUE_MAXSIZE = 5000
+LOG_GUI_MAX_LINES = 2000
+
+# Fila limitada consumida pela interface Tkinter: sem GUI drenando, os
+# registros mais antigos são descartados em vez de acumular para sempre.
+log_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+
+# Fila sem formatação: as threads de requisição/download só entregam o
+# registro; a formatação e a escrita acontecem na thread do listener.
+log_record_queue = queue.SimpleQueue()
+
+DEFAULT_LOG_LEVELS = {
+    'yt_dlp': 'WARNING',
+    'werkzeug': 'INFO',
+    'urllib3': 'WARNING',
+    'mysql.connector': 'WARNING',
+}
 
 class TkinterHandler(logging.Handler):
     def __init__(self, log_queue):
@@ -29,14 +84,141 @@ class TkinterHandler(logging.Handler):
         self.log_queue = log_queue
 
     def emit(self, record):
-        self.log_queue.put(self.format(record))
+        msg = self.format(record)
+        try:
+            self.log_queue.put_nowait(msg)
+        except queue.Full:
+            try:
+                self.log_queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self.log_queue.put_nowait(msg)
+            except queue.Full:
+                pass
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Entrega o registro ao listener sem formatá-lo na thread chamadora."""
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Formata cada registro como uma linha JSON (logs estruturados)."""
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
 
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+logger.setLevel(logging.INFO)
 log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 tk_handler = TkinterHandler(log_queue)
 tk_handler.setFormatter(log_formatter)
-logger.addHandler(tk_handler)
+logger.addHandler(RecordQueueHandler(log_record_queue))
+for _nome_logger, _nivel in DEFAULT_LOG_LEVELS.items():
+    logging.getLogger(_nome_logger).setLevel(_nivel)
+
+log_listener = logging.handlers.QueueListener(log_record_queue, tk_handler, respect_handler_level=True)
+log_listener.start()
+_log_listener_ativo = True
+_log_settings_aplicados = None
+_log_no_console = False
+
+def parar_logging():
+    """Esvazia a fila de registros e encerra o listener de log."""
+    global _log_listener_ativo
+    if _log_listener_ativo:
+        _log_listener_ativo = False
+        log_listener.stop()
+
+atexit.register(parar_logging)
+
+def configurar_logging():
+    """
+    Aplica as configurações de log (nível raiz, níveis por módulo, arquivo
+    rotativo e formato JSON) recriando os handlers do listener em background.
+    """
+    global log_listener, _log_listener_ativo, _log_settings_aplicados
+    levels = dict(DEFAULT_LOG_LEVELS)
+    levels.update(config.log_levels or {})
+    settings = (
+        config.log_level, config.log_file, config.log_json,
+        config.log_max_bytes, config.log_backup_count,
+        tuple(sorted(levels.items())), _log_no_console
+    )
+    if settings == _log_settings_aplicados:
+        return
+
+    try:
+        logger.setLevel(str(config.log_level).upper())
+        for nome_logger, nivel in levels.items():
+            logging.getLogger(nome_logger).setLevel(str(nivel).upper())
+    except ValueError as e:
+        logger.error(f"Nível de log inválido na configuração: {e}")
+
+    handlers = [tk_handler]
+    if _log_no_console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(log_formatter)
+        handlers.append(console_handler)
+    if config.log_file:
+        try:
+            file_handler = logging.handlers.RotatingFileHandler(
+                config.log_file,
+                maxBytes=config.log_max_bytes,
+                backupCount=config.log_backup_count,
+                encoding='utf-8'
+            )
+            file_handler.setFormatter(JsonFormatter() if config.log_json else log_formatter)
+            handlers.append(file_handler)
+        except OSError as e:
+            logger.error(f"Erro ao abrir arquivo de log '{config.log_file}': {e}")
+
+    antigo = log_listener
+    parar_logging()
+    for handler in antigo.handlers:
+        if handler is not tk_handler:
+            handler.close()
+    log_listener = logging.handlers.QueueListener(log_record_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+    _log_listener_ativo = True
+    _log_settings_aplicados = settings
+
+def ativar_log_no_console():
+    """Envia os logs também para o terminal (comandos sem interface gráfica)."""
+    global _log_no_console
+    _log_no_console = True
+    configurar_logging()
+
+class YtDlpLogger:
+    """Encaminha as mensagens do yt-dlp para o logger 'yt_dlp'."""
+    def __init__(self):
+        self.log = logging.getLogger('yt_dlp')
+
+    def debug(self, msg):
+        # O yt-dlp envia mensagens de progresso como debug; descartadas cedo
+        # se o nível configurado para 'yt_dlp' não as aceitar.
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug(msg)
+
+    def info(self, msg):
+        self.log.info(msg)
+
+    def warning(self, msg):
+        self.log.warning(msg)
+
+    def error(self, msg):
+        self.log.error(msg)
 
 #############################################################################
 #                         CLASSE DE CONFIGURAÇÃO
@@ -52,6 +234,47 @@ class Config:
         self.ffmpeg_path = ''
         self.file_path = ''
         self.flask_port = 5000
+        self.log_file = 'spoti-tube.log'
+        self.log_level = 'INFO'
+        self.log_json = False
+        self.log_max_bytes = 5 * 1024 * 1024
+        self.log_backup_count = 5
+        self.log_levels = {}
+        self.cache_ttl = 300
+        self.cache_max_bytes = 32 * 1024 * 1024
+        self.fragment_cache_max_bytes = 16 * 1024 * 1024
+        self.metadata_cache_ttl = 900
+        self.shared_cache_path = ''
+        self.media_store_path = ''
+        self.transcode_cache_path = ''
+        self.transcode_cache_max_bytes = 2 * 1024 * 1024 * 1024
+        self.audio_profile = 'mp3-192'
+        self.peaks_path = ''
+        self.library_snapshot_path = ''
+        self.library_scan_workers = 4
+        self.admin_users = []
+        # Limites de banda dos downloads em bytes/s (0 = sem limite)
+        self.download_rate_limit = 0
+        self.download_job_rate_limit = 0
+        self.download_rate_limit_streaming = 0
+        self.download_rate_schedule = []
+        self.download_workers = 2
+        self.queue_user_weights = {}
+        self.download_max_retries = 5
+        self.download_retry_backoff = 30
+        self.queue_archive_after_days = 7
+        # Perfilamento: % de requisições/jobs com cProfile e limites do log de lentidão
+        self.profile_sample_percent = 0
+        self.profile_path = ''
+        self.slow_request_ms = 1000
+        self.slow_job_seconds = 900
+        # Rastreamento de consultas: orçamento por requisição e repetições que sugerem N+1
+        self.query_budget = 25
+        self.query_repeat_threshold = 5
+        # Cotas de armazenamento em bytes (0 = sem limite) e intervalo da reconciliação
+        self.storage_quota_bytes = 0
+        self.storage_user_quotas = {}
+        self.storage_reconcile_interval = 3600
 
 config = Config()
 
@@ -76,6 +299,49 @@ def load_db_config():
             config.ffmpeg_path = data.get('ffmpeg_path', '')
             config.file_path = data.get('file_path', '')
             config.flask_port = data.get('flask_port', 5000)
+            config.log_file = data.get('log_file', 'spoti-tube.log')
+            config.log_level = data.get('log_level', 'INFO')
+            config.log_json = data.get('log_json', False)
+            config.log_max_bytes = data.get('log_max_bytes', 5 * 1024 * 1024)
+            config.log_backup_count = data.get('log_backup_count', 5)
+            config.log_levels = data.get('log_levels', {})
+            config.cache_ttl = data.get('cache_ttl', 300)
+            config.cache_max_bytes = data.get('cache_max_bytes', 32 * 1024 * 1024)
+            config.fragment_cache_max_bytes = data.get('fragment_cache_max_bytes', 16 * 1024 * 1024)
+            config.metadata_cache_ttl = data.get('metadata_cache_ttl', 900)
+            config.shared_cache_path = data.get('shared_cache_path', '')
+            config.media_store_path = data.get('media_store_path', '')
+            config.transcode_cache_path = data.get('transcode_cache_path', '')
+            config.transcode_cache_max_bytes = data.get('transcode_cache_max_bytes', 2 * 1024 * 1024 * 1024)
+            config.audio_profile = data.get('audio_profile', 'mp3-192')
+            config.peaks_path = data.get('peaks_path', '')
+            config.library_snapshot_path = data.get('library_snapshot_path', '')
+            config.library_scan_workers = data.get('library_scan_workers', 4)
+            config.admin_users = data.get('admin_users', [])
+            config.download_rate_limit = data.get('download_rate_limit', 0)
+            config.download_job_rate_limit = data.get('download_job_rate_limit', 0)
+            config.download_rate_limit_streaming = data.get('download_rate_limit_streaming', 0)
+            config.download_rate_schedule = data.get('download_rate_schedule', [])
+            config.download_workers = data.get('download_workers', 2)
+            config.queue_user_weights = data.get('queue_user_weights', {})
+            config.download_max_retries = data.get('download_max_retries', 5)
+            config.download_retry_backoff = data.get('download_retry_backoff', 30)
+            config.queue_archive_after_days = data.get('queue_archive_after_days', 7)
+            config.profile_sample_percent = data.get('profile_sample_percent', 0)
+            config.profile_path = data.get('profile_path', '')
+            config.slow_request_ms = data.get('slow_request_ms', 1000)
+            config.slow_job_seconds = data.get('slow_job_seconds', 900)
+            config.query_budget = data.get('query_budget', 25)
+            config.query_repeat_threshold = data.get('query_repeat_threshold', 5)
+            config.storage_quota_bytes = data.get('storage_quota_bytes', 0)
+            config.storage_user_quotas = data.get('storage_user_quotas', {})
+            config.storage_reconcile_interval = data.get('storage_reconcile_interval', 3600)
+        configurar_logging()
+        library_cache.configurar(config.cache_ttl, config.cache_max_bytes)
+        library_cache.compartilhar(config.shared_cache_path)
+        metadata_cache.configurar(config.metadata_cache_ttl, RESOLUCAO_MAX_BYTES)
+        metadata_cache.compartilhar(config.shared_cache_path)
+        fragment_cache.configurar(FRAGMENTO_TTL, config.fragment_cache_max_bytes)
         logger.info("Configurações de banco de dados carregadas do arquivo.")
         return True
     except Exception as e:
@@ -93,7 +359,44 @@ def save_db_config():
             'dbname': config.dbname,
             'ffmpeg_path': config.ffmpeg_path,
             'file_path': config.file_path,
-            'flask_port': config.flask_port
+            'flask_port': config.flask_port,
+            'log_file': config.log_file,
+            'log_level': config.log_level,
+            'log_json': config.log_json,
+            'log_max_bytes': config.log_max_bytes,
+            'log_backup_count': config.log_backup_count,
+            'log_levels': config.log_levels,
+            'cache_ttl': config.cache_ttl,
+            'cache_max_bytes': config.cache_max_bytes,
+            'fragment_cache_max_bytes': config.fragment_cache_max_bytes,
+            'metadata_cache_ttl': config.metadata_cache_ttl,
+            'shared_cache_path': config.shared_cache_path,
+            'media_store_path': config.media_store_path,
+            'transcode_cache_path': config.transcode_cache_path,
+            'transcode_cache_max_bytes': config.transcode_cache_max_bytes,
+            'audio_profile': config.audio_profile,
+            'peaks_path': config.peaks_path,
+            'library_snapshot_path': config.library_snapshot_path,
+            'library_scan_workers': config.library_scan_workers,
+            'admin_users': config.admin_users,
+            'download_rate_limit': config.download_rate_limit,
+            'download_job_rate_limit': config.download_job_rate_limit,
+            'download_rate_limit_streaming': config.download_rate_limit_streaming,
+            'download_rate_schedule': config.download_rate_schedule,
+            'download_workers': config.download_workers,
+            'queue_user_weights': config.queue_user_weights,
+            'download_max_retries': config.download_max_retries,
+            'download_retry_backoff': config.download_retry_backoff,
+            'queue_archive_after_days': config.queue_archive_after_days,
+            'profile_sample_percent': config.profile_sample_percent,
+            'profile_path': config.profile_path,
+            'slow_request_ms': config.slow_request_ms,
+            'slow_job_seconds': config.slow_job_seconds,
+            'query_budget': config.query_budget,
+            'query_repeat_threshold': config.query_repeat_threshold,
+            'storage_quota_bytes': config.storage_quota_bytes,
+            'storage_user_quotas': config.storage_user_quotas,
+            'storage_reconcile_interval': config.storage_reconcile_interval
         }
         with open(CONFIG_FILE, 'w') as f:
             json.dump(data, f, indent=4)
@@ -294,6 +597,426 @@ def save_config_to_db():
     except Exception as e:
         logger.error(f"Erro inesperado ao salvar configurações no banco de dados: {e}")
 
+#############################################################################
+#                         MIGRAÇÕES DE ESQUEMA
+#############################################################################
+
+def _colunas_da_tabela(cursor, tabela):
+    cursor.execute(f"DESCRIBE {tabela}")
+    return {row[0] for row in cursor.fetchall()}
+
+def _indices_da_tabela(cursor, tabela):
+    cursor.execute(f"SHOW INDEX FROM {tabela}")
+    return {row[2] for row in cursor.fetchall()}
+
+def _migracao_tabela_track(conn, cursor):
+    """
+    Cria a tabela 'track' e migra 'favorites' e 'playlist_musica' do nome do
+    arquivo (musica) para a chave inteira track_id.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS track (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            usuario VARCHAR(255) NOT NULL,
+            filename VARCHAR(255) NOT NULL,
+            size BIGINT DEFAULT NULL,
+            mtime DOUBLE DEFAULT NULL,
+            duration FLOAT DEFAULT NULL,
+            UNIQUE KEY uq_track_usuario_filename (usuario, filename)
+        )
+    """)
+    conn.commit()
+
+    # favorites: (usuario, musica) -> (usuario, track_id)
+    colunas = _colunas_da_tabela(cursor, 'favorites')
+    if 'track_id' not in colunas:
+        cursor.execute("ALTER TABLE favorites ADD COLUMN track_id INT NULL")
+    if 'musica' in colunas:
+        cursor.execute("""
+            INSERT IGNORE INTO track (usuario, filename)
+            SELECT DISTINCT usuario, musica FROM favorites
+        """)
+        cursor.execute("""
+            UPDATE favorites f
+            JOIN track t ON t.usuario = f.usuario AND t.filename = f.musica
+            SET f.track_id = t.id
+            WHERE f.track_id IS NULL
+        """)
+        cursor.execute("""
+            DELETE f1 FROM favorites f1
+            JOIN favorites f2
+              ON f1.usuario = f2.usuario AND f1.track_id = f2.track_id AND f1.id > f2.id
+        """)
+        cursor.execute("DELETE FROM favorites WHERE track_id IS NULL")
+        conn.commit()
+        cursor.execute("ALTER TABLE favorites DROP COLUMN musica")
+        logger.info("Tabela 'favorites' migrada para track_id.")
+    indices = _indices_da_tabela(cursor, 'favorites')
+    if 'uq_favorites_usuario_track' not in indices:
+        cursor.execute("""
+            ALTER TABLE favorites
+            MODIFY track_id INT NOT NULL,
+            ADD UNIQUE KEY uq_favorites_usuario_track (usuario, track_id),
+            ADD CONSTRAINT fk_favorites_track FOREIGN KEY (track_id)
+                REFERENCES track (id) ON DELETE CASCADE
+        """)
+
+    # playlist_musica: (playlist_id, musica) -> (playlist_id, track_id)
+    colunas = _colunas_da_tabela(cursor, 'playlist_musica')
+    if 'track_id' not in colunas:
+        cursor.execute("ALTER TABLE playlist_musica ADD COLUMN track_id INT NULL")
+    if 'musica' in colunas:
+        cursor.execute("""
+            INSERT IGNORE INTO track (usuario, filename)
+            SELECT DISTINCT p.usuario, pm.musica
+            FROM playlist_musica pm JOIN playlist p ON p.id = pm.playlist_id
+        """)
+        cursor.execute("""
+            UPDATE playlist_musica pm
+            JOIN playlist p ON p.id = pm.playlist_id
+            JOIN track t ON t.usuario = p.usuario AND t.filename = pm.musica
+            SET pm.track_id = t.id
+            WHERE pm.track_id IS NULL
+        """)
+        cursor.execute("""
+            DELETE pm1 FROM playlist_musica pm1
+            JOIN playlist_musica pm2
+              ON pm1.playlist_id = pm2.playlist_id AND pm1.track_id = pm2.track_id AND pm1.id > pm2.id
+        """)
+        cursor.execute("DELETE FROM playlist_musica WHERE track_id IS NULL")
+        conn.commit()
+        cursor.execute("ALTER TABLE playlist_musica DROP COLUMN musica")
+        logger.info("Tabela 'playlist_musica' migrada para track_id.")
+    indices = _indices_da_tabela(cursor, 'playlist_musica')
+    if 'uq_playlist_musica_track' not in indices:
+        cursor.execute("""
+            ALTER TABLE playlist_musica
+            MODIFY track_id INT NOT NULL,
+            ADD UNIQUE KEY uq_playlist_musica_track (playlist_id, track_id),
+            ADD CONSTRAINT fk_playlist_musica_track FOREIGN KEY (track_id)
+                REFERENCES track (id) ON DELETE CASCADE
+        """)
+
+def _criar_indice(cursor, tabela, nome, colunas):
+    if nome in _indices_da_tabela(cursor, tabela):
+        return
+    cursor.execute(f"ALTER TABLE {tabela} ADD INDEX {nome} ({colunas})")
+    logger.info(f"Índice '{nome}' adicionado à tabela '{tabela}'.")
+
+def _migracao_indices_hot_path(conn, cursor):
+    """Índices das consultas executadas a cada requisição/ciclo da fila."""
+    # manutencao_da_fila / listar_fila_admin (filtros por status)
+    _criar_indice(cursor, 'fila', 'idx_fila_status', 'status, id')
+    # listar_fila
+    _criar_indice(cursor, 'fila', 'idx_fila_usuario', 'usuario, id')
+    # criar_playlist / get_playlist_id
+    _criar_indice(cursor, 'playlist', 'idx_playlist_usuario_nome', 'usuario, nome')
+
+def _migracao_metadados_track(conn, cursor):
+    """Colunas de metadados de áudio (tags) e índices de navegação."""
+    colunas = _colunas_da_tabela(cursor, 'track')
+    novas = {
+        'title': 'VARCHAR(255) DEFAULT NULL',
+        'artist': 'VARCHAR(255) DEFAULT NULL',
+        'album': 'VARCHAR(255) DEFAULT NULL',
+        'track_number': 'INT DEFAULT NULL',
+        'year': 'SMALLINT DEFAULT NULL',
+        'source_id': 'VARCHAR(64) DEFAULT NULL',
+        'metadata_mtime': 'DOUBLE DEFAULT NULL',
+    }
+    for coluna, tipo in novas.items():
+        if coluna not in colunas:
+            cursor.execute(f"ALTER TABLE track ADD COLUMN {coluna} {tipo}")
+    _criar_indice(cursor, 'track', 'idx_track_usuario_album', 'usuario, album')
+    _criar_indice(cursor, 'track', 'idx_track_usuario_artist', 'usuario, artist')
+
+def _migracao_acervo_compartilhado(conn, cursor):
+    """Acervo de mídia compartilhado entre usuários (endereçado por conteúdo)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS media_store (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            source_id VARCHAR(64) NOT NULL,
+            perfil VARCHAR(32) NOT NULL,
+            arquivo VARCHAR(512) NOT NULL,
+            capa VARCHAR(512) DEFAULT NULL,
+            nome_arquivo VARCHAR(255) NOT NULL,
+            size BIGINT DEFAULT NULL,
+            metadados TEXT,
+            criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_media_source_perfil (source_id, perfil)
+        )
+    """)
+    if 'media_id' not in _colunas_da_tabela(cursor, 'track'):
+        cursor.execute("ALTER TABLE track ADD COLUMN media_id INT DEFAULT NULL")
+    _criar_indice(cursor, 'track', 'idx_track_media', 'media_id')
+
+def _migracao_agendamento_fila(conn, cursor):
+    """Prioridade, tamanho estimado e índice do agendador da fila."""
+    colunas = _colunas_da_tabela(cursor, 'fila')
+    novas = {
+        'prioridade': 'INT NOT NULL DEFAULT 0',
+        'tamanho': 'INT DEFAULT NULL',
+        'criado_em': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP',
+    }
+    for coluna, tipo in novas.items():
+        if coluna not in colunas:
+            cursor.execute(f"ALTER TABLE fila ADD COLUMN {coluna} {tipo}")
+    # usuarios_em_fila / cabeca_da_fila_do_usuario
+    _criar_indice(cursor, 'fila', 'idx_fila_agenda', 'status, usuario, prioridade DESC, tamanho, id')
+
+def _migracao_jobs_retomaveis(conn, cursor):
+    """Estado por entrada dos jobs, tentativas e sinal de vida dos workers."""
+    colunas = _colunas_da_tabela(cursor, 'fila')
+    novas = {
+        'tentativas': 'INT NOT NULL DEFAULT 0',
+        'proxima_tentativa': 'DATETIME DEFAULT NULL',
+        'atualizado_em': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP',
+    }
+    for coluna, tipo in novas.items():
+        if coluna not in colunas:
+            cursor.execute(f"ALTER TABLE fila ADD COLUMN {coluna} {tipo}")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fila_entrada (
+            fila_id INT NOT NULL,
+            source_id VARCHAR(64) NOT NULL,
+            posicao INT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pendente',
+            tentativas INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (fila_id, source_id),
+            CONSTRAINT fk_fila_entrada_fila FOREIGN KEY (fila_id) REFERENCES fila (id) ON DELETE CASCADE
+        )
+    """)
+
+def _migracao_historico_fila(conn, cursor):
+    """Histórico dos jobs encerrados e índices da listagem paginada."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fila_historico (
+            id INT PRIMARY KEY,
+            usuario VARCHAR(50) NOT NULL,
+            caminho VARCHAR(255) NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            prioridade INT NOT NULL DEFAULT 0,
+            tamanho INT DEFAULT NULL,
+            tentativas INT NOT NULL DEFAULT 0,
+            criado_em TIMESTAMP NULL DEFAULT NULL,
+            concluido_em TIMESTAMP NULL DEFAULT NULL,
+            arquivado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_fila_historico_usuario (usuario, id),
+            KEY idx_fila_historico_usuario_status (usuario, status, id)
+        )
+    """)
+    # listar_fila_paginada com filtro de status / resumo_da_fila
+    _criar_indice(cursor, 'fila', 'idx_fila_usuario_status', 'usuario, status, id')
+    # arquivar_fila
+    _criar_indice(cursor, 'fila', 'idx_fila_status_atualizado', 'status, atualizado_em')
+
+def _migracao_uso_armazenamento(conn, cursor):
+    """Uso de armazenamento por usuário, inicializado a partir da tabela track."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS uso_armazenamento (
+            usuario VARCHAR(255) PRIMARY KEY,
+            bytes BIGINT NOT NULL DEFAULT 0,
+            reconciliado_em TIMESTAMP NULL DEFAULT NULL
+        )
+    """)
+    cursor.execute("""
+        INSERT IGNORE INTO uso_armazenamento (usuario, bytes, reconciliado_em)
+        SELECT usuario, COALESCE(SUM(size), 0), NOW() FROM track GROUP BY usuario
+    """)
+
+# Migrações versionadas: cada versão é aplicada uma única vez e registrada em
+# schema_migrations. Novas migrações entram sempre no fim da lista.
+MIGRACOES = [
+    (1, 'tabela track e track_id em favorites/playlist_musica', _migracao_tabela_track),
+    (2, 'índices de fila e playlist', _migracao_indices_hot_path),
+    (3, 'metadados de áudio na tabela track', _migracao_metadados_track),
+    (4, 'acervo de mídia compartilhado', _migracao_acervo_compartilhado),
+    (5, 'prioridade e agendamento justo da fila', _migracao_agendamento_fila),
+    (6, 'jobs de download retomáveis', _migracao_jobs_retomaveis),
+    (7, 'histórico da fila e listagem paginada', _migracao_historico_fila),
+    (8, 'uso de armazenamento por usuário', _migracao_uso_armazenamento),
+]
+
+def aplicar_migracoes():
+    """
+    Aplica as migrações pendentes em ordem, registrando cada versão aplicada.
+    Um lock nomeado do MySQL impede que dois processos migrem ao mesmo tempo.
+    Retorna True se o esquema ficou atualizado.
+    """
+    try:
+        conn = get_db_connection_dynamic()
+    except mysql.connector.Error as err:
+        logger.error(f"Erro ao conectar ao banco para aplicar migrações: {err}")
+        return False
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK('spoti_tube_migracoes', 60)")
+        (lock_ok,) = cursor.fetchone()
+        if not lock_ok:
+            logger.error("Não foi possível obter o lock de migrações.")
+            return False
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                nome VARCHAR(255) NOT NULL,
+                aplicada_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        aplicadas = {row[0] for row in cursor.fetchall()}
+        for versao, nome, migracao in MIGRACOES:
+            if versao in aplicadas:
+                continue
+            logger.info(f"Aplicando migração {versao}: {nome}...")
+            migracao(conn, cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, nome) VALUES (%s, %s)",
+                           (versao, nome))
+            conn.commit()
+            logger.info(f"Migração {versao} aplicada.")
+        return True
+    except mysql.connector.Error as err:
+        conn.rollback()
+        logger.error(f"Erro ao aplicar migrações: {err}")
+        return False
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro inesperado ao aplicar migrações: {e}")
+        return False
+    finally:
+        try:
+            cursor.execute("SELECT RELEASE_LOCK('spoti_tube_migracoes')")
+            cursor.fetchall()
+            cursor.close()
+        finally:
+            conn.close()
+
+# Consultas do hot path. As funções de acesso ao banco e o EXPLAIN de
+# verificar_planos_de_consulta usam as mesmas strings, para não divergirem.
+SQL_CABECAS_DA_FILA = """
+    SELECT id, usuario, caminho, prioridade, tamanho FROM (
+        SELECT id, usuario, caminho, prioridade, tamanho,
+               ROW_NUMBER() OVER (PARTITION BY usuario ORDER BY prioridade DESC, tamanho, id) AS posicao
+        FROM fila WHERE status = %s
+    ) AS fila_por_usuario
+    WHERE posicao = 1
+"""
+SQL_FILA_PAGINADA = (
+    "(SELECT id, usuario, caminho, status FROM fila WHERE {filtros} ORDER BY id DESC LIMIT %s) "
+    "UNION ALL "
+    "(SELECT id, usuario, caminho, status FROM fila_historico WHERE {filtros} ORDER BY id DESC LIMIT %s) "
+    "ORDER BY id DESC LIMIT %s"
+)
+SQL_RESUMO_DA_FILA = "SELECT status, COUNT(*) FROM {tabela} WHERE usuario = %s GROUP BY status"
+SQL_JOBS_A_ARQUIVAR = """
+    SELECT id FROM fila WHERE status IN ('Baixado', 'Erro')
+    AND atualizado_em < NOW() - INTERVAL %s DAY LIMIT %s
+"""
+SQL_FAVORITOS = """SELECT t.filename FROM favorites f
+                   JOIN track t ON t.id = f.track_id
+                   WHERE f.usuario = %s
+                   ORDER BY f.id"""
+SQL_REMOVER_FAVORITO = """DELETE f FROM favorites f
+                          JOIN track t ON t.id = f.track_id
+                          WHERE t.usuario = %s AND t.filename = %s"""
+SQL_PLAYLISTS_DO_USUARIO = "SELECT id, nome FROM playlist WHERE usuario=%s"
+SQL_PLAYLIST_POR_NOME = "SELECT id FROM playlist WHERE usuario=%s AND nome=%s"
+SQL_MUSICAS_DA_PLAYLIST = """
+    SELECT t.filename FROM playlist_musica pm
+    JOIN track t ON t.id = pm.track_id
+    WHERE pm.playlist_id = %s
+    ORDER BY pm.id
+"""
+SQL_FAIXAS_DO_USUARIO = "SELECT id, filename, size, mtime, media_id FROM track WHERE usuario = %s"
+SQL_ALBUNS_DO_USUARIO = """
+    SELECT album, MIN(artist) AS artist, COUNT(*) AS faixas, SUM(duration) AS duracao
+    FROM track
+    WHERE usuario = %s AND album IS NOT NULL
+    GROUP BY album
+    ORDER BY album
+"""
+SQL_ARTISTAS_DO_USUARIO = """
+    SELECT artist, COUNT(*) AS faixas, COUNT(DISTINCT album) AS albuns
+    FROM track
+    WHERE usuario = %s AND artist IS NOT NULL
+    GROUP BY artist
+    ORDER BY artist
+"""
+SQL_FAIXAS_POR = """
+    SELECT filename, title, artist, album, track_number, year, duration
+    FROM track
+    WHERE usuario = %s AND {campo} = %s
+    ORDER BY album, track_number, title, filename
+"""
+SQL_USO_DE_ARMAZENAMENTO = "SELECT bytes FROM uso_armazenamento WHERE usuario = %s"
+
+DOWNLOADS_POR_PAGINA = 50
+
+def sql_fila_paginada(usuario, status=None, antes=None, limite=DOWNLOADS_POR_PAGINA):
+    """(sql, params) da página de jobs do usuário em fila e fila_historico."""
+    filtros = "usuario = %s"
+    params = [usuario]
+    if status:
+        filtros += " AND status = %s"
+        params.append(status)
+    if antes:
+        filtros += " AND id < %s"
+        params.append(antes)
+    sql = SQL_FILA_PAGINADA.format(filtros=filtros)
+    return sql, (*params, limite + 1, *params, limite + 1, limite + 1)
+
+# Verificadas por EXPLAIN com parâmetros de exemplo: nenhuma pode virar full
+# scan (type=ALL, ou seja, nenhum índice usado).
+CONSULTAS_HOT_PATH = [
+    ("cabeças da fila", SQL_CABECAS_DA_FILA, ('em fila',)),
+    ("fila do usuário", *sql_fila_paginada('x')),
+    ("fila do usuário (página seguinte)", *sql_fila_paginada('x', antes=1000)),
+    ("fila do usuário por status", *sql_fila_paginada('x', status='Erro', antes=1000)),
+    ("resumo da fila", SQL_RESUMO_DA_FILA.format(tabela='fila'), ('x',)),
+    ("resumo do histórico", SQL_RESUMO_DA_FILA.format(tabela='fila_historico'), ('x',)),
+    ("jobs a arquivar", SQL_JOBS_A_ARQUIVAR, (7, 500)),
+    ("favoritos", SQL_FAVORITOS, ('x',)),
+    ("remover favorito", SQL_REMOVER_FAVORITO, ('x', 'x.mp3')),
+    ("playlists do usuário", SQL_PLAYLISTS_DO_USUARIO, ('x',)),
+    ("playlist por nome", SQL_PLAYLIST_POR_NOME, ('x', 'x')),
+    ("músicas da playlist", SQL_MUSICAS_DA_PLAYLIST, (1,)),
+    ("faixas do usuário", SQL_FAIXAS_DO_USUARIO, ('x',)),
+    ("álbuns do usuário", SQL_ALBUNS_DO_USUARIO, ('x',)),
+    ("artistas do usuário", SQL_ARTISTAS_DO_USUARIO, ('x',)),
+    ("faixas do álbum", SQL_FAIXAS_POR.format(campo='album'), ('x', 'x')),
+    ("faixas do artista", SQL_FAIXAS_POR.format(campo='artist'), ('x', 'x')),
+    ("uso de armazenamento", SQL_USO_DE_ARMAZENAMENTO, ('x',)),
+]
+
+def verificar_planos_de_consulta():
+    """
+    Executa EXPLAIN nas consultas do hot path e retorna a lista de
+    (nome, tabela) que regrediram para full scan, ou None se não conseguir
+    conectar ao banco.
+    """
+    regressoes = []
+    try:
+        conn = get_db_connection_dynamic()
+    except mysql.connector.Error as err:
+        logger.error(f"Erro ao conectar ao banco para verificar os planos de consulta: {err}")
+        return None
+    try:
+        cursor = conn.cursor(dictionary=True)
+        for nome, sql, params in CONSULTAS_HOT_PATH:
+            cursor.execute("EXPLAIN " + sql, params)
+            for linha in cursor.fetchall():
+                # Com ou sem índices candidatos: se o otimizador não usou nenhum, é full scan.
+                # Tabelas derivadas/uniões (<derived2>, <union1,2>) são sempre lidas inteiras
+                # e não contam; as tabelas de origem aparecem em linhas próprias.
+                if linha.get('type') == 'ALL' and not str(linha.get('table') or '').startswith('<'):
+                    regressoes.append((nome, linha.get('table')))
+                    logger.error(f"Consulta '{nome}' faz full scan em '{linha.get('table')}'.")
+        cursor.close()
+    finally:
+        conn.close()
+    if not regressoes:
+        logger.info("Planos de consulta verificados: nenhum full scan no hot path.")
+    return regressoes
+
 #############################################################################
 #                             INTERFACE TKINTER
 #############################################################################
@@ -411,6 +1134,7 @@ class ConfigApp:
                 return
 
             initialize_config_table()
+            aplicar_migracoes()
             messagebox.showinfo("Sucesso", "Configurações salvas e tabela 'config' inicializada com sucesso!")
         except ValueError as ve:
             logger.error(f"Validação de dados falhou: {ve}")
@@ -432,6 +1156,7 @@ class ConfigApp:
             return
 
         initialize_config_table()
+        aplicar_migracoes()
         self.flask_thread = threading.Thread(target=run_flask_app, daemon=True)
         self.flask_thread.start()
         self.flask_running = True
@@ -459,15 +1184,21 @@ class ConfigApp:
             messagebox.showerror("Erro", f"Erro ao tentar desligar o Flask: {e}")
 
     def update_logs(self):
-        while not log_queue.empty():
+        records = []
+        while len(records) < 500:
             try:
-                record = log_queue.get_nowait()
-                self.log_text.configure(state='normal')
-                self.log_text.insert(tk.END, record + '\n')
-                self.log_text.configure(state='disabled')
-                self.log_text.yview(tk.END)
+                records.append(log_queue.get_nowait())
             except queue.Empty:
-                pass
+                break
+        if records:
+            self.log_text.configure(state='normal')
+            self.log_text.insert(tk.END, '\n'.join(records) + '\n')
+            # Mantém o widget limitado às últimas LOG_GUI_MAX_LINES linhas
+            total_lines = int(self.log_text.index('end-1c').split('.')[0])
+            if total_lines > LOG_GUI_MAX_LINES:
+                self.log_text.delete('1.0', f'{total_lines - LOG_GUI_MAX_LINES}.0')
+            self.log_text.configure(state='disabled')
+            self.log_text.yview(tk.END)
         self.root.after(100, self.update_logs)
 
 #############################################################################
@@ -478,6 +1209,7 @@ def run_flask_app():
     try:
         t = threading.Thread(target=processar_fila_loop, daemon=True)
         t.start()
+        threading.Thread(target=aquecer_bibliotecas, daemon=True).start()
         app.run(debug=False, host='0.0.0.0', port=config.flask_port)
         logger.info("Servidor Flask foi desligado.")
     except Exception as e:
@@ -487,16 +1219,1001 @@ def run_flask_app():
 #                          CONFIGURAÇÃO FLASK
 #############################################################################
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder='Static', template_folder='Templates')
 app.secret_key = 'CHAVE_SECRETA_QUALQUER'
 
 def get_db_connection():
+    inicio = time.perf_counter()
     try:
-        return get_db_connection_dynamic()
+        with medir_fase('db'):
+            conexao = get_db_connection_dynamic()
+        registrar_conexao(time.perf_counter() - inicio)
+        return ConexaoMedida(conexao)
     except mysql.connector.Error as err:
         logger.error(f"Erro ao conectar ao banco de dados: {err}")
         return None
 
+#############################################################################
+#                  MEDIÇÃO POR FASE E PERFILAMENTO
+#############################################################################
+
+PERFIL_CABECALHO = 'X-Profile'
+
+_medicao_local = threading.local()
+
+class Medicao:
+    """
+    Tempo acumulado por fase (db, fs, render) da requisição ou do job da
+    thread, mais as consultas executadas e as conexões abertas.
+    """
+
+    __slots__ = ('inicio', 'fases', 'chamadas', 'ativas', 'marcas', 'consultas', 'conexoes')
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.fases = {}
+        self.chamadas = {}
+        self.ativas = set()
+        self.marcas = {}
+        self.consultas = {}      # impressão -> [chamadas, segundos, max_segundos, linhas]
+        self.conexoes = [0, 0.0]  # quantidade, segundos
+
+    def somar(self, fase, segundos):
+        self.fases[fase] = self.fases.get(fase, 0.0) + segundos
+        self.chamadas[fase] = self.chamadas.get(fase, 0) + 1
+
+    def resumo(self):
+        """Retorna (segundos totais, texto com o tempo e o número de chamadas por fase)."""
+        total = time.perf_counter() - self.inicio
+        partes = [
+            f"{fase} {segundos * 1000:.0f} ms/{self.chamadas[fase]}x"
+            for fase, segundos in sorted(self.fases.items())
+        ]
+        partes.append(f"outros {max(total - sum(self.fases.values()), 0) * 1000:.0f} ms")
+        return total, ', '.join(partes)
+
+def medicao_atual():
+    return getattr(_medicao_local, 'medicao', None)
+
+@contextmanager
+def medir_fase(fase):
+    """Soma o tempo do bloco à fase da medição corrente; a mesma fase aninhada conta uma vez."""
+    medicao = medicao_atual()
+    if medicao is None or fase in medicao.ativas:
+        yield
+        return
+    medicao.ativas.add(fase)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicao.ativas.discard(fase)
+        medicao.somar(fase, time.perf_counter() - inicio)
+
+def pasta_de_perfis():
+    """Pasta dos perfis gravados; padrão: '.profiles' dentro de config.file_path."""
+    return config.profile_path or os.path.join(config.file_path, '.profiles')
+
+def sortear_perfil():
+    return config.profile_sample_percent > 0 and random.random() * 100 < config.profile_sample_percent
+
+# A partir do Python 3.12 o cProfile usa sys.monitoring e só um perfil pode
+# estar ativo no processo: os demais pedidos ficam sem perfil, sem falhar
+_perfil_lock = threading.Lock()
+
+def iniciar_medicao(perfilar=False):
+    """Abre a medição da thread corrente e, se pedido, liga o cProfile nela."""
+    perfil = None
+    if perfilar and _perfil_lock.acquire(blocking=False):
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError as e:
+            logger.debug(f"Perfilamento ignorado: {e}")
+            perfil = None
+            _perfil_lock.release()
+    _medicao_local.perfil = perfil
+    _medicao_local.medicao = Medicao()
+
+def encerrar_medicao(descricao, nome, limite_segundos, verificar=True):
+    """
+    Fecha a medição da thread: grava o perfil, se havia um, soma as consultas
+    ao rastreador (avisando de excessos se `verificar`) e registra o
+    detalhamento por fase quando o tempo total passou de `limite_segundos`.
+    """
+    medicao = medicao_atual()
+    perfil = getattr(_medicao_local, 'perfil', None)
+    _medicao_local.medicao = None
+    _medicao_local.perfil = None
+    if medicao is None:
+        return
+    if perfil is not None:
+        perfil.disable()
+        _perfil_lock.release()
+    total, resumo = medicao.resumo()
+    rastreador_de_consultas.acumular(nome, medicao, verificar_consultas(descricao, medicao) if verificar else 0)
+    if perfil is not None:
+        nome = re.sub(r'[^\w.-]+', '_', nome)
+        arquivo = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{nome}-{total * 1000:.0f}ms-"
+            f"{os.getpid()}-{threading.get_ident()}.prof"
+        )
+        try:
+            os.makedirs(pasta_de_perfis(), exist_ok=True)
+            perfil.dump_stats(os.path.join(pasta_de_perfis(), arquivo))
+            logger.info(f"Perfil de {descricao} gravado em '{arquivo}'.")
+        except OSError as e:
+            logger.warning(f"Erro ao gravar o perfil de {descricao}: {e}")
+    if limite_segundos and total >= limite_segundos:
+        logger.warning(f"Lento: {descricao} em {total * 1000:.0f} ms ({resumo}).")
+
+@app.before_request
+def iniciar_medicao_da_requisicao():
+    # O cabeçalho só liga o perfil para administradores
+    perfilar = sortear_perfil() or (request.headers.get(PERFIL_CABECALHO) == '1' and usuario_e_admin())
+    iniciar_medicao(perfilar)
+
+@app.after_request
+def encerrar_medicao_da_requisicao(resposta):
+    encerrar_medicao(
+        f"{request.method} {request.path} ({resposta.status_code})",
+        request.endpoint or 'sem-rota', config.slow_request_ms / 1000
+    )
+    return resposta
+
+@app.teardown_request
+def descartar_medicao_da_requisicao(_erro=None):
+    if medicao_atual() is not None:
+        encerrar_medicao(f"{request.method} {request.path} (erro)", request.endpoint or 'sem-rota',
+                         config.slow_request_ms / 1000)
+
+def _antes_de_renderizar(remetente, **extra):
+    medicao = medicao_atual()
+    if medicao is not None:
+        medicao.marcas['render'] = time.perf_counter()
+
+def _depois_de_renderizar(remetente, **extra):
+    medicao = medicao_atual()
+    if medicao is not None and 'render' in medicao.marcas:
+        medicao.somar('render', time.perf_counter() - medicao.marcas.pop('render'))
+
+before_render_template.connect(_antes_de_renderizar, app)
+template_rendered.connect(_depois_de_renderizar, app)
+
+class CursorMedido:
+    """
+    Cursor do mysql.connector com execução e leitura contadas na fase 'db'
+    e registradas no rastreador de consultas.
+    """
+
+    __slots__ = ('_cursor', '_impressao')
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._impressao = None
+
+    def execute(self, operacao, params=None, *args, **kwargs):
+        self._impressao = impressao_da_consulta(operacao)
+        inicio = time.perf_counter()
+        try:
+            with medir_fase('db'):
+                return self._cursor.execute(operacao, params, *args, **kwargs)
+        finally:
+            # SELECTs contam as linhas na leitura; os demais, as linhas afetadas
+            linhas = 0 if getattr(self._cursor, 'with_rows', False) else max(self._cursor.rowcount, 0)
+            registrar_consulta(self._impressao, time.perf_counter() - inicio, linhas)
+
+    def _ler(self, metodo, *args, **kwargs):
+        inicio = time.perf_counter()
+        with medir_fase('db'):
+            resultado = metodo(*args, **kwargs)
+        if self._impressao is not None:
+            linhas = len(resultado) if isinstance(resultado, list) else int(resultado is not None)
+            registrar_consulta(self._impressao, time.perf_counter() - inicio, linhas, nova=False)
+        return resultado
+
+    def fetchone(self):
+        return self._ler(self._cursor.fetchone)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._ler(self._cursor.fetchmany, *args, **kwargs)
+
+    def fetchall(self):
+        return self._ler(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+class ConexaoMedida:
+    """Conexão que entrega cursores medidos; o resto é repassado à conexão real."""
+
+    __slots__ = ('_conexao',)
+
+    def __init__(self, conexao):
+        self._conexao = conexao
+
+    def cursor(self, *args, **kwargs):
+        return CursorMedido(self._conexao.cursor(*args, **kwargs))
+
+    def __getattr__(self, nome):
+        return getattr(self._conexao, nome)
+
+#############################################################################
+#                  RASTREAMENTO DE CONSULTAS AO BANCO
+#############################################################################
+
+RASTREIO_MAX_IMPRESSOES = 500
+
+_RE_ESPACOS = re.compile(r'\s+')
+_RE_LITERAIS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\b\d+\b")
+_RE_LISTAS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_RE_LISTAS_REPETIDAS = re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+')
+
+@lru_cache(maxsize=2048)
+def impressao_da_consulta(sql):
+    """
+    Normaliza a consulta para agrupar execuções equivalentes: literais e
+    parâmetros viram '?', listas de parâmetros (IN, VALUES em lote) viram
+    '(?+)' e os espaços são colapsados.
+    """
+    sql = _RE_ESPACOS.sub(' ', sql).strip()
+    sql = _RE_LITERAIS.sub('?', sql).replace('%s', '?')
+    sql = _RE_LISTAS.sub('(?+)', sql)
+    return _RE_LISTAS_REPETIDAS.sub('(?+)', sql)
+
+class RastreadorDeConsultas:
+    """
+    Agregados das consultas por impressão digital e por rota/job. Cada
+    requisição acumula na sua Medicao, sem lock, e é somada aqui no fim;
+    consultas fora de requisições e jobs entram direto na rota '(fundo)'.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self._consultas = {}  # impressão -> [chamadas, segundos, max_segundos, linhas]
+            self._rotas = {}      # rota -> [execuções, consultas, max_consultas, conexões, segundos_conexão, alertas]
+            self.desde = time.time()
+
+    def _somar(self, impressao, chamadas, segundos, maximo, linhas):
+        if impressao not in self._consultas and len(self._consultas) >= RASTREIO_MAX_IMPRESSOES:
+            impressao = '(outras)'
+        item = self._consultas.setdefault(impressao, [0, 0.0, 0.0, 0])
+        item[0] += chamadas
+        item[1] += segundos
+        item[2] = max(item[2], maximo)
+        item[3] += linhas
+
+    def registrar_avulsa(self, impressao, segundos, linhas, nova):
+        with self._lock:
+            self._somar(impressao, 1 if nova else 0, segundos, segundos if nova else 0.0, linhas)
+            if nova:
+                self._rotas.setdefault('(fundo)', [0, 0, 0, 0, 0.0, 0])[1] += 1
+
+    def registrar_conexao_avulsa(self, segundos):
+        with self._lock:
+            rota = self._rotas.setdefault('(fundo)', [0, 0, 0, 0, 0.0, 0])
+            rota[3] += 1
+            rota[4] += segundos
+
+    def acumular(self, rota, medicao, alertas):
+        total = sum(c[0] for c in medicao.consultas.values())
+        with self._lock:
+            for impressao, (chamadas, segundos, maximo, linhas) in medicao.consultas.items():
+                self._somar(impressao, chamadas, segundos, maximo, linhas)
+            item = self._rotas.setdefault(rota, [0, 0, 0, 0, 0.0, 0])
+            item[0] += 1
+            item[1] += total
+            item[2] = max(item[2], total)
+            item[3] += medicao.conexoes[0]
+            item[4] += medicao.conexoes[1]
+            item[5] += alertas
+
+    def estado(self, limite=100):
+        with self._lock:
+            consultas = sorted(self._consultas.items(), key=lambda i: i[1][1], reverse=True)[:limite]
+            rotas = sorted(self._rotas.items(), key=lambda i: i[1][1], reverse=True)
+            return {
+                'since': self.desde,
+                'queries': [
+                    {
+                        'fingerprint': impressao,
+                        'calls': chamadas,
+                        'total_ms': round(segundos * 1000, 2),
+                        'avg_ms': round(segundos * 1000 / chamadas, 3) if chamadas else 0.0,
+                        'max_ms': round(maximo * 1000, 2),
+                        'rows': linhas,
+                    }
+                    for impressao, (chamadas, segundos, maximo, linhas) in consultas
+                ],
+                'endpoints': [
+                    {
+                        'endpoint': rota,
+                        'requests': execucoes,
+                        'queries': total,
+                        'avg_queries': round(total / execucoes, 2) if execucoes else None,
+                        'max_queries': maximo,
+                        'connections': conexoes,
+                        'connect_ms': round(segundos * 1000, 2),
+                        'warnings': alertas,
+                    }
+                    for rota, (execucoes, total, maximo, conexoes, segundos, alertas) in rotas
+                ],
+            }
+
+rastreador_de_consultas = RastreadorDeConsultas()
+
+def registrar_consulta(impressao, segundos, linhas, nova=True):
+    """Soma uma execução (ou, com nova=False, a leitura do resultado) da consulta."""
+    medicao = medicao_atual()
+    if medicao is None:
+        rastreador_de_consultas.registrar_avulsa(impressao, segundos, linhas, nova)
+        return
+    item = medicao.consultas.setdefault(impressao, [0, 0.0, 0.0, 0])
+    if nova:
+        item[0] += 1
+        item[2] = max(item[2], segundos)
+    item[1] += segundos
+    item[3] += linhas
+
+def registrar_conexao(segundos):
+    medicao = medicao_atual()
+    if medicao is None:
+        rastreador_de_consultas.registrar_conexao_avulsa(segundos)
+        return
+    medicao.conexoes[0] += 1
+    medicao.conexoes[1] += segundos
+
+def verificar_consultas(descricao, medicao):
+    """Avisa quando a requisição passou do orçamento de consultas ou repetiu uma consulta (N+1)."""
+    alertas = 0
+    total = sum(c[0] for c in medicao.consultas.values())
+    if config.query_budget and total > config.query_budget:
+        alertas += 1
+        logger.warning(
+            f"{descricao}: {total} consultas em {medicao.conexoes[0]} conexão(ões), "
+            f"acima do orçamento de {config.query_budget}."
+        )
+    if config.query_repeat_threshold:
+        for impressao, (chamadas, segundos, _, _) in medicao.consultas.items():
+            if chamadas >= config.query_repeat_threshold:
+                alertas += 1
+                logger.warning(
+                    f"{descricao}: possível N+1, {chamadas}x em {segundos * 1000:.0f} ms: {impressao[:200]}"
+                )
+    return alertas
+
+#############################################################################
+#                  ARQUIVOS ESTÁTICOS E COMPRESSÃO DE RESPOSTAS
+#############################################################################
+
+COMPRESSAO_MIN_BYTES = 1024
+TIPOS_COMPRIMIVEIS = ('text/html', 'application/json')
+
+class AssetsEstaticos:
+    """
+    Fingerprint (hash do conteúdo) e variantes pré-comprimidas (gzip e,
+    se disponível, brotli) dos arquivos de Static/, calculados uma vez por
+    versão do arquivo e mantidos em memória.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arquivos = {}  # nome -> (mtime_ns, fingerprint, {codificação: bytes})
+
+    def obter(self, nome):
+        caminho = safe_join(app.static_folder, nome)
+        if not caminho or not os.path.isfile(caminho):
+            return None
+        mtime = os.stat(caminho).st_mtime_ns
+        with self._lock:
+            atual = self._arquivos.get(nome)
+        if atual and atual[0] == mtime:
+            return atual
+        with open(caminho, 'rb') as f:
+            dados = f.read()
+        variantes = {'identity': dados, 'gzip': gzip.compress(dados, 9, mtime=0)}
+        if brotli:
+            variantes['br'] = brotli.compress(dados, quality=11)
+        entrada = (mtime, hashlib.sha256(dados).hexdigest()[:12], variantes)
+        with self._lock:
+            self._arquivos[nome] = entrada
+        return entrada
+
+    def url(self, nome):
+        entrada = self.obter(nome)
+        if not entrada:
+            return url_for('static', filename=nome)
+        return url_for('asset_estatico', fingerprint=entrada[1], nome=nome)
+
+assets_estaticos = AssetsEstaticos()
+app.jinja_env.globals['asset_url'] = assets_estaticos.url
+
+def _codificacao_aceita():
+    return request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+
+@app.route('/assets/<fingerprint>/<path:nome>')
+def asset_estatico(fingerprint, nome):
+    entrada = assets_estaticos.obter(nome)
+    if not entrada:
+        abort(404)
+    _, atual, variantes = entrada
+    codificacao = _codificacao_aceita() or 'identity'
+    resposta = Response(variantes[codificacao], mimetype=mimetypes.guess_type(nome)[0])
+    if codificacao != 'identity':
+        resposta.headers['Content-Encoding'] = codificacao
+    resposta.vary.add('Accept-Encoding')
+    resposta.set_etag(f"{atual}-{codificacao}")
+    # Só a URL com o fingerprint atual pode ficar em cache para sempre
+    if fingerprint == atual:
+        resposta.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        resposta.headers['Cache-Control'] = 'no-cache'
+    return resposta.make_conditional(request)
+
+@app.after_request
+def comprimir_resposta(resposta):
+    """Comprime HTML e JSON com brotli/gzip conforme o Accept-Encoding."""
+    if (resposta.direct_passthrough or resposta.is_streamed or resposta.status_code != 200
+            or 'Content-Encoding' in resposta.headers or resposta.mimetype not in TIPOS_COMPRIMIVEIS):
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+    codificacao = _codificacao_aceita()
+    dados = resposta.get_data()
+    if not codificacao or len(dados) < COMPRESSAO_MIN_BYTES:
+        return resposta
+    if codificacao == 'br':
+        resposta.set_data(brotli.compress(dados, quality=5))
+    else:
+        resposta.set_data(gzip.compress(dados, 6))
+    resposta.headers['Content-Encoding'] = codificacao
+    return resposta
+
+#############################################################################
+#                  CACHE DE LEITURA (PLAYLISTS E FAVORITOS)
+#############################################################################
+
+def _tamanho_aproximado(valor):
+    """Estimativa em bytes do espaço ocupado por um valor em cache."""
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(
+            _tamanho_aproximado(k) + _tamanho_aproximado(v) for k, v in valor.items()
+        )
+    if isinstance(valor, (list, tuple, set, frozenset)):
+        return sys.getsizeof(valor) + sum(_tamanho_aproximado(v) for v in valor)
+    return sys.getsizeof(valor)
+
+class CacheCompartilhado:
+    """
+    Camada comum a todos os processos do servidor no mesmo host. Uma tabela
+    de versões mapeada em memória é o canal de invalidação: quem altera um
+    dado incrementa a versão da chave e os outros processos percebem na
+    leitura seguinte, sem chamada de sistema. Os valores ficam em arquivos
+    da mesma pasta (de preferência em tmpfs), marcados com a versão em que
+    foram gravados. Chaves que colidem no mesmo slot só se invalidam juntas.
+    """
+    SLOTS = 1 << 16
+    VERSAO = struct.Struct('<Q')
+    CABECALHO = struct.Struct('<Qd')  # versão, expira_em (epoch)
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        os.makedirs(os.path.join(pasta, 'valores'), exist_ok=True)
+        self._fd = os.open(os.path.join(pasta, 'versoes.bin'), os.O_RDWR | os.O_CREAT, 0o600)
+        tamanho = self.SLOTS * self.VERSAO.size
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < tamanho:
+                os.ftruncate(self._fd, tamanho)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._versoes = mmap.mmap(self._fd, tamanho)
+        self._lock = threading.Lock()
+
+    def _posicao(self, chave):
+        return (zlib.crc32(repr(chave).encode('utf-8')) % self.SLOTS) * self.VERSAO.size
+
+    def _caminho(self, chave):
+        return os.path.join(self.pasta, 'valores', hashlib.sha1(repr(chave).encode('utf-8')).hexdigest())
+
+    def versao(self, chave):
+        return self.VERSAO.unpack_from(self._versoes, self._posicao(chave))[0]
+
+    def incrementar(self, chaves):
+        # flock entre processos; o lock de thread porque o flock é por descritor
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                for chave in chaves:
+                    posicao = self._posicao(chave)
+                    self.VERSAO.pack_into(self._versoes, posicao, self.VERSAO.unpack_from(self._versoes, posicao)[0] + 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        for chave in chaves:
+            try:
+                os.unlink(self._caminho(chave))
+            except OSError:
+                pass
+
+    def ler(self, chave, versao):
+        """Retorna (True, valor) se há valor gravado nesta versão e ainda válido."""
+        try:
+            with open(self._caminho(chave), 'rb') as f:
+                dados = f.read()
+            gravado_em, expira_em = self.CABECALHO.unpack_from(dados)
+            if gravado_em != versao or expira_em < time.time():
+                return False, None
+            return True, marshal.loads(memoryview(dados)[self.CABECALHO.size:])
+        except (OSError, ValueError, EOFError, TypeError, struct.error):
+            return False, None
+
+    def gravar(self, chave, valor, versao, ttl):
+        try:
+            conteudo = marshal.dumps(valor)
+        except ValueError:
+            return
+        destino = self._caminho(chave)
+        temporario = f"{destino}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(temporario, 'wb') as f:
+                f.write(self.CABECALHO.pack(versao, time.time() + ttl))
+                f.write(conteudo)
+            os.replace(temporario, destino)
+        except OSError as e:
+            logger.warning(f"Erro ao gravar no cache compartilhado: {e}")
+
+class CacheTTL:
+    """
+    Cache em memória com expiração (TTL) e descarte LRU limitado por memória.
+    Cada chave tem uma versão incrementada a cada invalidação, para que uma
+    leitura concorrente não grave no cache um valor anterior à mutação. Com
+    um CacheCompartilhado, as versões e os valores valem para todos os
+    processos do host.
+    """
+    def __init__(self, ttl=300, max_bytes=32 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._dados = OrderedDict()  # chave -> (expira_em, tamanho, valor, versao)
+        self._versoes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.compartilhado = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def configurar(self, ttl, max_bytes):
+        with self._lock:
+            self.ttl = ttl
+            self.max_bytes = max_bytes
+            self._descartar_excesso()
+
+    def compartilhar(self, pasta):
+        """Liga (ou desliga, com pasta vazia) o cache compartilhado entre processos."""
+        if self.compartilhado and self.compartilhado.pasta == pasta:
+            return
+        compartilhado = None
+        if pasta and fcntl is None:
+            logger.warning("Cache compartilhado indisponível nesta plataforma; usando só o cache local.")
+        elif pasta:
+            try:
+                compartilhado = CacheCompartilhado(pasta)
+            except OSError as e:
+                logger.error(f"Erro ao abrir o cache compartilhado em '{pasta}': {e}")
+        with self._lock:
+            self.compartilhado = compartilhado
+            self._dados.clear()
+            self._bytes = 0
+
+    def versao(self, chave):
+        compartilhado = self.compartilhado
+        if compartilhado:
+            return compartilhado.versao(chave)
+        with self._lock:
+            return self._versoes.get(chave, 0)
+
+    def obter(self, chave):
+        """Retorna (True, valor) em caso de acerto ou (False, None)."""
+        compartilhado = self.compartilhado
+        versao = compartilhado.versao(chave) if compartilhado else None
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is not None:
+                expira_em, tamanho, valor, gravado_em = item
+                if expira_em < time.monotonic():
+                    self.expirations += 1
+                elif compartilhado and gravado_em != versao:
+                    self.invalidations += 1  # alterado em outro processo
+                else:
+                    self._dados.move_to_end(chave)
+                    self.hits += 1
+                    return True, valor
+                del self._dados[chave]
+                self._bytes -= tamanho
+        if compartilhado:
+            achou, valor = compartilhado.ler(chave, versao)
+            if achou:
+                self._guardar(chave, valor, versao)
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return True, valor
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def gravar(self, chave, valor, versao):
+        """Grava o valor se a chave não foi invalidada desde `versao`."""
+        if self.ttl <= 0:
+            return
+        compartilhado = self.compartilhado
+        if compartilhado:
+            if compartilhado.versao(chave) != versao:
+                return
+            compartilhado.gravar(chave, valor, versao, self.ttl)
+        self._guardar(chave, valor, versao)
+
+    def _guardar(self, chave, valor, versao):
+        tamanho = _tamanho_aproximado(valor)
+        with self._lock:
+            if tamanho > self.max_bytes:
+                return
+            if not self.compartilhado and self._versoes.get(chave, 0) != versao:
+                return
+            antigo = self._dados.pop(chave, None)
+            if antigo is not None:
+                self._bytes -= antigo[1]
+            self._dados[chave] = (time.monotonic() + self.ttl, tamanho, valor, versao)
+            self._bytes += tamanho
+            self._descartar_excesso()
+
+    def invalidar(self, *chaves):
+        with self._lock:
+            for chave in chaves:
+                self._versoes[chave] = self._versoes.get(chave, 0) + 1
+                item = self._dados.pop(chave, None)
+                if item is not None:
+                    self._bytes -= item[1]
+                self.invalidations += 1
+        if self.compartilhado:
+            self.compartilhado.incrementar(chaves)
+
+    def _descartar_excesso(self):
+        while self._dados and self._bytes > self.max_bytes:
+            _, (_, tamanho, _, _) = self._dados.popitem(last=False)
+            self._bytes -= tamanho
+            self.evictions += 1
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._dados),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'shared': self.compartilhado is not None,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+library_cache = CacheTTL()
+
+def _chave_playlists(usuario):
+    return ('playlists', usuario)
+
+def _chave_musicas_playlist(playlist_id):
+    return ('playlist_musicas', int(playlist_id))
+
+def _chave_favoritos(usuario):
+    return ('favoritos', usuario)
+
+def _chave_biblioteca(usuario):
+    return ('biblioteca', usuario)
+
+def invalidar_biblioteca(usuario):
+    """Incrementa a versão da biblioteca do usuário (arquivos adicionados/removidos)."""
+    library_cache.invalidar(_chave_biblioteca(usuario))
+
+def invalidar_playlists_do_usuario(usuario, incluir_musicas=False):
+    """
+    Invalida a lista de playlists do usuário e, se pedido, o conteúdo de
+    todas as suas playlists (ex.: música excluída de todas as listas).
+    """
+    chaves = []
+    if incluir_musicas:
+        chaves.extend(_chave_musicas_playlist(p['id']) for p in listar_playlists_do_usuario(usuario))
+    chaves.append(_chave_playlists(usuario))
+    library_cache.invalidar(*chaves)
+
+#############################################################################
+#                  CACHE DE FRAGMENTOS RENDERIZADOS E ETAGS
+#############################################################################
+
+# As chaves já carregam as versões; o TTL só limpa fragmentos esquecidos
+FRAGMENTO_TTL = 3600
+fragment_cache = CacheTTL(FRAGMENTO_TTL, 16 * 1024 * 1024)
+
+def versao_da_biblioteca(usuario, diretorio):
+    """
+    Contador de mutações da biblioteca mais o mtime do diretório, que cobre
+    arquivos alterados fora da aplicação.
+    """
+    try:
+        with medir_fase('fs'):
+            mtime = os.stat(diretorio).st_mtime_ns if diretorio else 0
+    except OSError:
+        mtime = 0
+    return library_cache.versao(_chave_biblioteca(usuario)), mtime
+
+@pass_context
+def fragmento(contexto, nome):
+    """
+    Renderiza um template parcial com o contexto da página, reaproveitando
+    o HTML enquanto a biblioteca e os favoritos do usuário não mudarem.
+    """
+    usuario = session.get('usuario')
+    chave = (
+        nome, request.endpoint, usuario,
+        versao_da_biblioteca(usuario, session.get('diretorio')),
+        library_cache.versao(_chave_favoritos(usuario)),
+    )
+    achou, html = fragment_cache.obter(chave)
+    if achou:
+        return html
+    html = Markup(app.jinja_env.get_template(nome).render(contexto.get_all()))
+    fragment_cache.gravar(chave, html, fragment_cache.versao(chave))
+    return html
+
+app.jinja_env.globals['fragmento'] = fragmento
+
+def responder_com_etag(corpo):
+    """Resposta com ETag fraco do conteúdo; 304 se o cliente já tem esta versão."""
+    resposta = make_response(corpo)
+    resposta.set_etag(hashlib.sha1(resposta.get_data()).hexdigest(), weak=True)
+    resposta.headers['Cache-Control'] = 'private, no-cache'
+    return resposta.make_conditional(request)
+
+#############################################################################
+#                  SNAPSHOT PERSISTENTE DAS BIBLIOTECAS
+#############################################################################
+
+BIBLIOTECA_MAGIC = b'STLB'
+BIBLIOTECA_VERSAO = 1
+# magic, versão, mtime do diretório e instante do escaneamento em ns, número
+# de faixas; seguidos de (diretorio, arquivos, capas) serializados com marshal
+BIBLIOTECA_CABECALHO = struct.Struct('<4sBxxxqqI')
+# Diretório alterado menos disso antes do escaneamento pode ter mudado de novo
+# sem alterar o mtime (NAS com resolução de segundos): o snapshot é refeito
+BIBLIOTECA_JANELA_INCERTA_NS = 2 * 10**9
+BIBLIOTECA_LOTE_STAT = 64
+
+# Cada stat é uma ida ao NAS; os lotes de um escaneamento rodam em paralelo
+scan_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='scan')
+# Gravações dos snapshots em série, fora da requisição
+snapshot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshot')
+
+def pasta_de_snapshots():
+    """Pasta dos snapshots das bibliotecas; padrão: '.library' dentro de config.file_path."""
+    return config.library_snapshot_path or os.path.join(config.file_path, '.library')
+
+def _caminho_snapshot(usuario):
+    return os.path.join(pasta_de_snapshots(), hashlib.sha1(usuario.encode('utf-8')).hexdigest() + '.snap')
+
+class SnapshotBiblioteca:
+    """Conteúdo do diretório de uma biblioteca no instante do escaneamento."""
+
+    __slots__ = ('diretorio', 'mtime_ns', 'escaneado_em', 'arquivos', 'capas', 'musicas', 'versao')
+
+    def __init__(self, diretorio, mtime_ns, escaneado_em, arquivos, capas):
+        self.diretorio = diretorio
+        self.mtime_ns = mtime_ns
+        self.escaneado_em = escaneado_em
+        self.arquivos = arquivos    # {filename: (inode, size, mtime)}
+        self.capas = capas          # {filename: arquivo da capa}
+        self.musicas = tuple(sorted(arquivos))
+        self.versao = None          # versão da biblioteca no library_cache (só em memória)
+
+    def confiavel(self, diretorio, mtime_ns):
+        return (
+            diretorio == self.diretorio and mtime_ns == self.mtime_ns
+            and self.escaneado_em - mtime_ns > BIBLIOTECA_JANELA_INCERTA_NS
+        )
+
+def _stat_em_lote(diretorio, nomes):
+    resultado = {}
+    for nome in nomes:
+        try:
+            st = os.stat(os.path.join(diretorio, nome))
+        except OSError:
+            continue  # removido durante o escaneamento
+        resultado[nome] = (st.st_ino, st.st_size, st.st_mtime)
+    return resultado
+
+def _mapear_capas(musicas, imagens):
+    capas = {}
+    for nome in musicas:
+        nome_sem_ext = os.path.splitext(nome)[0]
+        for capa in (f"{nome_sem_ext}.jpg.jpg", f"{nome_sem_ext}.jpg"):
+            if capa in imagens:
+                capas[nome] = capa
+                break
+    return capas
+
+def escanear_biblioteca(diretorio, anterior=None):
+    """
+    Lê o diretório com os.scandir e faz o stat, em lotes paralelos, só das
+    faixas novas ou cujo inode mudou desde o snapshot `anterior`; sem
+    snapshot anterior é uma reconstrução completa.
+    """
+    escaneado_em = time.time_ns()
+    mtime_ns = os.stat(diretorio).st_mtime_ns
+    conhecidos = anterior.arquivos if anterior and anterior.diretorio == diretorio else {}
+    arquivos, imagens, pendentes = {}, set(), []
+    with os.scandir(diretorio) as it:
+        for entry in it:
+            nome = entry.name
+            minusculo = nome.lower()
+            if minusculo.endswith('.jpg'):
+                imagens.add(nome)
+            elif minusculo.endswith(EXTENSOES_AUDIO) and entry.is_file():
+                conhecido = conhecidos.get(nome)
+                if conhecido and conhecido[0] == entry.inode():
+                    arquivos[nome] = conhecido
+                else:
+                    pendentes.append(nome)
+    for resultado in scan_executor.map(partial(_stat_em_lote, diretorio),
+                                       _em_blocos(pendentes, BIBLIOTECA_LOTE_STAT)):
+        arquivos.update(resultado)
+    return SnapshotBiblioteca(diretorio, mtime_ns, escaneado_em, arquivos, _mapear_capas(arquivos, imagens))
+
+def gravar_snapshot(usuario, snapshot):
+    destino = _caminho_snapshot(usuario)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporario = destino + '.part'
+    with open(temporario, 'wb') as f:
+        f.write(BIBLIOTECA_CABECALHO.pack(
+            BIBLIOTECA_MAGIC, BIBLIOTECA_VERSAO, snapshot.mtime_ns, snapshot.escaneado_em, len(snapshot.arquivos)
+        ))
+        f.write(marshal.dumps((snapshot.diretorio, snapshot.arquivos, snapshot.capas)))
+    os.replace(temporario, destino)
+
+def ler_snapshot(usuario):
+    """Retorna o snapshot gravado do usuário ou None se ausente ou inválido."""
+    try:
+        with open(_caminho_snapshot(usuario), 'rb') as f:
+            dados = f.read()
+        magic, versao, mtime_ns, escaneado_em, qtd = BIBLIOTECA_CABECALHO.unpack_from(dados)
+        if magic != BIBLIOTECA_MAGIC or versao != BIBLIOTECA_VERSAO:
+            return None
+        diretorio, arquivos, capas = marshal.loads(memoryview(dados)[BIBLIOTECA_CABECALHO.size:])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, EOFError, TypeError, struct.error) as e:
+        logger.warning(f"Snapshot da biblioteca de '{usuario}' ilegível; será reconstruído: {e}")
+        return None
+    if len(arquivos) != qtd:
+        return None
+    return SnapshotBiblioteca(diretorio, mtime_ns, escaneado_em, arquivos, capas)
+
+class IndiceDeBibliotecas:
+    """
+    Snapshots das bibliotecas em memória, gravados em disco para o arranque
+    a quente e reconciliados sob demanda pelo mtime do diretório.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _lock_do_usuario(self, usuario):
+        with self._lock:
+            return self._locks.setdefault(usuario, threading.Lock())
+
+    def _gravar(self, usuario, snapshot):
+        try:
+            gravar_snapshot(usuario, snapshot)
+        except OSError as e:
+            logger.warning(f"Erro ao gravar o snapshot da biblioteca de '{usuario}': {e}")
+
+    @medir_fase('fs')
+    def obter(self, usuario, diretorio):
+        """
+        Snapshot atual da biblioteca; só escaneia o diretório se o mtime ou a
+        versão da biblioteca mudaram desde o último escaneamento. Propaga
+        OSError se o diretório não existir.
+        """
+        versao = library_cache.versao(_chave_biblioteca(usuario))
+        snapshot = self._snapshots.get(usuario)
+        if snapshot and snapshot.versao == versao and snapshot.confiavel(diretorio, os.stat(diretorio).st_mtime_ns):
+            return snapshot
+        with self._lock_do_usuario(usuario):
+            mtime_ns = os.stat(diretorio).st_mtime_ns
+            snapshot = self._snapshots.get(usuario)
+            if snapshot and snapshot.versao == versao and snapshot.confiavel(diretorio, mtime_ns):
+                return snapshot
+            # Outro processo pode já ter reescaneado e gravado um snapshot mais novo
+            gravado = ler_snapshot(usuario)
+            if gravado and (snapshot is None or gravado.escaneado_em > snapshot.escaneado_em):
+                snapshot = gravado
+                if gravado.confiavel(diretorio, mtime_ns):
+                    gravado.versao = versao
+                    self._snapshots[usuario] = gravado
+                    return gravado
+            novo = escanear_biblioteca(diretorio, snapshot)
+            novo.versao = versao
+            self._snapshots[usuario] = novo
+        snapshot_executor.submit(self._gravar, usuario, novo)
+        return novo
+
+    def reconstruir(self, usuario, diretorio):
+        """Reescaneia o diretório inteiro, sem aproveitar o snapshot anterior."""
+        with self._lock_do_usuario(usuario):
+            versao = library_cache.versao(_chave_biblioteca(usuario))
+            novo = escanear_biblioteca(diretorio)
+            novo.versao = versao
+            self._snapshots[usuario] = novo
+        self._gravar(usuario, novo)
+        return novo
+
+    def aquecer(self, usuarios, max_workers=4, reconstruir=False):
+        """Carrega (ou reconstrói) as bibliotecas de vários usuários em paralelo."""
+        def _carregar(item):
+            usuario, diretorio = item
+            try:
+                if reconstruir:
+                    self.reconstruir(usuario, diretorio)
+                else:
+                    self.obter(usuario, diretorio)
+                return True
+            except OSError as e:
+                logger.warning(f"Biblioteca de '{usuario}' indisponível: {e}")
+                return False
+
+        inicio = time.time()
+        usuarios = [(u, d) for u, d in usuarios if d]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='biblioteca') as executor:
+            prontas = sum(executor.map(_carregar, usuarios))
+        logger.info(f"{prontas} de {len(usuarios)} biblioteca(s) carregada(s) em {time.time() - inicio:.1f}s.")
+        return prontas
+
+indice_de_bibliotecas = IndiceDeBibliotecas()
+
+def musicas_da_biblioteca(usuario, diretorio):
+    """Faixas do diretório do usuário em ordem alfabética, servidas pelo snapshot."""
+    try:
+        return indice_de_bibliotecas.obter(usuario, diretorio).musicas
+    except FileNotFoundError:
+        return ()
+
+def aquecer_bibliotecas(max_workers=None, reconstruir=False):
+    """Carrega os snapshots de todos os usuários para o primeiro acesso não escanear."""
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT usuario, diretorio FROM usuario")
+        usuarios = cursor.fetchall()
+        cursor.close()
+    finally:
+        conn.close()
+    return indice_de_bibliotecas.aquecer(usuarios, max_workers or config.library_scan_workers, reconstruir)
+
 #############################################################################
 #                  FUNÇÕES AUXILIARES DE BANCO (TABELA usuario)
 #############################################################################
@@ -526,391 +2243,2839 @@ def get_diretorio_do_usuario(usuario):
 #                  FUNÇÕES AUXILIARES DE BANCO (TABELA fila)
 #############################################################################
 
-def ja_tem_baixando():
+def atualizar_status_fila(id_registro, novo_status):
     try:
         conn = get_db_connection()
         if not conn:
-            return False
+            return
         cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM fila WHERE status = 'baixando'")
-        (count,) = cursor.fetchone()
+        sql = "UPDATE fila SET status = %s WHERE id = %s"
+        cursor.execute(sql, (novo_status, id_registro))
+        conn.commit()
         cursor.close()
         conn.close()
-        return (count > 0)
     except Exception as e:
-        logger.error(f"Erro ao verificar status 'baixando' na fila: {e}")
-        return False
+        logger.error(f"Erro ao atualizar status da fila: {e}")
 
-def pegar_proximo_em_fila():
+def listar_fila_paginada(usuario, status=None, antes=None, limite=DOWNLOADS_POR_PAGINA):
+    """
+    Jobs do usuário (fila e histórico), do mais recente para o mais antigo,
+    paginados por chave: `antes` é o menor ID da página anterior. Retorna
+    (itens, id para a próxima página ou None).
+    """
+    sql, params = sql_fila_paginada(usuario, status, antes, limite)
     try:
         conn = get_db_connection()
         if not conn:
-            return None
+            return [], None
         cursor = conn.cursor(dictionary=True)
-        sql = """SELECT id, usuario, caminho 
-                 FROM fila
-                 WHERE status = 'em fila'
-                 ORDER BY id ASC
-                 LIMIT 1"""
-        cursor.execute(sql)
-        row = cursor.fetchone()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
         cursor.close()
         conn.close()
-        if row:
-            return (row['id'], row['usuario'], row['caminho'])
-        return None
+        if len(rows) > limite:
+            return rows[:limite], rows[limite - 1]['id']
+        return rows, None
     except Exception as e:
-        logger.error(f"Erro ao pegar próximo em fila: {e}")
-        return None
+        logger.error(f"Erro ao listar fila: {e}")
+        return [], None
 
-def atualizar_status_fila(id_registro, novo_status):
+def resumo_da_fila(usuario):
+    """Quantidade de jobs do usuário por status, contada no índice (usuario, status, id)."""
     try:
         conn = get_db_connection()
         if not conn:
-            return
+            return {}
         cursor = conn.cursor()
-        sql = "UPDATE fila SET status = %s WHERE id = %s"
-        cursor.execute(sql, (novo_status, id_registro))
-        conn.commit()
+        resumo = {}
+        for tabela in ('fila', 'fila_historico'):
+            cursor.execute(SQL_RESUMO_DA_FILA.format(tabela=tabela), (usuario,))
+            for status, quantidade in cursor.fetchall():
+                resumo[status] = resumo.get(status, 0) + quantidade
         cursor.close()
         conn.close()
+        return resumo
     except Exception as e:
-        logger.error(f"Erro ao atualizar status da fila: {e}")
+        logger.error(f"Erro ao resumir a fila: {e}")
+        return {}
 
-def listar_fila(usuario):
+def arquivar_fila():
+    """
+    Move para fila_historico os jobs encerrados ('Baixado'/'Erro') há mais
+    de config.queue_archive_after_days dias, em lotes. Retorna quantos moveu.
+    """
+    if not config.queue_archive_after_days or config.queue_archive_after_days <= 0:
+        return 0
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    total = 0
     try:
-        conn = get_db_connection()
-        if not conn:
-            return []
-        cursor = conn.cursor(dictionary=True)
-        sql = "SELECT id, usuario, caminho, status FROM fila WHERE usuario = %s"
-        cursor.execute(sql, (usuario,))
-        rows = cursor.fetchall()
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(SQL_JOBS_A_ARQUIVAR, (config.queue_archive_after_days, LOTE_MAX_PARAMETROS))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            marcadores = _placeholders(len(ids))
+            # INSERT sem IGNORE: um ID já existente no histórico (fila truncada ou
+            # restaurada) falha o lote inteiro, em vez de o job ser apagado sem cópia
+            cursor.execute(f"""
+                INSERT INTO fila_historico
+                    (id, usuario, caminho, status, prioridade, tamanho, tentativas, criado_em, concluido_em)
+                SELECT id, usuario, caminho, status, prioridade, tamanho, tentativas, criado_em, atualizado_em
+                FROM fila WHERE id IN ({marcadores})
+            """, tuple(ids))
+            cursor.execute(f"DELETE FROM fila WHERE id IN ({marcadores})", tuple(ids))
+            conn.commit()
+            total += len(ids)
         cursor.close()
-        conn.close()
-        return rows
+        if total:
+            logger.info(f"{total} job(s) encerrado(s) movido(s) para o histórico da fila.")
+        return total
     except Exception as e:
-        logger.error(f"Erro ao listar fila: {e}")
-        return []
+        conn.rollback()
+        logger.error(f"Erro ao arquivar a fila (lote desfeito, jobs mantidos na fila): {e}")
+        return total
+    finally:
+        conn.close()
 
 def inserir_fila(usuario, caminho):
     try:
         conn = get_db_connection()
         if not conn:
-            return
+            return None
         cursor = conn.cursor()
         sql = "INSERT INTO fila (usuario, caminho, status) VALUES (%s, %s, %s)"
         cursor.execute(sql, (usuario, caminho, "em fila"))
+        id_reg = cursor.lastrowid
         conn.commit()
         cursor.close()
         conn.close()
         logger.info(f"Item inserido na fila para o usuário '{usuario}'.")
+        fila_executor.submit(estimar_tamanho_do_job, id_reg, caminho)
+        return id_reg
     except Exception as e:
         logger.error(f"Erro ao inserir na fila: {e}")
+        return None
 
 #############################################################################
-#                  FUNÇÕES AUXILIARES DE BANCO (TABELA favorites)
+#                  AGENDAMENTO DA FILA (PRIORIDADE E PARTILHA JUSTA)
 #############################################################################
 
-def adicionar_favorito(usuario, musica):
+fila_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='fila')
+# Acorda o loop da fila quando um job entra ou termina
+fila_evento = threading.Event()
+
+def estimar_tamanho_do_job(id_reg, caminho):
+    """Grava o número de entradas da URL (resolução flat) para o agendador."""
+    try:
+        tamanho = len(listar_ids_da_url(caminho)) or 1
+    except Exception as e:
+        logger.warning(f"Não foi possível estimar o tamanho do job {id_reg}: {e}")
+        return
+    conn = get_db_connection()
+    if not conn:
+        return
     try:
-        conn = get_db_connection()
-        if not conn:
-            return
         cursor = conn.cursor()
-        sql = "INSERT INTO favorites (usuario, musica) VALUES (%s, %s)"
-        cursor.execute(sql, (usuario, musica))
+        cursor.execute("UPDATE fila SET tamanho = %s WHERE id = %s", (tamanho, id_reg))
         conn.commit()
         cursor.close()
-        conn.close()
-        logger.info(f"Música '{musica}' adicionada aos favoritos do usuário '{usuario}'.")
-    except mysql.connector.IntegrityError:
-        logger.warning(f"Música '{musica}' já está nos favoritos do usuário '{usuario}'.")
     except Exception as e:
-        logger.error(f"Erro ao adicionar favorito: {e}")
+        logger.error(f"Erro ao gravar o tamanho do job {id_reg}: {e}")
     finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+        conn.close()
+    fila_evento.set()
 
-def remover_favorito(usuario, musica):
+def cabecas_da_fila():
+    """
+    Próximo job de cada usuário com itens em fila (maior prioridade, depois
+    o menor job), numa única consulta: ROW_NUMBER() por usuário sobre a faixa
+    status = 'em fila' do índice idx_fila_agenda, que já está nessa ordem.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return []
     try:
-        conn = get_db_connection()
-        if not conn:
-            return
-        cursor = conn.cursor()
-        sql = "DELETE FROM favorites WHERE usuario = %s AND musica = %s"
-        cursor.execute(sql, (usuario, musica))
-        conn.commit()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(SQL_CABECAS_DA_FILA, ('em fila',))
+        cabecas = cursor.fetchall()
         cursor.close()
-        conn.close()
-        logger.info(f"Música '{musica}' removida dos favoritos do usuário '{usuario}'.")
+        return cabecas
     except Exception as e:
-        logger.error(f"Erro ao remover favorito: {e}")
+        logger.error(f"Erro ao consultar a fila: {e}")
+        return []
     finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+        conn.close()
 
-def esta_favorito(usuario, musica):
+def reservar_job_da_fila(id_reg):
+    """Passa o job de 'em fila' para 'baixando'; False se outro worker já o pegou."""
+    conn = get_db_connection()
+    if not conn:
+        return False
     try:
-        conn = get_db_connection()
-        if not conn:
-            return False
         cursor = conn.cursor()
-        sql = "SELECT COUNT(*) FROM favorites WHERE usuario = %s AND musica = %s"
-        cursor.execute(sql, (usuario, musica))
-        (count,) = cursor.fetchone()
+        cursor.execute("UPDATE fila SET status = 'baixando' WHERE id = %s AND status = 'em fila'", (id_reg,))
+        reservado = cursor.rowcount == 1
+        conn.commit()
         cursor.close()
+        return reservado
+    finally:
         conn.close()
-        return count > 0
-    except Exception as e:
-        logger.error(f"Erro ao verificar favorito: {e}")
-        return False
 
-def listar_favoritos(usuario):
+class AgendadorDaFila:
+    """
+    Weighted fair queuing entre usuários. Cada usuário acumula um tempo
+    virtual de serviço (custo do job / peso do usuário); vence a maior
+    prioridade e, no empate, o menor tempo virtual de término, o que também
+    favorece jobs curtos. Jobs de tamanho ainda desconhecido custam 1.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._termino = {}  # usuario -> tempo virtual de término do último job
+        self._tempo_virtual = 0.0
+
+    def _inicio(self, usuario):
+        # Usuário que ficou ocioso não acumula crédito
+        return max(self._tempo_virtual, self._termino.get(usuario, 0.0))
+
+    def _custo(self, registro):
+        peso = config.queue_user_weights.get(registro['usuario'], 1) or 1
+        return (registro['tamanho'] or 1) / peso
+
+    def escolher(self, cabecas):
+        with self._lock:
+            if not cabecas:
+                return None
+            return min(cabecas, key=lambda r: (
+                -r['prioridade'], self._inicio(r['usuario']) + self._custo(r), r['id']
+            ))
+
+    def registrar(self, registro):
+        with self._lock:
+            inicio = self._inicio(registro['usuario'])
+            self._termino[registro['usuario']] = inicio + self._custo(registro)
+            self._tempo_virtual = inicio
+
+    def estado(self):
+        with self._lock:
+            return {'tempo_virtual': self._tempo_virtual, 'termino_por_usuario': dict(self._termino)}
+
+agendador_da_fila = AgendadorDaFila()
+
+def proximo_job_da_fila():
+    """Escolhe e reserva o próximo job; None se a fila estiver vazia."""
+    for _ in range(3):
+        registro = agendador_da_fila.escolher(cabecas_da_fila())
+        if not registro:
+            return None
+        if reservar_job_da_fila(registro['id']):
+            agendador_da_fila.registrar(registro)
+            return registro
+    return None
+
+def listar_fila_admin():
+    """Jobs em andamento, em fila, aguardando nova tentativa e pausados de todos os usuários."""
+    conn = get_db_connection()
+    if not conn:
+        return []
     try:
-        conn = get_db_connection()
-        if not conn:
-            return []
-        cursor = conn.cursor()
-        sql = "SELECT musica FROM favorites WHERE usuario = %s"
-        cursor.execute(sql, (usuario,))
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, usuario, caminho, status, prioridade, tamanho FROM fila
+            WHERE status IN ('baixando', 'em fila', 'aguardando', 'pausado')
+            ORDER BY status, prioridade DESC, tamanho, id
+        """)
         rows = cursor.fetchall()
         cursor.close()
-        conn.close()
-        return [row[0] for row in rows]
+        return rows
     except Exception as e:
-        logger.error(f"Erro ao listar favoritos: {e}")
+        logger.error(f"Erro ao listar a fila: {e}")
         return []
+    finally:
+        conn.close()
 
-#############################################################################
-#                  FUNÇÕES AUXILIARES DE BANCO (PLAYLISTS)
-#############################################################################
-
-def criar_playlist(usuario, nome_playlist):
+def alterar_job_da_fila(id_reg, prioridade=None, acao=None):
     """
-    Cria uma nova playlist para o usuário, caso ainda não exista com esse nome.
+    Altera a prioridade e/ou pausa ('pausar') / retoma ('retomar') um job
+    que ainda não começou. Retorna False se o job não estiver em um estado
+    compatível.
     """
+    conn = get_db_connection()
+    if not conn:
+        return False
     try:
-        conn = get_db_connection()
-        if not conn:
-            return False
         cursor = conn.cursor()
-        # Verifica se já existe
-        cursor.execute("SELECT COUNT(*) FROM playlist WHERE usuario=%s AND nome=%s",
-                       (usuario, nome_playlist))
-        (count,) = cursor.fetchone()
-        if count == 0:
-            cursor.execute("INSERT INTO playlist (usuario, nome) VALUES (%s, %s)",
-                           (usuario, nome_playlist))
-            conn.commit()
-            logger.info(f"Playlist '{nome_playlist}' criada para '{usuario}'.")
-        else:
-            logger.info(f"Playlist '{nome_playlist}' já existe para '{usuario}'.")
+        cursor.execute("SELECT status FROM fila WHERE id = %s", (id_reg,))
+        row = cursor.fetchone()
+        if not row or row[0] not in ('em fila', 'pausado'):
+            cursor.close()
+            return False
+        if prioridade is not None:
+            cursor.execute("UPDATE fila SET prioridade = %s WHERE id = %s", (prioridade, id_reg))
+        if acao == 'pausar':
+            cursor.execute("UPDATE fila SET status = 'pausado' WHERE id = %s AND status = 'em fila'", (id_reg,))
+        elif acao == 'retomar':
+            cursor.execute("UPDATE fila SET status = 'em fila' WHERE id = %s AND status = 'pausado'", (id_reg,))
+        conn.commit()
         cursor.close()
-        conn.close()
-        return True
     except Exception as e:
-        logger.error(f"Erro ao criar playlist: {e}")
+        conn.rollback()
+        logger.error(f"Erro ao alterar o job {id_reg} da fila: {e}")
         return False
+    finally:
+        conn.close()
+    fila_evento.set()
+    return True
 
-def get_playlist_id(usuario, nome_playlist):
-    """ Retorna o ID da playlist, ou None se não encontrar. """
+#############################################################################
+#                  JOBS RETOMÁVEIS (ESTADO POR ENTRADA E TENTATIVAS)
+#############################################################################
+
+# Um job 'baixando' sem sinal de vida por mais tempo que isso volta para a fila
+JOB_SEM_SINAL_SEGUNDOS = 120
+ESPERA_MAXIMA_TENTATIVA = 3600
+
+class ErroTransitorio(Exception):
+    """Falha que justifica uma nova tentativa do job mais tarde."""
+
+def _erro_transitorio(e):
+    if isinstance(e, yt_dlp.utils.DownloadError) and e.exc_info:
+        e = e.exc_info[1]
+    if isinstance(e, HTTPError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (ErroTransitorio, TransportError, ConnectionError, TimeoutError))
+
+def registrar_entradas_do_job(id_fila, ids):
+    """Cria o estado 'pendente' das entradas ainda não registradas do job."""
+    conn = get_db_connection()
+    if not conn:
+        raise ErroTransitorio("Banco de dados indisponível")
     try:
-        conn = get_db_connection()
-        if not conn:
-            return None
         cursor = conn.cursor()
-        cursor.execute("SELECT id FROM playlist WHERE usuario=%s AND nome=%s",
-                       (usuario, nome_playlist))
-        row = cursor.fetchone()
+        # Com IDs repetidos na playlist, o INSERT IGNORE mantém a primeira posição
+        linhas = [(id_fila, source_id, posicao) for posicao, source_id in enumerate(ids)]
+        for bloco in _em_blocos(linhas, LOTE_MAX_PARAMETROS // 3):
+            cursor.execute(
+                f"INSERT IGNORE INTO fila_entrada (fila_id, source_id, posicao) VALUES "
+                f"{', '.join(['(%s, %s, %s)'] * len(bloco))}",
+                tuple(v for linha in bloco for v in linha)
+            )
+        conn.commit()
         cursor.close()
+    finally:
         conn.close()
-        if row:
-            return row[0]
-        return None
-    except Exception as e:
-        logger.error(f"Erro ao obter ID da playlist: {e}")
-        return None
 
-def adicionar_musica_playlist(playlist_id, musica):
-    """
-    Adiciona a música na tabela playlist_musica, se não estiver presente.
-    """
+def ids_pendentes_do_job(id_fila):
+    conn = get_db_connection()
+    if not conn:
+        raise ErroTransitorio("Banco de dados indisponível")
     try:
-        conn = get_db_connection()
-        if not conn:
-            return
         cursor = conn.cursor()
-        # Verifica se já existe
-        cursor.execute(
-            "SELECT COUNT(*) FROM playlist_musica WHERE playlist_id=%s AND musica=%s",
-            (playlist_id, musica)
-        )
-        (count,) = cursor.fetchone()
-        if count == 0:
+        cursor.execute("SELECT source_id FROM fila_entrada WHERE fila_id = %s AND status = 'pendente'", (id_fila,))
+        pendentes = {row[0] for row in cursor.fetchall()}
+        cursor.close()
+        return pendentes
+    finally:
+        conn.close()
+
+def marcar_entradas_concluidas(id_fila, ids):
+    ids = list(ids)
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        for bloco in _em_blocos(ids):
             cursor.execute(
-                "INSERT INTO playlist_musica (playlist_id, musica) VALUES (%s, %s)",
-                (playlist_id, musica)
+                f"UPDATE fila_entrada SET status = 'concluida' "
+                f"WHERE fila_id = %s AND source_id IN ({_placeholders(len(bloco))})",
+                (id_fila, *bloco)
             )
-            conn.commit()
-            logger.info(f"Música '{musica}' adicionada na playlist (ID={playlist_id}).")
-        else:
-            logger.info(f"Música '{musica}' já existe na playlist (ID={playlist_id}).")
+        conn.commit()
         cursor.close()
-        conn.close()
     except Exception as e:
-        logger.error(f"Erro ao adicionar música na playlist: {e}")
+        logger.error(f"Erro ao marcar entradas concluídas do job {id_fila}: {e}")
+    finally:
+        conn.close()
 
-def remover_musica_playlist(playlist_id, musica):
+def encerrar_passada_do_job(id_fila):
     """
-    Remove a música da tabela playlist_musica.
+    Conta uma tentativa para as entradas que continuam pendentes (desistindo
+    das que esgotaram as tentativas) e retorna {status: quantidade}.
     """
+    conn = get_db_connection()
+    if not conn:
+        raise ErroTransitorio("Banco de dados indisponível")
     try:
-        conn = get_db_connection()
-        if not conn:
-            return
         cursor = conn.cursor()
-        cursor.execute(
-            "DELETE FROM playlist_musica WHERE playlist_id=%s AND musica=%s",
-            (playlist_id, musica)
-        )
+        cursor.execute("UPDATE fila_entrada SET tentativas = tentativas + 1 "
+                       "WHERE fila_id = %s AND status = 'pendente'", (id_fila,))
+        cursor.execute("UPDATE fila_entrada SET status = 'erro' "
+                       "WHERE fila_id = %s AND status = 'pendente' AND tentativas >= %s",
+                       (id_fila, config.download_max_retries))
+        cursor.execute("SELECT status, COUNT(*) FROM fila_entrada WHERE fila_id = %s GROUP BY status", (id_fila,))
+        contagem = dict(cursor.fetchall())
         conn.commit()
         cursor.close()
+        return contagem
+    finally:
         conn.close()
-        logger.info(f"Música '{musica}' removida da playlist (ID={playlist_id}).")
-    except Exception as e:
-        logger.error(f"Erro ao remover música da playlist: {e}")
 
-def listar_playlists_do_usuario(usuario):
+def agendar_nova_tentativa(id_fila):
     """
-    Retorna uma lista de dicionários: [ {'id': 1, 'nome': 'Rock'}, ... ]
+    Devolve o job à fila depois de uma espera exponencial ('aguardando').
+    Retorna False se as tentativas do job se esgotaram.
     """
+    conn = get_db_connection()
+    if not conn:
+        return False
     try:
-        conn = get_db_connection()
-        if not conn:
-            return []
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, nome FROM playlist WHERE usuario=%s", (usuario,))
-        rows = cursor.fetchall()
+        cursor = conn.cursor()
+        cursor.execute("SELECT tentativas FROM fila WHERE id = %s", (id_fila,))
+        row = cursor.fetchone()
+        if not row or row[0] >= config.download_max_retries:
+            cursor.close()
+            return False
+        espera = min(config.download_retry_backoff * 2 ** row[0], ESPERA_MAXIMA_TENTATIVA)
+        cursor.execute("""
+            UPDATE fila SET status = 'aguardando', tentativas = tentativas + 1,
+                proxima_tentativa = NOW() + INTERVAL %s SECOND
+            WHERE id = %s
+        """, (espera, id_fila))
+        conn.commit()
         cursor.close()
-        conn.close()
-        return rows
+        logger.info(f"Job {id_fila}: tentativa {row[0] + 1} de {config.download_max_retries} em {espera}s.")
+        return True
     except Exception as e:
-        logger.error(f"Erro ao listar playlists do usuário: {e}")
-        return []
+        logger.error(f"Erro ao agendar nova tentativa do job {id_fila}: {e}")
+        return False
+    finally:
+        conn.close()
 
-def listar_musicas_da_playlist(playlist_id):
+def manutencao_da_fila(ids_ativos):
     """
-    Retorna todas as músicas vinculadas a uma playlist.
+    A cada ciclo do loop: renova o sinal de vida dos jobs deste processo,
+    devolve à fila os jobs 'baixando' abandonados (processo morto ou
+    /shutdown) e os 'aguardando' cuja espera terminou.
     """
+    conn = get_db_connection()
+    if not conn:
+        return
     try:
-        conn = get_db_connection()
-        if not conn:
-            return []
         cursor = conn.cursor()
-        cursor.execute("SELECT musica FROM playlist_musica WHERE playlist_id=%s", (playlist_id,))
-        rows = cursor.fetchall()
+        for bloco in _em_blocos(list(ids_ativos)):
+            cursor.execute(
+                f"UPDATE fila SET atualizado_em = CURRENT_TIMESTAMP WHERE id IN ({_placeholders(len(bloco))})",
+                tuple(bloco)
+            )
+        cursor.execute("""
+            UPDATE fila SET status = 'em fila'
+            WHERE status = 'baixando' AND atualizado_em < NOW() - INTERVAL %s SECOND
+        """, (JOB_SEM_SINAL_SEGUNDOS,))
+        if cursor.rowcount:
+            logger.warning(f"{cursor.rowcount} job(s) interrompido(s) devolvido(s) à fila.")
+        cursor.execute("""
+            UPDATE fila SET status = 'em fila', proxima_tentativa = NULL
+            WHERE status = 'aguardando' AND proxima_tentativa <= NOW()
+        """)
+        conn.commit()
         cursor.close()
-        conn.close()
-        return [row[0] for row in rows]
     except Exception as e:
-        logger.error(f"Erro ao listar músicas da playlist: {e}")
-        return []
+        logger.error(f"Erro na manutenção da fila: {e}")
+    finally:
+        conn.close()
 
 #############################################################################
-#                      FUNÇÃO DE DOWNLOAD (yt-dlp)
+#                  FUNÇÕES AUXILIARES DE BANCO (TABELA track)
 #############################################################################
 
-def baixar_videos_para_mp3(playlist_url, pasta_destino):
-    try:
-        if not os.path.exists(pasta_destino):
-            os.makedirs(pasta_destino)
+EXTENSOES_AUDIO = ('.mp3', '.wav', '.ogg', '.m4a', '.opus', '.webm', '.aac')
 
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': os.path.join(pasta_destino, '%(title)s.%(ext)s'),
-            'writethumbnail': True,
-            'postprocessors': [
-                {
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                },
-                {
-                    'key': 'FFmpegThumbnailsConvertor',
-                    'format': 'jpg'
-                },
-            ],
-            'ffmpeg_location': config.ffmpeg_path,
-            'quiet': False,
-            'ignoreerrors': True,
-        }
+# Tipos servidos para os contêineres gerados pelos perfis de remux
+for _ext, _tipo in (('.m4a', 'audio/mp4'), ('.opus', 'audio/ogg'), ('.webm', 'audio/webm'), ('.aac', 'audio/aac')):
+    mimetypes.add_type(_tipo, _ext)
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([playlist_url])
-        logger.info(f"Download concluído para URL: {playlist_url}")
+def obter_ou_criar_track_id(cursor, usuario, musica):
+    """
+    Retorna o ID da faixa (usuario, filename), criando-a se necessário,
+    numa única ida ao banco.
+    """
+    cursor.execute("""
+        INSERT INTO track (usuario, filename) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+    """, (usuario, musica))
+    return cursor.lastrowid
+
+def remover_tracks(usuario, musicas):
+    """
+    Exclui as faixas do usuário; favoritos e itens de playlist são removidos
+    pelo ON DELETE CASCADE. Retorna a quantidade de faixas removidas ou None.
+    """
+    musicas = list(dict.fromkeys(musicas))
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        removidas = 0
+        bytes_liberados = 0
+        media_ids = set()
+        for bloco in _em_blocos(musicas):
+            cursor.execute(
+                f"SELECT media_id, size FROM track WHERE usuario = %s "
+                f"AND filename IN ({_placeholders(len(bloco))})",
+                (usuario, *bloco)
+            )
+            for media_id, size in cursor.fetchall():
+                if media_id:
+                    media_ids.add(media_id)
+                bytes_liberados += size or 0
+            cursor.execute(
+                f"DELETE FROM track WHERE usuario = %s AND filename IN ({_placeholders(len(bloco))})",
+                (usuario, *bloco)
+            )
+            removidas += cursor.rowcount
+        ajustar_uso_de_armazenamento(cursor, usuario, -bytes_liberados)
+        arquivos_liberados = liberar_midias_sem_referencia(cursor, media_ids)
+        conn.commit()
+        apagar_arquivos_em_background(arquivos_liberados)
+        cursor.close()
+        invalidar_biblioteca(usuario)
+        library_cache.invalidar(_chave_favoritos(usuario))
+        invalidar_playlists_do_usuario(usuario, incluir_musicas=True)
+        return removidas
     except Exception as e:
-        logger.error(f"Erro ao baixar vídeos: {e}")
-        raise e
+        conn.rollback()
+        logger.error(f"Erro ao remover faixas do usuário '{usuario}': {e}")
+        return None
+    finally:
+        conn.close()
+
+@medir_fase('fs')
+def _escanear_diretorio_audio(diretorio):
+    """Retorna {filename: (size, mtime)} dos arquivos de áudio do diretório."""
+    arquivos = {}
+    with os.scandir(diretorio) as it:
+        for entry in it:
+            if entry.name.lower().endswith(EXTENSOES_AUDIO) and entry.is_file():
+                st = entry.stat()
+                arquivos[entry.name] = (st.st_size, st.st_mtime)
+    return arquivos
+
+# Acima disso, remoções em massa numa sincronização são tratadas como diretório
+# indisponível e recusadas
+SINCRONIZACAO_MAX_FRACAO_REMOVIDA = 0.5
+SINCRONIZACAO_MIN_REMOCOES_SUSPEITAS = 20
+
+def sincronizar_tracks(usuario, diretorio):
+    """
+    Reconcilia a tabela track com o diretório do usuário: cria/atualiza as
+    faixas presentes no disco e remove as que não existem mais, exceto quando
+    o diretório parece vazio ou desmontado.
+    """
+    if not diretorio or not os.path.isdir(diretorio):
+        logger.warning(f"Diretório '{diretorio}' indisponível; sincronização de faixas ignorada.")
+        return False
+    try:
+        arquivos = _escanear_diretorio_audio(diretorio)
+    except OSError as e:
+        logger.error(f"Erro ao escanear o diretório '{diretorio}': {e}")
+        return False
+
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SQL_FAIXAS_DO_USUARIO, (usuario,))
+        no_banco = {row[1]: row for row in cursor.fetchall()}
+
+        alterados = [
+            (usuario, nome, size, mtime)
+            for nome, (size, mtime) in arquivos.items()
+            if nome not in no_banco or no_banco[nome][2] != size or no_banco[nome][3] != mtime
+        ]
+        ausentes = {nome: row for nome, row in no_banco.items() if nome not in arquivos}
+        if ausentes and (not arquivos or (len(ausentes) >= SINCRONIZACAO_MIN_REMOCOES_SUSPEITAS and
+                                          len(ausentes) > len(no_banco) * SINCRONIZACAO_MAX_FRACAO_REMOVIDA)):
+            # Diretório vazio ou quase (ex.: NAS desmontado): apagar as faixas levaria
+            # junto favoritos e playlists pelo ON DELETE CASCADE
+            logger.error(
+                f"Sincronização de '{usuario}': {len(ausentes)} de {len(no_banco)} faixa(s) sumiram de "
+                f"'{diretorio}'; remoção recusada. Verifique se o diretório está montado."
+            )
+            ausentes = {}
+        removidos = [row[0] for row in ausentes.values()]
+        media_ids = {row[4] for row in ausentes.values() if row[4]}
+        # Variação do uso: tamanho novo das faixas alteradas menos o que o banco registrava
+        delta = sum(size - ((no_banco[nome][2] or 0) if nome in no_banco else 0)
+                    for _, nome, size, _ in alterados)
+        delta -= sum(row[2] or 0 for row in ausentes.values())
+
+        for bloco in _em_blocos(alterados, LOTE_MAX_PARAMETROS // 4):
+            cursor.execute(
+                f"INSERT INTO track (usuario, filename, size, mtime) VALUES "
+                f"{', '.join(['(%s, %s, %s, %s)'] * len(bloco))} "
+                f"ON DUPLICATE KEY UPDATE size = VALUES(size), mtime = VALUES(mtime)",
+                tuple(v for linha in bloco for v in linha)
+            )
+        for bloco in _em_blocos(removidos):
+            cursor.execute(
+                f"DELETE FROM track WHERE id IN ({_placeholders(len(bloco))})",
+                tuple(bloco)
+            )
+        ajustar_uso_de_armazenamento(cursor, usuario, delta)
+        arquivos_liberados = liberar_midias_sem_referencia(cursor, media_ids)
+        conn.commit()
+        apagar_arquivos_em_background(arquivos_liberados)
+        cursor.close()
+        if alterados or removidos:
+            invalidar_biblioteca(usuario)
+        if removidos:
+            library_cache.invalidar(_chave_favoritos(usuario))
+            invalidar_playlists_do_usuario(usuario, incluir_musicas=True)
+        logger.info(
+            f"Faixas de '{usuario}' sincronizadas: {len(alterados)} nova(s)/alterada(s), "
+            f"{len(removidos)} removida(s)."
+        )
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao sincronizar faixas do usuário '{usuario}': {e}")
+        return False
+    finally:
+        conn.close()
+
+#############################################################################
+#                  COTAS DE ARMAZENAMENTO POR USUÁRIO
+#############################################################################
+
+class CotaExcedida(yt_dlp.utils.DownloadCancelled):
+    """Cota de armazenamento do usuário esgotada: interrompe o job sem nova tentativa."""
+    # O yt-dlp recria a exceção sem argumentos quando o filtro barra a playlist inteira
+    msg = 'Cota de armazenamento esgotada'
+
+def ajustar_uso_de_armazenamento(cursor, usuario, delta):
+    """
+    Soma `delta` bytes ao uso do usuário na mesma transação que alterou a
+    tabela track, mantendo o contador em dia sem escanear o disco.
+    """
+    if not delta:
+        return
+    cursor.execute("""
+        INSERT INTO uso_armazenamento (usuario, bytes) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE bytes = bytes + VALUES(bytes)
+    """, (usuario, int(delta)))
+
+def quota_do_usuario(usuario):
+    """Cota do usuário em bytes (None = sem limite)."""
+    quota = config.storage_user_quotas.get(usuario, config.storage_quota_bytes)
+    return int(quota) if quota else None
+
+def uso_de_armazenamento(usuario):
+    """Bytes usados pelo usuário segundo o contador (None se o banco falhar)."""
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SQL_USO_DE_ARMAZENAMENTO, (usuario,))
+        row = cursor.fetchone()
+        cursor.close()
+        return max(0, int(row[0])) if row else 0
+    except Exception as e:
+        logger.error(f"Erro ao consultar o uso de armazenamento de '{usuario}': {e}")
+        return None
+    finally:
+        conn.close()
+
+def espaco_livre(usuario):
+    """
+    Bytes que ainda cabem na cota do usuário. None sem cota ou com o banco
+    indisponível: nesses casos nada é bloqueado.
+    """
+    quota = quota_do_usuario(usuario)
+    if quota is None:
+        return None
+    uso = uso_de_armazenamento(usuario)
+    if uso is None:
+        return None
+    return max(0, quota - uso)
+
+def cota_excedida(usuario, adicionais=0):
+    """True se a cota está esgotada ou não comporta mais `adicionais` bytes."""
+    livre = espaco_livre(usuario)
+    return livre is not None and (livre == 0 or adicionais > livre)
+
+def estado_da_cota(usuario):
+    """Resumo do uso e da cota do usuário para a API."""
+    uso = uso_de_armazenamento(usuario)
+    quota = quota_do_usuario(usuario)
+    limitado = quota is not None and uso is not None
+    return {
+        'used': uso,
+        'quota': quota,
+        'available': max(0, quota - uso) if limitado else None,
+        'percent': round(100 * uso / quota, 1) if limitado else None,
+    }
+
+def listar_uso_de_armazenamento():
+    """Uso, cota e última reconciliação de todos os usuários, do maior para o menor."""
+    conn = get_db_connection()
+    if not conn:
+        return []
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT usuario, bytes, reconciliado_em FROM uso_armazenamento ORDER BY bytes DESC")
+        linhas = cursor.fetchall()
+        cursor.close()
+    except Exception as e:
+        logger.error(f"Erro ao listar o uso de armazenamento: {e}")
+        return []
+    finally:
+        conn.close()
+    for linha in linhas:
+        linha['quota'] = quota_do_usuario(linha['usuario'])
+        if linha['reconciliado_em']:
+            linha['reconciliado_em'] = linha['reconciliado_em'].strftime('%Y-%m-%d %H:%M:%S')
+    return linhas
+
+def reconciliar_uso_de_armazenamento():
+    """
+    Recalcula o uso de cada usuário a partir da tabela track e corrige os
+    contadores que divergiram (arquivos trocados fora do app, ajustes
+    perdidos). Retorna {usuario: bytes corrigidos}.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return {}
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT usuario, COALESCE(SUM(size), 0) FROM track GROUP BY usuario")
+        somas = {usuario: int(total) for usuario, total in cursor.fetchall()}
+        cursor.execute("SELECT usuario, bytes FROM uso_armazenamento")
+        contadores = {usuario: int(total) for usuario, total in cursor.fetchall()}
+        divergencias = {
+            usuario: somas.get(usuario, 0) - contadores.get(usuario, 0)
+            for usuario in somas.keys() | contadores.keys()
+            if somas.get(usuario, 0) != contadores.get(usuario, 0)
+        }
+        for usuario, diferenca in divergencias.items():
+            # A soma é refeita na própria escrita para não sobrescrever ajustes
+            # feitos entre a leitura acima e esta correção
+            cursor.execute("""
+                INSERT INTO uso_armazenamento (usuario, bytes)
+                SELECT %s, COALESCE(SUM(size), 0) FROM track WHERE usuario = %s
+                ON DUPLICATE KEY UPDATE bytes = VALUES(bytes)
+            """, (usuario, usuario))
+            logger.warning(f"Uso de armazenamento de '{usuario}' corrigido em {diferenca:+d} bytes.")
+        cursor.execute("UPDATE uso_armazenamento SET reconciliado_em = NOW()")
+        conn.commit()
+        cursor.close()
+        logger.info(f"Uso de armazenamento reconciliado: {len(divergencias)} contador(es) corrigido(s).")
+        return divergencias
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao reconciliar o uso de armazenamento: {e}")
+        return {}
+    finally:
+        conn.close()
+
+#############################################################################
+#                  FUNÇÕES AUXILIARES DE BANCO (TABELA favorites)
+#############################################################################
+
+def adicionar_favorito(usuario, musica):
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return
+        cursor = conn.cursor()
+        track_id = obter_ou_criar_track_id(cursor, usuario, musica)
+        sql = "INSERT INTO favorites (usuario, track_id) VALUES (%s, %s)"
+        cursor.execute(sql, (usuario, track_id))
+        conn.commit()
+        cursor.close()
+        conn.close()
+        library_cache.invalidar(_chave_favoritos(usuario))
+        logger.info(f"Música '{musica}' adicionada aos favoritos do usuário '{usuario}'.")
+    except mysql.connector.IntegrityError:
+        logger.warning(f"Música '{musica}' já está nos favoritos do usuário '{usuario}'.")
+    except Exception as e:
+        logger.error(f"Erro ao adicionar favorito: {e}")
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+def remover_favorito(usuario, musica):
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return
+        cursor = conn.cursor()
+        cursor.execute(SQL_REMOVER_FAVORITO, (usuario, musica))
+        conn.commit()
+        cursor.close()
+        conn.close()
+        library_cache.invalidar(_chave_favoritos(usuario))
+        logger.info(f"Música '{musica}' removida dos favoritos do usuário '{usuario}'.")
+    except Exception as e:
+        logger.error(f"Erro ao remover favorito: {e}")
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+def esta_favorito(usuario, musica):
+    return musica in listar_favoritos(usuario)
+
+def listar_favoritos(usuario):
+    chave = _chave_favoritos(usuario)
+    hit, favoritos = library_cache.obter(chave)
+    if hit:
+        return list(favoritos)
+    versao = library_cache.versao(chave)
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return []
+        cursor = conn.cursor()
+        cursor.execute(SQL_FAVORITOS, (usuario,))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        favoritos = [row[0] for row in rows]
+        library_cache.gravar(chave, tuple(favoritos), versao)
+        return favoritos
+    except Exception as e:
+        logger.error(f"Erro ao listar favoritos: {e}")
+        return []
+
+#############################################################################
+#                  FUNÇÕES AUXILIARES DE BANCO (PLAYLISTS)
+#############################################################################
+
+def criar_playlist(usuario, nome_playlist):
+    """
+    Cria uma nova playlist para o usuário, caso ainda não exista com esse nome.
+    """
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return False
+        cursor = conn.cursor()
+        # Verifica se já existe
+        cursor.execute("SELECT COUNT(*) FROM playlist WHERE usuario=%s AND nome=%s",
+                       (usuario, nome_playlist))
+        (count,) = cursor.fetchone()
+        if count == 0:
+            cursor.execute("INSERT INTO playlist (usuario, nome) VALUES (%s, %s)",
+                           (usuario, nome_playlist))
+            conn.commit()
+            library_cache.invalidar(_chave_playlists(usuario))
+            logger.info(f"Playlist '{nome_playlist}' criada para '{usuario}'.")
+        else:
+            logger.info(f"Playlist '{nome_playlist}' já existe para '{usuario}'.")
+        cursor.close()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao criar playlist: {e}")
+        return False
+
+def get_playlist_id(usuario, nome_playlist):
+    """ Retorna o ID da playlist, ou None se não encontrar. """
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return None
+        cursor = conn.cursor()
+        cursor.execute(SQL_PLAYLIST_POR_NOME, (usuario, nome_playlist))
+        row = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        if row:
+            return row[0]
+        return None
+    except Exception as e:
+        logger.error(f"Erro ao obter ID da playlist: {e}")
+        return None
+
+def adicionar_musica_playlist(playlist_id, musica):
+    """
+    Adiciona a música na tabela playlist_musica, se não estiver presente.
+    Retorna False se a playlist não existe ou em caso de erro.
+    """
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return False
+        cursor = conn.cursor()
+        # A faixa pertence ao dono da playlist
+        cursor.execute("SELECT usuario FROM playlist WHERE id = %s", (playlist_id,))
+        dono = cursor.fetchone()
+        if not dono:
+            cursor.close()
+            conn.close()
+            logger.warning(f"Playlist (ID={playlist_id}) não encontrada ao adicionar '{musica}'.")
+            return False
+        track_id = obter_ou_criar_track_id(cursor, dono[0], musica)
+        cursor.execute(
+            "INSERT IGNORE INTO playlist_musica (playlist_id, track_id) VALUES (%s, %s)",
+            (playlist_id, track_id)
+        )
+        inserida = cursor.rowcount > 0
+        conn.commit()
+        if inserida:
+            library_cache.invalidar(_chave_musicas_playlist(playlist_id))
+            logger.info(f"Música '{musica}' adicionada na playlist (ID={playlist_id}).")
+        else:
+            logger.info(f"Música '{musica}' já existe na playlist (ID={playlist_id}).")
+        cursor.close()
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao adicionar música na playlist: {e}")
+        return False
+
+def remover_musica_playlist(playlist_id, musica):
+    """
+    Remove a música da tabela playlist_musica.
+    """
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return
+        cursor = conn.cursor()
+        cursor.execute("""
+            DELETE pm FROM playlist_musica pm
+            JOIN track t ON t.id = pm.track_id
+            WHERE pm.playlist_id = %s AND t.filename = %s
+        """, (playlist_id, musica))
+        conn.commit()
+        library_cache.invalidar(_chave_musicas_playlist(playlist_id))
+        cursor.close()
+        conn.close()
+        logger.info(f"Música '{musica}' removida da playlist (ID={playlist_id}).")
+    except Exception as e:
+        logger.error(f"Erro ao remover música da playlist: {e}")
+
+def listar_playlists_do_usuario(usuario):
+    """
+    Retorna uma lista de dicionários: [ {'id': 1, 'nome': 'Rock'}, ... ]
+    """
+    chave = _chave_playlists(usuario)
+    hit, playlists = library_cache.obter(chave)
+    if hit:
+        return [dict(p) for p in playlists]
+    versao = library_cache.versao(chave)
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return []
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(SQL_PLAYLISTS_DO_USUARIO, (usuario,))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        library_cache.gravar(chave, tuple(dict(r) for r in rows), versao)
+        return rows
+    except Exception as e:
+        logger.error(f"Erro ao listar playlists do usuário: {e}")
+        return []
+
+def listar_musicas_da_playlist(playlist_id):
+    """
+    Retorna todas as músicas vinculadas a uma playlist.
+    """
+    chave = _chave_musicas_playlist(playlist_id)
+    hit, musicas = library_cache.obter(chave)
+    if hit:
+        return list(musicas)
+    versao = library_cache.versao(chave)
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return []
+        cursor = conn.cursor()
+        cursor.execute(SQL_MUSICAS_DA_PLAYLIST, (playlist_id,))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        musicas = [row[0] for row in rows]
+        library_cache.gravar(chave, tuple(musicas), versao)
+        return musicas
+    except Exception as e:
+        logger.error(f"Erro ao listar músicas da playlist: {e}")
+        return []
+
+#############################################################################
+#                  FUNÇÕES AUXILIARES DE BANCO (ÁLBUNS E ARTISTAS)
+#############################################################################
+
+def listar_albuns_do_usuario(usuario):
+    """
+    Retorna [ {'album': 'X', 'artist': 'Y', 'faixas': 10, 'duracao': 2400.0}, ... ]
+    a partir do índice (usuario, album) da tabela track.
+    """
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return []
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(SQL_ALBUNS_DO_USUARIO, (usuario,))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return rows
+    except Exception as e:
+        logger.error(f"Erro ao listar álbuns do usuário: {e}")
+        return []
+
+def listar_artistas_do_usuario(usuario):
+    """
+    Retorna [ {'artist': 'Y', 'faixas': 10, 'albuns': 2}, ... ]
+    """
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return []
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(SQL_ARTISTAS_DO_USUARIO, (usuario,))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return rows
+    except Exception as e:
+        logger.error(f"Erro ao listar artistas do usuário: {e}")
+        return []
+
+def listar_faixas_por(usuario, campo, valor):
+    """
+    Retorna as faixas do usuário com album/artist igual a `valor`, com seus
+    metadados, ordenadas pelo número da faixa.
+    """
+    if campo not in ('album', 'artist'):
+        raise ValueError(f"Campo inválido: {campo}")
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return []
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(SQL_FAIXAS_POR.format(campo=campo), (usuario, valor))
+        rows = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return rows
+    except Exception as e:
+        logger.error(f"Erro ao listar faixas por {campo}: {e}")
+        return []
+
+#############################################################################
+#                  FUNÇÕES AUXILIARES DE BANCO (OPERAÇÕES EM LOTE)
+#############################################################################
+
+LOTE_MAX_PARAMETROS = 500
+
+# Remoção de arquivos fora da requisição: o banco é atualizado numa única
+# transação e os unlinks ficam para este executor.
+file_delete_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='unlink')
+
+def _em_blocos(itens, tamanho=LOTE_MAX_PARAMETROS):
+    for i in range(0, len(itens), tamanho):
+        yield itens[i:i + tamanho]
+
+def _placeholders(qtd):
+    return ', '.join(['%s'] * qtd)
+
+def adicionar_musicas_playlist_em_lote(usuario, nome_playlist, musicas):
+    """
+    Cria a playlist se necessário e adiciona todas as músicas numa única
+    transação. Retorna (playlist_id, quantidade_inserida) ou (None, 0).
+    """
+    musicas = list(dict.fromkeys(musicas))
+    conn = get_db_connection()
+    if not conn:
+        return None, 0
+    try:
+        cursor = conn.cursor()
+        cursor.execute(SQL_PLAYLIST_POR_NOME, (usuario, nome_playlist))
+        row = cursor.fetchone()
+        if row:
+            playlist_id = row[0]
+            playlist_criada = False
+        else:
+            cursor.execute("INSERT INTO playlist (usuario, nome) VALUES (%s, %s)",
+                           (usuario, nome_playlist))
+            playlist_id = cursor.lastrowid
+            playlist_criada = True
+
+        inseridas = 0
+        for bloco in _em_blocos(musicas):
+            cursor.execute(
+                f"INSERT IGNORE INTO track (usuario, filename) VALUES {', '.join(['(%s, %s)'] * len(bloco))}",
+                tuple(v for m in bloco for v in (usuario, m))
+            )
+            cursor.execute(
+                f"INSERT IGNORE INTO playlist_musica (playlist_id, track_id) "
+                f"SELECT %s, id FROM track WHERE usuario = %s AND filename IN ({_placeholders(len(bloco))})",
+                (playlist_id, usuario, *bloco)
+            )
+            inseridas += cursor.rowcount
+        conn.commit()
+        cursor.close()
+        if playlist_criada:
+            library_cache.invalidar(_chave_playlists(usuario))
+        library_cache.invalidar(_chave_musicas_playlist(playlist_id))
+        logger.info(f"{inseridas} música(s) adicionada(s) na playlist '{nome_playlist}' (ID={playlist_id}) em lote.")
+        return playlist_id, inseridas
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao adicionar músicas em lote na playlist: {e}")
+        return None, 0
+    finally:
+        conn.close()
+
+def remover_musicas_playlist_em_lote(playlist_id, musicas):
+    """
+    Remove várias músicas de uma playlist numa única transação.
+    Retorna a quantidade de linhas removidas, ou None em caso de erro.
+    """
+    musicas = list(dict.fromkeys(musicas))
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        removidas = 0
+        for bloco in _em_blocos(musicas):
+            cursor.execute(
+                f"DELETE pm FROM playlist_musica pm JOIN track t ON t.id = pm.track_id "
+                f"WHERE pm.playlist_id = %s AND t.filename IN ({_placeholders(len(bloco))})",
+                (playlist_id, *bloco)
+            )
+            removidas += cursor.rowcount
+        conn.commit()
+        cursor.close()
+        library_cache.invalidar(_chave_musicas_playlist(playlist_id))
+        logger.info(f"{removidas} música(s) removida(s) da playlist (ID={playlist_id}) em lote.")
+        return removidas
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao remover músicas em lote da playlist: {e}")
+        return None
+    finally:
+        conn.close()
+
+def remover_musicas_das_listas_em_lote(usuario, musicas):
+    """
+    Remove as músicas dos favoritos e de todas as playlists do usuário numa
+    única transação, mantendo as faixas. Retorna True em caso de sucesso.
+    """
+    musicas = list(dict.fromkeys(musicas))
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        cursor = conn.cursor()
+        for bloco in _em_blocos(musicas):
+            cursor.execute(
+                f"DELETE f FROM favorites f JOIN track t ON t.id = f.track_id "
+                f"WHERE t.usuario = %s AND t.filename IN ({_placeholders(len(bloco))})",
+                (usuario, *bloco)
+            )
+            cursor.execute(
+                f"DELETE pm FROM playlist_musica pm JOIN track t ON t.id = pm.track_id "
+                f"WHERE t.usuario = %s AND t.filename IN ({_placeholders(len(bloco))})",
+                (usuario, *bloco)
+            )
+        conn.commit()
+        cursor.close()
+        library_cache.invalidar(_chave_favoritos(usuario))
+        invalidar_playlists_do_usuario(usuario, incluir_musicas=True)
+        logger.info(f"{len(musicas)} música(s) removida(s) das listas do usuário '{usuario}' em lote.")
+        return True
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao remover músicas das listas em lote: {e}")
+        return False
+    finally:
+        conn.close()
+
+def _apagar_arquivos(caminhos):
+    for caminho in caminhos:
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Erro ao excluir o arquivo '{caminho}': {e}")
+    logger.info(f"{len(caminhos)} arquivo(s) excluído(s) em background.")
+
+def apagar_arquivos_em_background(caminhos):
+    """Agenda a remoção dos arquivos sem bloquear a requisição."""
+    if caminhos:
+        file_delete_executor.submit(_apagar_arquivos, list(caminhos))
+
+#############################################################################
+#                  LIMITE DE BANDA DOS DOWNLOADS
+#############################################################################
+
+# Por quanto tempo depois de um /play os downloads ficam no limite de streaming
+JANELA_PRIORIDADE_STREAM = 60
+ESPERA_MAXIMA_BANDA = 1.0
+
+class TokenBucket:
+    """
+    Balde de tokens em bytes/s com rajada de um segundo. O consumo pode
+    deixar o saldo negativo; quem consome espera a dívida ser paga, o que
+    divide a taxa entre as threads que compartilham o balde.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._ultimo = time.monotonic()
+
+    def consumir(self, quantidade, taxa):
+        """Retira `quantidade` bytes e retorna quantos segundos esperar (taxa 0 = sem limite)."""
+        with self._lock:
+            agora = time.monotonic()
+            if not taxa:
+                self._tokens = 0.0
+                self._ultimo = agora
+                return 0.0
+            self._tokens = min(taxa, self._tokens + (agora - self._ultimo) * taxa) - quantidade
+            self._ultimo = agora
+            return -self._tokens / taxa if self._tokens < 0 else 0.0
+
+def _no_intervalo(agora, inicio, fim):
+    """Intervalo 'HH:MM'-'HH:MM' do dia; aceita janelas que cruzam a meia-noite."""
+    if inicio <= fim:
+        return inicio <= agora < fim
+    return agora >= inicio or agora < fim
+
+class ControleDeBanda:
+    """
+    Limite global compartilhado por todos os jobs de download (um único
+    TokenBucket) mais um limite por job. As taxas são lidas da configuração a
+    cada consumo, então podem mudar em tempo de execução.
+    """
+    def __init__(self):
+        self.balde_global = TokenBucket()
+        self._ultimo_stream = 0.0
+
+    def registrar_stream(self):
+        self._ultimo_stream = time.monotonic()
+
+    def streaming_ativo(self):
+        return time.monotonic() - self._ultimo_stream < JANELA_PRIORIDADE_STREAM
+
+    def taxa_global(self):
+        """Taxa global vigente: agenda do horário, reduzida enquanto houver streaming."""
+        taxa = config.download_rate_limit
+        agora = time.strftime('%H:%M')
+        for faixa in config.download_rate_schedule:
+            try:
+                if _no_intervalo(agora, faixa['start'], faixa['end']):
+                    taxa = faixa.get('limit', 0)
+                    break
+            except (KeyError, TypeError):
+                logger.warning(f"Faixa de horário inválida em download_rate_schedule: {faixa}")
+        limite_stream = config.download_rate_limit_streaming
+        if limite_stream and self.streaming_ativo():
+            taxa = min(taxa, limite_stream) if taxa else limite_stream
+        return taxa
+
+    def aguardar(self, quantidade, balde_job):
+        espera = max(
+            self.balde_global.consumir(quantidade, self.taxa_global()),
+            balde_job.consumir(quantidade, config.download_job_rate_limit),
+        )
+        if espera:
+            # A dívida que sobrar é cobrada no próximo bloco
+            time.sleep(min(espera, ESPERA_MAXIMA_BANDA))
+
+    def hook_do_job(self):
+        """
+        progress_hook do yt-dlp para um job. O hook roda na thread do
+        download a cada bloco recebido, então dormir nele reduz a taxa.
+        """
+        balde_job = TokenBucket()
+        anterior = {'arquivo': None, 'bytes': 0}
+
+        def hook(d):
+            if d.get('status') != 'downloading':
+                return
+            baixados = d.get('downloaded_bytes') or 0
+            if d.get('filename') != anterior['arquivo'] or baixados < anterior['bytes']:
+                anterior['arquivo'] = d.get('filename')
+                anterior['bytes'] = 0
+            delta = baixados - anterior['bytes']
+            anterior['bytes'] = baixados
+            if delta > 0:
+                self.aguardar(delta, balde_job)
+        return hook
+
+    def estado(self):
+        return {
+            'download_rate_limit': config.download_rate_limit,
+            'download_job_rate_limit': config.download_job_rate_limit,
+            'download_rate_limit_streaming': config.download_rate_limit_streaming,
+            'download_rate_schedule': config.download_rate_schedule,
+            'taxa_global_vigente': self.taxa_global(),
+            'streaming_ativo': self.streaming_ativo(),
+        }
+
+controle_de_banda = ControleDeBanda()
+
+#############################################################################
+#                      FUNÇÃO DE DOWNLOAD (yt-dlp)
+#############################################################################
+
+# Perfil padrão (o formato que instalações existentes já produzem) e fallback
+# quando o perfil configurado é desconhecido; m4a/opus são opcionais no config.json
+PERFIL_PADRAO = 'mp3-192'
+
+# Perfis de codificação: a chave faz parte do endereço no acervo compartilhado.
+# Os perfis de remux escolhem o formato de origem que já tem o codec pedido,
+# então o ffmpeg só troca o contêiner (cópia do fluxo, sem recodificar).
+PERFIS_DE_CODIFICACAO = {
+    'm4a': {'format': 'bestaudio[ext=m4a]/bestaudio/best', 'preferredcodec': 'm4a'},
+    'opus': {'format': 'bestaudio[acodec=opus]/bestaudio/best', 'preferredcodec': 'opus'},
+    'original': {'format': 'bestaudio/best', 'preferredcodec': 'best'},
+    'mp3-192': {'format': 'bestaudio/best', 'preferredcodec': 'mp3', 'preferredquality': '192'},
+}
+
+def perfil_configurado():
+    """Perfil de saída dos downloads (config.audio_profile), com fallback para mp3."""
+    if config.audio_profile in PERFIS_DE_CODIFICACAO:
+        return config.audio_profile
+    logger.warning(f"Perfil de áudio '{config.audio_profile}' desconhecido; usando '{PERFIL_PADRAO}'.")
+    return PERFIL_PADRAO
+
+def _espera_exponencial(tentativa):
+    return min(2 ** tentativa, 60)
+
+def _opcoes_ydl(outtmpl, perfil=PERFIL_PADRAO):
+    codificacao = PERFIS_DE_CODIFICACAO[perfil]
+    return {
+        'format': codificacao['format'],
+        'outtmpl': outtmpl,
+        'writethumbnail': True,
+        'postprocessors': [
+            {
+                # Sem álbum na origem, usa o título da playlist
+                'key': 'MetadataParser',
+                'when': 'pre_process',
+                'actions': [
+                    (MetadataParserPP.Actions.INTERPRET, '%(album,playlist_title|)s', '%(album)s'),
+                ],
+            },
+            {
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': codificacao['preferredcodec'],
+                'preferredquality': codificacao.get('preferredquality'),
+            },
+            {
+                'key': 'FFmpegMetadata',
+                'add_metadata': True,
+            },
+            {
+                'key': 'FFmpegThumbnailsConvertor',
+                'format': 'jpg'
+            },
+        ],
+        'ffmpeg_location': config.ffmpeg_path,
+        'quiet': False,
+        'logger': YtDlpLogger(),
+        'progress_hooks': [controle_de_banda.hook_do_job()],
+        'ignoreerrors': True,
+        # Falhas de rede repetem com espera exponencial; os .part são retomados
+        'continuedl': True,
+        'retries': 10,
+        'fragment_retries': 10,
+        'extractor_retries': 3,
+        'retry_sleep_functions': {
+            'http': _espera_exponencial,
+            'fragment': _espera_exponencial,
+            'extractor': _espera_exponencial,
+        },
+    }
+
+# Extratores consultados antes dos padrão do yt-dlp (ex.: o do benchmark offline)
+EXTRATORES_EXTRAS = []
+
+def criar_ydl(opcoes):
+    """YoutubeDL com os EXTRATORES_EXTRAS na frente dos extratores padrão."""
+    ydl = yt_dlp.YoutubeDL(opcoes, auto_init=False)
+    for extrator in EXTRATORES_EXTRAS:
+        ydl.add_info_extractor(extrator())
+    ydl.add_default_info_extractors()
+    return ydl
+
+# Resoluções "flat" das URLs: a prévia, a estimativa do agendador e o
+# download do job usam a mesma extração enquanto ela não expira
+RESOLUCAO_MAX_BYTES = 8 * 1024 * 1024
+metadata_cache = CacheTTL(900, RESOLUCAO_MAX_BYTES)
+_resolucoes_em_andamento = {}
+_resolucoes_lock = threading.Lock()
+
+def _entrada_resolvida(entrada, url_padrao=None):
+    return {
+        'id': entrada['id'],
+        'url': entrada.get('url') or entrada.get('webpage_url') or url_padrao,
+        'ie_key': entrada.get('ie_key'),
+        'title': entrada.get('title'),
+        'duration': entrada.get('duration'),
+    }
+
+def resolver_url(url):
+    """
+    Resolve a URL sem baixar mídia (extração "flat") e guarda o resultado por
+    config.metadata_cache_ttl. Retorna {'playlist', 'id', 'title',
+    'webpage_url', 'extractor', 'extractor_key', 'entries': [{'id', 'url',
+    'ie_key', 'title', 'duration'}, ...]} ou None se a URL não resolveu.
+    Chamadas simultâneas para a mesma URL fazem uma única extração.
+    """
+    chave = ('resolucao', url)
+    hit, resolucao = metadata_cache.obter(chave)
+    if hit:
+        return resolucao
+    with _resolucoes_lock:
+        lock = _resolucoes_em_andamento.setdefault(url, threading.Lock())
+    try:
+        with lock:
+            return _resolver_url(url, chave)
+    finally:
+        with _resolucoes_lock:
+            _resolucoes_em_andamento.pop(url, None)
+
+def _resolver_url(url, chave):
+    hit, resolucao = metadata_cache.obter(chave)
+    if hit:
+        return resolucao
+    versao = metadata_cache.versao(chave)
+    opts = {
+        'extract_flat': 'in_playlist',
+        'quiet': True,
+        'logger': YtDlpLogger(),
+        'ignoreerrors': True,
+    }
+    with criar_ydl(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if not info:
+        return None
+    playlist = 'entries' in info
+    entradas = info['entries'] if playlist else [info]
+    resolucao = {
+        'playlist': playlist,
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'webpage_url': info.get('webpage_url') or url,
+        'extractor': info.get('extractor'),
+        'extractor_key': info.get('extractor_key'),
+        'entries': [
+            _entrada_resolvida(e, None if playlist else info.get('webpage_url') or url)
+            for e in entradas if e and e.get('id')
+        ],
+    }
+    metadata_cache.gravar(chave, resolucao, versao)
+    return resolucao
+
+def _playlist_da_resolucao(resolucao):
+    """Resultado de playlist para o YoutubeDL montado a partir da resolução (sem nova extração)."""
+    return {
+        '_type': 'playlist',
+        'id': resolucao['id'],
+        'title': resolucao['title'],
+        'webpage_url': resolucao['webpage_url'],
+        'original_url': resolucao['webpage_url'],
+        'extractor': resolucao['extractor'],
+        'extractor_key': resolucao['extractor_key'],
+        'entries': [
+            {'_type': 'url', 'url': e['url'], 'ie_key': e['ie_key'], 'id': e['id'],
+             'title': e['title'], 'duration': e['duration']}
+            for e in resolucao['entries']
+        ],
+    }
+
+def listar_ids_da_url(url):
+    """IDs de origem das entradas da URL, na ordem da playlist (resolução em cache)."""
+    resolucao = resolver_url(url)
+    return [e['id'] for e in resolucao['entries']] if resolucao else []
+
+def baixar_videos_para_mp3(playlist_url, pasta_destino, usuario=None, perfil=None, id_fila=None):
+    """
+    Baixa a URL para a biblioteca. Com `id_fila`, o estado de cada entrada é
+    gravado em fila_entrada e só as entradas pendentes são baixadas, então
+    uma nova execução do job continua de onde a anterior parou.
+    """
+    perfil = perfil or perfil_configurado()
+    try:
+        if not os.path.exists(pasta_destino):
+            os.makedirs(pasta_destino)
+
+        if not usuario:
+            with criar_ydl(_opcoes_ydl(os.path.join(pasta_destino, '%(title)s.%(ext)s'), perfil)) as ydl:
+                ydl.download([playlist_url])
+            logger.info(f"Download concluído para URL: {playlist_url}")
+            return
+
+        # Entradas já presentes no acervo são apenas vinculadas à biblioteca
+        resolucao = resolver_url(playlist_url)
+        ids = [e['id'] for e in resolucao['entries']] if resolucao else []
+        ignorados = set()
+        if id_fila is not None:
+            if not ids:
+                raise ErroTransitorio(f"Não foi possível resolver as entradas de {playlist_url}")
+            registrar_entradas_do_job(id_fila, ids)
+            ignorados = set(ids) - ids_pendentes_do_job(id_fila)
+        no_acervo = buscar_midias_no_acervo(set(ids) - ignorados, perfil)
+        livre = espaco_livre(usuario)
+        cota_esgotada = False
+        if livre is not None:
+            # Vincula do acervo só o que cabe na cota, na ordem da playlist
+            cabem = {}
+            for source_id in ids:
+                midia = no_acervo.get(source_id)
+                if midia is None or source_id in cabem:
+                    continue
+                if (midia['size'] or 0) > livre:
+                    cota_esgotada = True
+                    break
+                livre -= midia['size'] or 0
+                cabem[source_id] = midia
+            no_acervo = cabem
+        if no_acervo:
+            vincular_midias(usuario, pasta_destino, list(no_acervo.values()))
+            if id_fila is not None:
+                marcar_entradas_concluidas(id_fila, no_acervo.keys())
+            logger.info(f"{len(no_acervo)} faixa(s) reaproveitada(s) do acervo para '{usuario}'.")
+        ignorados |= set(no_acervo)
+        if cota_esgotada:
+            raise CotaExcedida(f"Cota de armazenamento de '{usuario}' esgotada")
+
+        if ids and ignorados >= set(ids):
+            logger.info(f"Download concluído para URL: {playlist_url} (nenhuma entrada pendente)")
+            return
+
+        def _filtro_acervo(info, *, incomplete=False):
+            if info.get('id') in no_acervo:
+                return 'Faixa já está no acervo compartilhado'
+            if info.get('id') in ignorados:
+                return 'Entrada já processada em uma execução anterior do job'
+            # O uso é atualizado a cada faixa vinculada, então a cota vale entre as entradas
+            previsto = 0 if incomplete else (info.get('filesize') or info.get('filesize_approx') or 0)
+            if cota_excedida(usuario, previsto):
+                raise CotaExcedida(f"Cota de armazenamento de '{usuario}' esgotada")
+            return None
+
+        outtmpl = os.path.join(pasta_do_acervo(), perfil, '%(id).2s', '%(id)s.%(ext)s')
+        ydl_opts = _opcoes_ydl(outtmpl, perfil)
+        ydl_opts['match_filter'] = _filtro_acervo
+        with criar_ydl(ydl_opts) as ydl:
+            ydl.add_post_processor(ArmazenarMidiaPP(usuario, pasta_destino, perfil, id_fila), when='post_process')
+            if resolucao and resolucao['playlist']:
+                # A lista de entradas já resolvida dispensa extrair a playlist de novo
+                ydl.process_ie_result(_playlist_da_resolucao(resolucao), download=True)
+            else:
+                ydl.download([playlist_url])
+        logger.info(f"Download concluído para URL: {playlist_url}")
+    except Exception as e:
+        logger.error(f"Erro ao baixar vídeos: {e}")
+        raise e
+
+#############################################################################
+#                  ACERVO DE MÍDIA COMPARTILHADO
+#############################################################################
+
+def pasta_do_acervo():
+    """Pasta do acervo; padrão: '.media-store' dentro de config.file_path."""
+    return config.media_store_path or os.path.join(config.file_path, '.media-store')
+
+def _vincular_arquivo(origem, destino):
+    """
+    Cria `destino` como hardlink de `origem` (cópia se o sistema de arquivos
+    não suportar). Não sobrescreve um arquivo diferente já existente.
+    """
+    if os.path.exists(destino):
+        if not os.path.samefile(origem, destino):
+            logger.warning(f"'{destino}' já existe e não é do acervo; mantido.")
+        return
+    try:
+        os.link(origem, destino)
+    except OSError:
+        shutil.copy2(origem, destino)
+
+def buscar_midias_no_acervo(source_ids, perfil):
+    """Retorna {source_id: linha do media_store} para os IDs já armazenados."""
+    source_ids = list(dict.fromkeys(source_ids))
+    if not source_ids:
+        return {}
+    conn = get_db_connection()
+    if not conn:
+        return {}
+    try:
+        cursor = conn.cursor(dictionary=True)
+        encontrados = {}
+        for bloco in _em_blocos(source_ids):
+            cursor.execute(
+                f"SELECT id, source_id, arquivo, capa, nome_arquivo, size, metadados FROM media_store "
+                f"WHERE perfil = %s AND source_id IN ({_placeholders(len(bloco))})",
+                (perfil, *bloco)
+            )
+            for row in cursor.fetchall():
+                if os.path.isfile(os.path.join(pasta_do_acervo(), row['arquivo'])):
+                    encontrados[row['source_id']] = row
+        cursor.close()
+        return encontrados
+    except Exception as e:
+        logger.error(f"Erro ao consultar o acervo compartilhado: {e}")
+        return {}
+    finally:
+        conn.close()
+
+def ids_na_biblioteca(usuario, source_ids):
+    """IDs de origem que já têm faixa na biblioteca do usuário."""
+    source_ids = list(dict.fromkeys(source_ids))
+    if not source_ids:
+        return set()
+    conn = get_db_connection()
+    if not conn:
+        return set()
+    try:
+        cursor = conn.cursor()
+        encontrados = set()
+        for bloco in _em_blocos(source_ids):
+            cursor.execute(
+                f"SELECT m.source_id FROM track t JOIN media_store m ON m.id = t.media_id "
+                f"WHERE t.usuario = %s AND m.source_id IN ({_placeholders(len(bloco))})",
+                (usuario, *bloco)
+            )
+            encontrados.update(row[0] for row in cursor.fetchall())
+        cursor.close()
+        return encontrados
+    except Exception as e:
+        logger.error(f"Erro ao consultar as faixas de '{usuario}' no acervo: {e}")
+        return set()
+    finally:
+        conn.close()
+
+def registrar_midia(cursor, source_id, perfil, arquivo, capa, nome_arquivo, size, metadados):
+    """Registra (ou atualiza) a mídia no acervo e retorna seu ID."""
+    cursor.execute("""
+        INSERT INTO media_store (source_id, perfil, arquivo, capa, nome_arquivo, size, metadados)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), arquivo = VALUES(arquivo),
+            capa = VALUES(capa), nome_arquivo = VALUES(nome_arquivo), size = VALUES(size),
+            metadados = VALUES(metadados)
+    """, (source_id, perfil, arquivo, capa, nome_arquivo, size, json.dumps(metadados)))
+    return cursor.lastrowid
+
+def vincular_midias(usuario, pasta_destino, midias):
+    """
+    Vincula mídias do acervo à biblioteca do usuário (hardlink do áudio e da
+    capa) e registra as faixas com referência ao acervo.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return
+    acervo = pasta_do_acervo()
+    try:
+        cursor = conn.cursor()
+        for midia in midias:
+            origem = os.path.join(acervo, midia['arquivo'])
+            destino = os.path.join(pasta_destino, midia['nome_arquivo'])
+            try:
+                _vincular_arquivo(origem, destino)
+                if midia.get('capa'):
+                    capa_destino = os.path.splitext(destino)[0] + '.jpg'
+                    _vincular_arquivo(os.path.join(acervo, midia['capa']), capa_destino)
+                st = os.stat(destino)
+            except OSError as e:
+                logger.error(f"Erro ao vincular '{midia['nome_arquivo']}' do acervo: {e}")
+                continue
+            metadados = json.loads(midia.get('metadados') or '{}')
+            gravar_metadados_track(cursor, usuario, midia['nome_arquivo'], st.st_size, st.st_mtime,
+                                   metadados, midia['id'])
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao registrar faixas do acervo para '{usuario}': {e}")
+    finally:
+        conn.close()
+
+def liberar_midias_sem_referencia(cursor, media_ids):
+    """
+    Contagem de referências do acervo: remove do media_store as mídias que
+    nenhuma faixa referencia mais e retorna os arquivos a excluir do disco.
+    """
+    media_ids = list(media_ids)
+    arquivos = []
+    acervo = pasta_do_acervo()
+    for bloco in _em_blocos(media_ids):
+        cursor.execute(
+            f"SELECT m.id, m.arquivo, m.capa FROM media_store m "
+            f"WHERE m.id IN ({_placeholders(len(bloco))}) "
+            f"AND NOT EXISTS (SELECT 1 FROM track t WHERE t.media_id = m.id)",
+            tuple(bloco)
+        )
+        orfas = cursor.fetchall()
+        if not orfas:
+            continue
+        cursor.execute(
+            f"DELETE FROM media_store WHERE id IN ({_placeholders(len(orfas))})",
+            tuple(row[0] for row in orfas)
+        )
+        for _, arquivo, capa in orfas:
+            arquivos.append(os.path.join(acervo, arquivo))
+            if capa:
+                arquivos.append(os.path.join(acervo, capa))
+    return arquivos
+
+class ArmazenarMidiaPP(PostProcessor):
+    """
+    Pós-processador do yt-dlp executado após a extração do áudio: registra o
+    arquivo no acervo compartilhado, vincula-o à biblioteca do usuário e grava
+    os metadados da faixa, sem precisar reabrir o arquivo depois.
+    """
+    def __init__(self, usuario, pasta_destino, perfil, id_fila=None, downloader=None):
+        super().__init__(downloader)
+        self.usuario = usuario
+        self.pasta_destino = pasta_destino
+        self.perfil = perfil
+        self.id_fila = id_fila
+
+    def run(self, info):
+        caminho = info.get('filepath')
+        if not caminho or not os.path.isfile(caminho) or not info.get('id'):
+            return [], info
+        try:
+            acervo = pasta_do_acervo()
+            nome_arquivo = os.path.basename(
+                self._downloader.prepare_filename(info, outtmpl='%(title)s.%(ext)s')
+            )
+            capa = os.path.splitext(caminho)[0] + '.jpg'
+            capa_rel = os.path.relpath(capa, acervo) if os.path.isfile(capa) else None
+            conn = get_db_connection()
+            if not conn:
+                return [], info
+            cursor = conn.cursor(dictionary=True)
+            media_id = registrar_midia(
+                cursor, info['id'], self.perfil, os.path.relpath(caminho, acervo), capa_rel,
+                nome_arquivo, os.path.getsize(caminho), metadados_do_info_dict(info)
+            )
+            conn.commit()
+            cursor.execute("SELECT id, arquivo, capa, nome_arquivo, metadados FROM media_store WHERE id = %s",
+                           (media_id,))
+            midia = cursor.fetchone()
+            cursor.close()
+            conn.close()
+            vincular_midias(self.usuario, self.pasta_destino, [midia])
+            if self.id_fila is not None:
+                marcar_entradas_concluidas(self.id_fila, [info['id']])
+        except Exception as e:
+            logger.error(f"Erro ao armazenar '{caminho}' no acervo: {e}")
+        return [], info
+
+#############################################################################
+#                      METADADOS DE ÁUDIO (TAGS)
+#############################################################################
+
+COLUNAS_METADADOS = ('duration', 'title', 'artist', 'album', 'track_number', 'year', 'source_id')
+
+def _inteiro_ou_none(valor):
+    try:
+        return int(str(valor).split('/')[0])
+    except (TypeError, ValueError):
+        return None
+
+def _float_ou_none(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+def _texto_ou_none(valor, limite=255):
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    return valor[:limite] or None
+
+def metadados_do_info_dict(info):
+    """Extrai os metadados de uma faixa a partir do info dict do yt-dlp."""
+    artistas = info.get('artists')
+    artist = info.get('artist') or (', '.join(artistas) if artistas else None) \
+        or info.get('creator') or info.get('uploader')
+    year = info.get('release_year')
+    if not year and info.get('upload_date'):
+        year = info['upload_date'][:4]
+    return {
+        'duration': _float_ou_none(info.get('duration')),
+        'title': _texto_ou_none(info.get('track') or info.get('title')),
+        'artist': _texto_ou_none(artist),
+        'album': _texto_ou_none(info.get('album')),
+        'track_number': _inteiro_ou_none(info.get('track_number') or info.get('playlist_index')),
+        'year': _inteiro_ou_none(year),
+        'source_id': _texto_ou_none(info.get('id'), 64),
+    }
+
+def _caminho_ferramenta_ffmpeg(ferramenta):
+    """
+    Deriva o caminho do ffmpeg/ffprobe a partir do ffmpeg configurado (que
+    pode apontar para o executável ou para a pasta bin).
+    """
+    caminho = config.ffmpeg_path or ''
+    if os.path.isdir(caminho):
+        return os.path.join(caminho, ferramenta)
+    pasta, nome = os.path.split(caminho)
+    if not nome:
+        return ferramenta
+    return os.path.join(pasta, nome.lower().replace('ffmpeg', ferramenta))
+
+def _caminho_ffprobe():
+    return _caminho_ferramenta_ffmpeg('ffprobe')
+
+def metadados_do_arquivo(caminho_arquivo):
+    """Lê as tags (ID3 etc.) e a duração de um arquivo com o ffprobe."""
+    resultado = subprocess.run(
+        [_caminho_ffprobe(), '-v', 'quiet', '-print_format', 'json', '-show_format', caminho_arquivo],
+        capture_output=True, timeout=60
+    )
+    if resultado.returncode != 0:
+        raise RuntimeError(f"ffprobe falhou para '{caminho_arquivo}'")
+    formato = json.loads(resultado.stdout or b'{}').get('format', {})
+    tags = {k.lower(): v for k, v in (formato.get('tags') or {}).items()}
+    return {
+        'duration': _float_ou_none(formato.get('duration')),
+        'title': _texto_ou_none(tags.get('title')),
+        'artist': _texto_ou_none(tags.get('artist') or tags.get('album_artist')),
+        'album': _texto_ou_none(tags.get('album')),
+        'track_number': _inteiro_ou_none(tags.get('track')),
+        'year': _inteiro_ou_none(str(tags.get('date') or '')[:4]),
+        # O ID de origem só existe no info dict do yt-dlp
+        'source_id': None,
+    }
+
+def gravar_metadados_track(cursor, usuario, filename, size, mtime, metadados, media_id=None):
+    """Insere/atualiza a faixa com os metadados extraídos."""
+    valores = [metadados.get(c) for c in COLUNAS_METADADOS]
+    cursor.execute("SELECT size FROM track WHERE usuario = %s AND filename = %s", (usuario, filename))
+    anterior = cursor.fetchone()
+    ajustar_uso_de_armazenamento(cursor, usuario, (size or 0) - ((anterior and anterior[0]) or 0))
+    cursor.execute(f"""
+        INSERT INTO track (usuario, filename, size, mtime, metadata_mtime, media_id, {', '.join(COLUNAS_METADADOS)})
+        VALUES (%s, %s, %s, %s, %s, %s, {_placeholders(len(COLUNAS_METADADOS))})
+        ON DUPLICATE KEY UPDATE size = VALUES(size), mtime = VALUES(mtime),
+            metadata_mtime = VALUES(metadata_mtime),
+            media_id = COALESCE(VALUES(media_id), media_id),
+            {', '.join(f'{c} = COALESCE(VALUES({c}), {c})' for c in COLUNAS_METADADOS)}
+    """, (usuario, filename, size, mtime, mtime, media_id, *valores))
+
+def backfill_metadados(max_workers=4):
+    """
+    Preenche os metadados das faixas já existentes (ou alteradas desde a
+    última leitura) de todas as bibliotecas, lendo os arquivos em paralelo.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    cursor = conn.cursor()
+    cursor.execute("SELECT usuario, diretorio FROM usuario")
+    usuarios = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='backfill') as executor:
+        for usuario, diretorio in usuarios:
+            if not sincronizar_tracks(usuario, diretorio):
+                continue
+            conn = get_db_connection()
+            if not conn:
+                continue
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT filename, size, mtime FROM track
+                    WHERE usuario = %s AND (metadata_mtime IS NULL OR metadata_mtime <> mtime)
+                """, (usuario,))
+                pendentes = cursor.fetchall()
+                futuros = {
+                    executor.submit(metadados_do_arquivo, os.path.join(diretorio, filename)): (filename, size, mtime)
+                    for filename, size, mtime in pendentes
+                }
+                for futuro in as_completed(futuros):
+                    filename, size, mtime = futuros[futuro]
+                    try:
+                        metadados = futuro.result()
+                    except Exception as e:
+                        logger.warning(f"Metadados indisponíveis para '{filename}': {e}")
+                        continue
+                    gravar_metadados_track(cursor, usuario, filename, size, mtime, metadados)
+                    total += 1
+                conn.commit()
+                cursor.close()
+                logger.info(f"Metadados de {len(pendentes)} faixa(s) processados para '{usuario}'.")
+            except Exception as e:
+                logger.error(f"Erro no backfill de metadados do usuário '{usuario}': {e}")
+            finally:
+                conn.close()
+    return total
+
+#############################################################################
+#                  TRANSCODIFICAÇÃO SOB DEMANDA (STREAMING MÓVEL)
+#############################################################################
+
+# qualidade -> (codec ffmpeg, bitrate, formato do contêiner, extensão, mimetype)
+QUALIDADES_STREAM = {
+    'low': ('libopus', '48k', 'ogg', 'ogg', 'audio/ogg'),
+    'medium': ('libopus', '96k', 'ogg', 'ogg', 'audio/ogg'),
+    'aac-low': ('aac', '64k', 'adts', 'aac', 'audio/aac'),
+    'aac-medium': ('aac', '128k', 'adts', 'aac', 'audio/aac'),
+}
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+class TranscodeJob:
+    """Um processo ffmpeg produzindo uma variante; compartilhado pelos leitores."""
+    def __init__(self, chave, caminho_parcial, caminho_final):
+        self.chave = chave
+        self.caminho_parcial = caminho_parcial
+        self.caminho_final = caminho_final
+        self.concluido = threading.Event()
+        self.ok = False
+        self.leitores = 0
+        self.renomear_pendente = False
+
+class TranscodeCache:
+    """
+    Cache em disco das variantes transcodificadas, com descarte LRU por
+    tamanho. Requisições simultâneas da mesma variante compartilham um único
+    processo ffmpeg e leem o arquivo enquanto ele é produzido.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indice = OrderedDict()  # nome do arquivo -> tamanho
+        self._bytes = 0
+        self._jobs = {}
+        self._pasta = None
+
+    def pasta(self):
+        return config.transcode_cache_path or os.path.join(config.file_path, '.transcode-cache')
+
+    def _carregar(self):
+        """Reconstrói o índice LRU a partir do disco (mais antigos primeiro)."""
+        pasta = self.pasta()
+        if self._pasta == pasta:
+            return
+        os.makedirs(pasta, exist_ok=True)
+        arquivos = []
+        with os.scandir(pasta) as it:
+            for entry in it:
+                if entry.name.endswith('.part'):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                elif entry.is_file():
+                    st = entry.stat()
+                    arquivos.append((st.st_mtime, entry.name, st.st_size))
+        self._indice.clear()
+        self._bytes = 0
+        for _, nome, tamanho in sorted(arquivos):
+            self._indice[nome] = tamanho
+            self._bytes += tamanho
+        self._pasta = pasta
+
+    def _chave(self, caminho_origem, qualidade):
+        st = os.stat(caminho_origem)
+        base = f"{os.path.abspath(caminho_origem)}|{st.st_size}|{st.st_mtime_ns}|{qualidade}"
+        return hashlib.sha1(base.encode('utf-8')).hexdigest() + '.' + QUALIDADES_STREAM[qualidade][3]
+
+    def obter(self, caminho_origem, qualidade):
+        """
+        Retorna ('pronto', caminho) se a variante já está em cache, ou
+        ('produzindo', leitura) com uma LeituraDaVariante do job (novo ou já
+        em andamento).
+        """
+        with self._lock:
+            self._carregar()
+            nome = self._chave(caminho_origem, qualidade)
+            caminho_final = os.path.join(self._pasta, nome)
+            if nome in self._indice and os.path.isfile(caminho_final):
+                self._indice.move_to_end(nome)
+                try:
+                    os.utime(caminho_final)
+                except OSError:
+                    pass
+                return 'pronto', caminho_final
+            job = self._jobs.get(nome)
+            if job is None:
+                job = TranscodeJob(nome, caminho_final + '.part', caminho_final)
+                self._iniciar(job, caminho_origem, qualidade)
+                self._jobs[nome] = job
+            # Aberto sob o lock: enquanto o job está em _jobs o arquivo parcial
+            # existe, e o descritor continua válido depois do rename/remoção
+            arquivo = open(job.caminho_parcial, 'rb')
+            job.leitores += 1
+            return 'produzindo', LeituraDaVariante(self, job, arquivo)
+
+    def _iniciar(self, job, caminho_origem, qualidade):
+        codec, bitrate, formato, _, _ = QUALIDADES_STREAM[qualidade]
+        comando = [
+            _caminho_ferramenta_ffmpeg('ffmpeg'), '-nostdin', '-v', 'error', '-y',
+            '-i', caminho_origem, '-vn', '-map', '0:a:0',
+            '-c:a', codec, '-b:a', bitrate, '-f', formato, job.caminho_parcial
+        ]
+        # Cria o arquivo parcial antes de liberar os leitores
+        open(job.caminho_parcial, 'wb').close()
+        processo = subprocess.Popen(comando, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        threading.Thread(target=self._aguardar, args=(job, processo), daemon=True,
+                         name=f"transcode-{job.chave[:8]}").start()
+
+    def _aguardar(self, job, processo):
+        _, erro = processo.communicate()
+        with self._lock:
+            if processo.returncode == 0:
+                job.ok = True
+                self._finalizar(job)
+            else:
+                logger.error(f"Falha ao transcodificar '{job.chave}': {erro.decode(errors='replace').strip()}")
+                try:
+                    os.remove(job.caminho_parcial)
+                except OSError:
+                    pass
+                self._jobs.pop(job.chave, None)
+            job.concluido.set()
+
+    def _finalizar(self, job):
+        """Move a variante pronta para o cache (chamado com o lock)."""
+        try:
+            os.replace(job.caminho_parcial, job.caminho_final)
+        except OSError:
+            # No Windows não é possível renomear enquanto houver leitores
+            job.renomear_pendente = True
+            return
+        job.renomear_pendente = False
+        self._jobs.pop(job.chave, None)
+        tamanho = os.path.getsize(job.caminho_final)
+        self._indice[job.chave] = tamanho
+        self._bytes += tamanho
+        self._descartar_excesso()
+
+    def liberar(self, job):
+        with self._lock:
+            job.leitores -= 1
+            if job.renomear_pendente and job.leitores == 0:
+                self._finalizar(job)
+
+    def _descartar_excesso(self):
+        while self._indice and self._bytes > config.transcode_cache_max_bytes:
+            nome, tamanho = self._indice.popitem(last=False)
+            self._bytes -= tamanho
+            try:
+                os.remove(os.path.join(self._pasta, nome))
+            except OSError as e:
+                logger.warning(f"Não foi possível descartar '{nome}' do cache de transcodificação: {e}")
+
+class LeituraDaVariante:
+    """
+    Leitor de uma variante enquanto o ffmpeg a escreve. close() libera o
+    leitor no cache mesmo que a iteração nunca tenha começado (cliente que
+    desconecta antes do primeiro bloco).
+    """
+    def __init__(self, cache, job, arquivo):
+        self.cache = cache
+        self.job = job
+        self._arquivo = arquivo
+        self._fechada = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            while True:
+                bloco = self._arquivo.read(STREAM_CHUNK_BYTES)
+                if bloco:
+                    yield bloco
+                    continue
+                if self.job.concluido.is_set():
+                    # Lê o que sobrou depois do fim do processo
+                    resto = self._arquivo.read()
+                    if resto:
+                        yield resto
+                    break
+                self.job.concluido.wait(0.05)
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._fechada:
+                return
+            self._fechada = True
+        self._arquivo.close()
+        self.cache.liberar(self.job)
+
+transcode_cache = TranscodeCache()
+
+def responder_variante(caminho_origem, qualidade):
+    """Resposta Flask para a variante transcodificada de um arquivo."""
+    mimetype = QUALIDADES_STREAM[qualidade][4]
+    estado, valor = transcode_cache.obter(caminho_origem, qualidade)
+    if estado == 'pronto':
+        return send_file(valor, mimetype=mimetype, conditional=True)
+    # A Response chama close() da leitura ao fim da requisição, mesmo sem iterá-la
+    return Response(valor, mimetype=mimetype)
+
+#############################################################################
+#                  RÁDIO: TRANSMISSÃO COMPARTILHADA
+#############################################################################
+
+# Só ADTS: os quadros AAC são independentes, então as faixas podem ser
+# emendadas num fluxo contínuo e um ouvinte pode entrar em qualquer quadro.
+QUALIDADES_RADIO = ('aac-low', 'aac-medium')
+TAXAS_ADTS = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+RADIO_BLOCO_SEGUNDOS = 0.5
+# Capacidade do anel em blocos; um ouvinte mais atrasado que isso volta à borda ao vivo
+RADIO_BLOCOS = 64
+# Quanto o leitor pode se adiantar ao relógio para absorver oscilações da rede
+RADIO_VANTAGEM_SEGUNDOS = 2.0
+RADIO_ESPERA_SEM_FAIXAS = 10
+
+def separar_quadros_adts(dados, limite=None):
+    """
+    Separa os quadros ADTS completos do início de `dados`, até somarem
+    `limite` segundos. Retorna (bytes dos quadros, duração em segundos,
+    resto ainda não consumido).
+    """
+    quadros = []
+    duracao = 0.0
+    pos = 0
+    while len(dados) - pos >= 7 and (limite is None or duracao < limite):
+        if dados[pos] != 0xFF or (dados[pos + 1] & 0xF6) != 0xF0:
+            pos += 1
+            continue
+        tamanho = ((dados[pos + 3] & 0x03) << 11) | (dados[pos + 4] << 3) | (dados[pos + 5] >> 5)
+        indice = (dados[pos + 2] >> 2) & 0x0F
+        if tamanho < 7 or indice >= len(TAXAS_ADTS):
+            pos += 1
+            continue
+        if pos + tamanho > len(dados):
+            break
+        quadros.append(dados[pos:pos + tamanho])
+        duracao += 1024 * ((dados[pos + 6] & 0x03) + 1) / TAXAS_ADTS[indice]
+        pos += tamanho
+    return b''.join(quadros), duracao, dados[pos:]
+
+class EstacaoDeRadio:
+    """
+    Uma transmissão contínua de uma playlist (ou da biblioteca embaralhada).
+    Uma única thread lê cada faixa (pela variante do cache de
+    transcodificação), no ritmo do áudio, e publica blocos num anel de
+    tamanho fixo. Cada ouvinte guarda só a posição do próximo bloco: a
+    memória por ouvinte é constante e a leitura do disco não depende de
+    quantos estão ouvindo. Sem ouvintes, a leitura fica pausada.
+    """
+    def __init__(self, nome, usuario, diretorio, playlist=None, aleatorio=True, qualidade='aac-medium'):
+        self.nome = nome
+        self.usuario = usuario
+        self.diretorio = diretorio
+        self.playlist = playlist
+        self.aleatorio = aleatorio
+        self.qualidade = qualidade
+        self.faixa_atual = None
+        self.ouvintes = 0
+        self.bytes_lidos = 0
+        self.bytes_enviados = 0
+        self._blocos = [None] * RADIO_BLOCOS
+        self._seq = 0
+        self._posicao = 0.0
+        self._inicio = time.monotonic()
+        self._cond = threading.Condition()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._transmitir, daemon=True, name=f"radio-{nome}")
+
+    def iniciar(self):
+        self._thread.start()
+
+    def encerrar(self):
+        with self._cond:
+            self._parar.set()
+            self._cond.notify_all()
+
+    @property
+    def encerrada(self):
+        return self._parar.is_set()
+
+    def estado(self):
+        with self._cond:
+            return {
+                'name': self.nome,
+                'owner': self.usuario,
+                'source': self.playlist or 'library',
+                'shuffle': self.aleatorio,
+                'quality': self.qualidade,
+                'now_playing': self.faixa_atual,
+                'listeners': self.ouvintes,
+                'position': round(self._posicao, 1),
+                'bytes_read': self.bytes_lidos,
+                'bytes_sent': self.bytes_enviados,
+            }
+
+    def _faixas(self):
+        """Faixas da próxima volta; relidas a cada volta para refletir edições."""
+        if self.playlist:
+            playlist_id = get_playlist_id(self.usuario, self.playlist)
+            faixas = listar_musicas_da_playlist(playlist_id) if playlist_id else []
+        else:
+            faixas = list(musicas_da_biblioteca(self.usuario, self.diretorio))
+        if self.aleatorio:
+            random.shuffle(faixas)
+        return faixas
+
+    def _transmitir(self):
+        logger.info(f"Rádio '{self.nome}' de '{self.usuario}' iniciada.")
+        while not self._parar.is_set():
+            transmitidas = 0
+            for musica in self._faixas():
+                if self._parar.is_set():
+                    break
+                caminho = safe_join(self.diretorio, musica)
+                if not caminho or not os.path.isfile(caminho):
+                    continue
+                self.faixa_atual = musica
+                try:
+                    self._transmitir_faixa(caminho)
+                    transmitidas += 1
+                except Exception as e:
+                    logger.warning(f"Rádio '{self.nome}': '{musica}' ignorada: {e}")
+            if not transmitidas:
+                logger.warning(f"Rádio '{self.nome}' sem faixas reproduzíveis; nova tentativa em "
+                               f"{RADIO_ESPERA_SEM_FAIXAS}s.")
+                self._parar.wait(RADIO_ESPERA_SEM_FAIXAS)
+        self.faixa_atual = None
+        logger.info(f"Rádio '{self.nome}' encerrada.")
+
+    def _transmitir_faixa(self, caminho):
+        estado, valor = transcode_cache.obter(caminho, self.qualidade)
+        origem = self._ler_arquivo(valor) if estado == 'pronto' else valor
+        try:
+            pendente = b''
+            bloco, duracao = [], 0.0
+            for dados in origem:
+                self.bytes_lidos += len(dados)
+                pendente += dados
+                while True:
+                    quadros, segundos, pendente = separar_quadros_adts(pendente, RADIO_BLOCO_SEGUNDOS - duracao)
+                    bloco.append(quadros)
+                    duracao += segundos
+                    if duracao < RADIO_BLOCO_SEGUNDOS:
+                        break
+                    if not self._publicar(b''.join(bloco), duracao):
+                        return
+                    bloco, duracao = [], 0.0
+            if duracao:
+                self._publicar(b''.join(bloco), duracao)
+        finally:
+            origem.close()
+
+    @staticmethod
+    def _ler_arquivo(caminho):
+        with open(caminho, 'rb') as f:
+            while True:
+                dados = f.read(STREAM_CHUNK_BYTES)
+                if not dados:
+                    break
+                yield dados
+
+    def _publicar(self, dados, duracao):
+        """
+        Espera haver ouvintes e chegar a hora do bloco, e então o grava no
+        anel. Retorna False se a estação foi encerrada.
+        """
+        with self._cond:
+            if not self.ouvintes:
+                while not self.ouvintes and not self._parar.is_set():
+                    self._cond.wait()
+                # Retoma a partir de agora, sem descarregar o tempo em que ficou pausada
+                self._inicio = time.monotonic() - self._posicao
+        espera = self._inicio + self._posicao - RADIO_VANTAGEM_SEGUNDOS - time.monotonic()
+        if espera > 0 and self._parar.wait(espera):
+            return False
+        if espera < -RADIO_VANTAGEM_SEGUNDOS:
+            # Atrasou (transcodificação lenta): realinha em vez de enviar em rajada
+            self._inicio = time.monotonic() - self._posicao
+        controle_de_banda.registrar_stream()
+        with self._cond:
+            if self._parar.is_set():
+                return False
+            self._blocos[self._seq % RADIO_BLOCOS] = dados
+            self._seq += 1
+            self._posicao += duracao
+            self._cond.notify_all()
+        return True
+
+    def ouvir(self):
+        """Gera os blocos para um ouvinte, começando pela borda ao vivo."""
+        with self._cond:
+            self.ouvintes += 1
+            proximo = max(0, self._seq - 1)
+            self._cond.notify_all()
+        try:
+            while True:
+                with self._cond:
+                    while proximo >= self._seq and not self._parar.is_set():
+                        self._cond.wait()
+                    if self._parar.is_set():
+                        return
+                    if self._seq - proximo > RADIO_BLOCOS:
+                        # O bloco já foi sobrescrito: o ouvinte lento volta à borda ao vivo
+                        proximo = self._seq - 1
+                    bloco = self._blocos[proximo % RADIO_BLOCOS]
+                    self.bytes_enviados += len(bloco)
+                proximo += 1
+                yield bloco
+        finally:
+            with self._cond:
+                self.ouvintes -= 1
+
+class EstacoesDeRadio:
+    """Registro das estações ativas neste processo."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._estacoes = {}
+
+    def criar(self, nome, usuario, diretorio, playlist=None, aleatorio=True, qualidade='aac-medium'):
+        """Cria e inicia a estação; retorna None se o nome já está em uso."""
+        with self._lock:
+            if nome in self._estacoes:
+                return None
+            estacao = EstacaoDeRadio(nome, usuario, diretorio, playlist, aleatorio, qualidade)
+            self._estacoes[nome] = estacao
+        estacao.iniciar()
+        return estacao
+
+    def obter(self, nome):
+        with self._lock:
+            return self._estacoes.get(nome)
+
+    def encerrar(self, nome):
+        with self._lock:
+            estacao = self._estacoes.pop(nome, None)
+        if estacao:
+            estacao.encerrar()
+        return estacao
+
+    def listar(self):
+        with self._lock:
+            estacoes = list(self._estacoes.values())
+        return [e.estado() for e in estacoes]
+
+estacoes_de_radio = EstacoesDeRadio()
+
+#############################################################################
+#                  PICOS DA FORMA DE ONDA (BARRA DE PROGRESSO)
+#############################################################################
+
+PICOS_PARES = 1500
+PICOS_TAXA_AMOSTRAGEM = 8000
+PICOS_MAGIC = b'STPK'
+PICOS_VERSAO = 1
+# magic, versão, número de pares, duração em ms; seguidos dos pares (min, max) em int8
+PICOS_CABECALHO = struct.Struct('<4sBxHI')
+
+peaks_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='peaks')
+_picos_em_andamento = set()
+_picos_lock = threading.Lock()
+
+def pasta_de_picos():
+    """Pasta dos sidecars de picos; padrão: '.peaks' dentro de config.file_path."""
+    return config.peaks_path or os.path.join(config.file_path, '.peaks')
+
+def _chave_picos(caminho):
+    """
+    Identifica o conteúdo pelo inode: hardlinks do acervo compartilhado
+    usam o mesmo sidecar em todas as bibliotecas.
+    """
+    st = os.stat(caminho)
+    base = f"{st.st_dev}|{st.st_ino}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(base.encode('utf-8')).hexdigest()
+
+def _caminho_picos(chave):
+    return os.path.join(pasta_de_picos(), chave[:2], chave + '.peaks')
+
+def calcular_picos(caminho, pares=PICOS_PARES):
+    """
+    Decodifica o áudio para PCM mono com o ffmpeg e reduz as amostras a
+    `pares` pares (min, max) em int8. Retorna (picos, duração em ms).
+    """
+    resultado = subprocess.run(
+        [_caminho_ferramenta_ffmpeg('ffmpeg'), '-nostdin', '-v', 'error', '-i', caminho,
+         '-vn', '-ac', '1', '-ar', str(PICOS_TAXA_AMOSTRAGEM), '-f', 's16le', '-'],
+        capture_output=True, timeout=600
+    )
+    if resultado.returncode != 0:
+        raise RuntimeError(f"ffmpeg falhou para '{caminho}': {resultado.stderr.decode(errors='replace').strip()}")
+    amostras = np.frombuffer(resultado.stdout, dtype='<i2')
+    if not amostras.size:
+        raise RuntimeError(f"'{caminho}' não tem áudio decodificável")
+    pares = min(pares, amostras.size)
+    inicios = np.linspace(0, amostras.size, pares, endpoint=False).astype(np.int64)
+    picos = np.empty((pares, 2), dtype=np.int8)
+    picos[:, 0] = np.minimum.reduceat(amostras, inicios) >> 8
+    picos[:, 1] = np.maximum.reduceat(amostras, inicios) >> 8
+    return picos, amostras.size * 1000 // PICOS_TAXA_AMOSTRAGEM
+
+def gerar_picos(caminho):
+    """Calcula e grava o sidecar de picos do arquivo, se ainda não existir."""
+    chave = _chave_picos(caminho)
+    destino = _caminho_picos(chave)
+    if os.path.isfile(destino):
+        return False
+    with _picos_lock:
+        if chave in _picos_em_andamento:
+            return False
+        _picos_em_andamento.add(chave)
+    try:
+        picos, duracao_ms = calcular_picos(caminho)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        temporario = destino + '.part'
+        with open(temporario, 'wb') as f:
+            f.write(PICOS_CABECALHO.pack(PICOS_MAGIC, PICOS_VERSAO, len(picos), duracao_ms))
+            f.write(picos.tobytes())
+        os.replace(temporario, destino)
+        return True
+    finally:
+        with _picos_lock:
+            _picos_em_andamento.discard(chave)
+
+def _gerar_picos_da_pasta(diretorio):
+    try:
+        arquivos = _escanear_diretorio_audio(diretorio)
+    except OSError as e:
+        logger.error(f"Erro ao escanear '{diretorio}' para os picos: {e}")
+        return
+    for nome in arquivos:
+        try:
+            gerar_picos(os.path.join(diretorio, nome))
+        except Exception as e:
+            logger.warning(f"Picos indisponíveis para '{nome}': {e}")
+
+def agendar_picos_da_pasta(diretorio):
+    """Gera em segundo plano os picos que faltam para as faixas da pasta."""
+    peaks_executor.submit(_gerar_picos_da_pasta, diretorio)
+
+def backfill_picos(max_workers=2):
+    """
+    Gera os picos das faixas já existentes de todas as bibliotecas e remove
+    os sidecars que não pertencem a nenhum arquivo.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return 0
+    cursor = conn.cursor()
+    cursor.execute("SELECT usuario, diretorio FROM usuario")
+    usuarios = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    inicio = time.time()
+    validos = set()
+    caminhos = []
+    for usuario, diretorio in usuarios:
+        if not diretorio or not os.path.isdir(diretorio):
+            continue
+        try:
+            for nome in _escanear_diretorio_audio(diretorio):
+                caminho = os.path.join(diretorio, nome)
+                validos.add(_chave_picos(caminho))
+                caminhos.append(caminho)
+        except OSError as e:
+            logger.error(f"Erro ao escanear a biblioteca de '{usuario}': {e}")
+            # Sem a lista completa, não é seguro remover sidecars
+            inicio = None
+
+    total = 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='backfill') as executor:
+        futuros = {executor.submit(gerar_picos, caminho): caminho for caminho in caminhos}
+        for futuro in as_completed(futuros):
+            try:
+                total += 1 if futuro.result() else 0
+            except Exception as e:
+                logger.warning(f"Picos indisponíveis para '{futuros[futuro]}': {e}")
+
+    removidos = 0
+    pasta = pasta_de_picos()
+    if inicio is not None and os.path.isdir(pasta):
+        for raiz, _, nomes in os.walk(pasta):
+            for nome in nomes:
+                caminho = os.path.join(raiz, nome)
+                chave = nome.split('.', 1)[0]
+                try:
+                    if chave not in validos and os.path.getmtime(caminho) < inicio:
+                        os.remove(caminho)
+                        removidos += 1
+                except OSError:
+                    pass
+    logger.info(f"Picos gerados para {total} faixa(s); {removidos} sidecar(s) órfão(s) removido(s).")
+    return total
+
+#############################################################################
+#                      VERIFICADOR DE DUPLICATAS (OFFLINE)
+#############################################################################
+
+HASH_PARCIAL_BYTES = 64 * 1024
+HASH_BLOCO_LEITURA = 1024 * 1024
+_SUFIXO_COPIA = re.compile(r'\s*\(\d+\)$')
+
+def _hash_parcial(caminho, size):
+    """Hash do início e do fim do arquivo (descarta a maioria dos falsos pares)."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(caminho, 'rb') as f:
+        h.update(f.read(HASH_PARCIAL_BYTES))
+        if size > 2 * HASH_PARCIAL_BYTES:
+            f.seek(-HASH_PARCIAL_BYTES, os.SEEK_END)
+            h.update(f.read(HASH_PARCIAL_BYTES))
+    return h.hexdigest()
+
+def _hash_completo(caminho):
+    h = hashlib.blake2b()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(HASH_BLOCO_LEITURA), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def _agrupar_por_hash(executor, grupos, funcao_hash):
+    """Aplica `funcao_hash` em paralelo e reagrupa cada grupo pelo resultado."""
+    futuros = {
+        executor.submit(funcao_hash, arq): (chave, arq)
+        for chave, arquivos in grupos.items() for arq in arquivos
+    }
+    novos = {}
+    for futuro in as_completed(futuros):
+        chave, arq = futuros[futuro]
+        try:
+            digest = futuro.result()
+        except OSError as e:
+            logger.warning(f"Não foi possível ler '{arq[1]}': {e}")
+            continue
+        novos.setdefault((chave, digest), []).append(arq)
+    return {k: v for k, v in novos.items() if len(v) > 1}
+
+def _chave_canonica(arq):
+    """Prefere o nome sem sufixo ' (n)', depois o mais curto e o mais antigo."""
+    usuario, caminho, size, mtime = arq
+    stem = os.path.splitext(os.path.basename(caminho))[0]
+    return (bool(_SUFIXO_COPIA.search(stem)), len(stem), mtime)
+
+def escanear_duplicatas(diretorios, max_workers=4):
+    """
+    Procura arquivos de áudio idênticos nas bibliotecas: agrupa por tamanho,
+    depois por hash parcial e só calcula o hash completo nas colisões.
+    `diretorios` é {usuario: diretorio}. Retorna a lista de grupos.
+    """
+    por_tamanho = {}
+    inodes_vistos = set()
+    for usuario, diretorio in diretorios.items():
+        if not diretorio or not os.path.isdir(diretorio):
+            continue
+        try:
+            with os.scandir(diretorio) as it:
+                for entry in it:
+                    if not entry.name.lower().endswith(EXTENSOES_AUDIO) or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    # Hardlinks do mesmo inode já não ocupam espaço extra
+                    if (st.st_dev, st.st_ino) in inodes_vistos:
+                        continue
+                    inodes_vistos.add((st.st_dev, st.st_ino))
+                    por_tamanho.setdefault(st.st_size, []).append((usuario, entry.path, st.st_size, st.st_mtime))
+        except OSError as e:
+            logger.error(f"Erro ao escanear a biblioteca de '{usuario}' em busca de duplicatas: {e}")
+    candidatos = {size: arqs for size, arqs in por_tamanho.items() if len(arqs) > 1}
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dedup') as executor:
+        parciais = _agrupar_por_hash(executor, candidatos, lambda arq: _hash_parcial(arq[1], arq[2]))
+        completos = _agrupar_por_hash(executor, parciais, lambda arq: _hash_completo(arq[1]))
+
+    grupos = []
+    for ((size, _), digest), arquivos in completos.items():
+        arquivos.sort(key=_chave_canonica)
+        grupos.append({
+            'hash': digest,
+            'size': size,
+            'desperdicio': size * (len(arquivos) - 1),
+            'arquivos': [{'usuario': u, 'caminho': c} for u, c, _, _ in arquivos],
+        })
+    grupos.sort(key=lambda g: g['desperdicio'], reverse=True)
+    return grupos
+
+def buscar_duplicatas_por_origem():
+    """
+    Faixas do mesmo usuário com o mesmo ID de origem (mesmo vídeo baixado
+    com títulos diferentes), mesmo que os bytes sejam diferentes.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return []
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT usuario, source_id FROM track
+            WHERE source_id IS NOT NULL
+            GROUP BY usuario, source_id
+            HAVING COUNT(*) > 1
+        """)
+        pares = cursor.fetchall()
+        grupos = []
+        for usuario, source_id in pares:
+            cursor.execute("SELECT filename, mtime FROM track WHERE usuario = %s AND source_id = %s",
+                           (usuario, source_id))
+            arquivos = sorted(
+                ((usuario, filename, 0, mtime or 0) for filename, mtime in cursor.fetchall()),
+                key=_chave_canonica
+            )
+            grupos.append({'usuario': usuario, 'source_id': source_id,
+                           'arquivos': [filename for _, filename, _, _ in arquivos]})
+        cursor.close()
+        return grupos
+    finally:
+        conn.close()
+
+def mesclar_faixas(usuario, manter, duplicadas):
+    """
+    Transfere favoritos e itens de playlist das faixas duplicadas para a
+    faixa `manter` e exclui as duplicadas. Retorna os nomes removidos.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return []
+    try:
+        cursor = conn.cursor()
+        manter_id = obter_ou_criar_track_id(cursor, usuario, manter)
+        cursor.execute(
+            f"SELECT id, media_id FROM track WHERE usuario = %s AND filename IN ({_placeholders(len(duplicadas))})",
+            (usuario, *duplicadas)
+        )
+        linhas = cursor.fetchall()
+        ids = [r[0] for r in linhas]
+        if ids:
+            marcadores = _placeholders(len(ids))
+            cursor.execute(
+                f"INSERT IGNORE INTO favorites (usuario, track_id) "
+                f"SELECT usuario, %s FROM favorites WHERE track_id IN ({marcadores})",
+                (manter_id, *ids)
+            )
+            cursor.execute(
+                f"INSERT IGNORE INTO playlist_musica (playlist_id, track_id) "
+                f"SELECT playlist_id, %s FROM playlist_musica WHERE track_id IN ({marcadores})",
+                (manter_id, *ids)
+            )
+            cursor.execute(f"DELETE FROM track WHERE id IN ({marcadores})", tuple(ids))
+        arquivos_liberados = liberar_midias_sem_referencia(cursor, {r[1] for r in linhas if r[1]})
+        conn.commit()
+        cursor.close()
+        apagar_arquivos_em_background(arquivos_liberados)
+        invalidar_biblioteca(usuario)
+        library_cache.invalidar(_chave_favoritos(usuario))
+        invalidar_playlists_do_usuario(usuario, incluir_musicas=True)
+        return list(duplicadas)
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao mesclar faixas duplicadas de '{usuario}': {e}")
+        return []
+    finally:
+        conn.close()
+
+def _substituir_por_hardlink(origem, destino):
+    """Troca `destino` por um hardlink de `origem` de forma atômica."""
+    temporario = destino + '.dedup-tmp'
+    os.link(origem, temporario)
+    os.replace(temporario, destino)
+
+def _remover_com_capa(diretorio, nome):
+    for caminho in (os.path.join(diretorio, nome), os.path.splitext(os.path.join(diretorio, nome))[0] + '.jpg'):
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+
+def aplicar_deduplicacao(grupos, grupos_origem, diretorios):
+    """
+    Mescla as referências das duplicatas de cada usuário na cópia canônica,
+    remove as cópias excedentes e, entre usuários diferentes, troca as
+    cópias por hardlinks da canônica. Retorna os bytes recuperados.
+    """
+    recuperado = 0
+    for grupo in grupos:
+        canonico = grupo['arquivos'][0]['caminho']
+        por_usuario = {}
+        for arq in grupo['arquivos']:
+            por_usuario.setdefault(arq['usuario'], []).append(arq['caminho'])
+        for usuario, caminhos in por_usuario.items():
+            manter, *duplicadas = caminhos
+            if duplicadas:
+                removidas = mesclar_faixas(usuario, os.path.basename(manter),
+                                           [os.path.basename(c) for c in duplicadas])
+                for nome in removidas:
+                    _remover_com_capa(diretorios[usuario], nome)
+                    recuperado += grupo['size']
+            if manter != canonico:
+                try:
+                    _substituir_por_hardlink(canonico, manter)
+                    recuperado += grupo['size']
+                except OSError as e:
+                    logger.warning(f"Hardlink não suportado para '{manter}': {e}")
+
+    if grupos:
+        # A primeira fase pode ter removido arquivos listados nos grupos de origem
+        grupos_origem = buscar_duplicatas_por_origem()
+    for grupo in grupos_origem:
+        usuario = grupo['usuario']
+        diretorio = diretorios.get(usuario)
+        if not diretorio:
+            continue
+        # A cópia mantida precisa existir no disco; senão as referências iriam para um fantasma
+        existentes = [nome for nome in grupo['arquivos'] if os.path.isfile(os.path.join(diretorio, nome))]
+        if not existentes:
+            logger.warning(f"Duplicatas de '{grupo['source_id']}' de '{usuario}' sem arquivo no disco; ignoradas.")
+            continue
+        manter = existentes[0]
+        duplicadas = [nome for nome in grupo['arquivos'] if nome != manter]
+        if not duplicadas:
+            continue
+        for nome in mesclar_faixas(usuario, manter, duplicadas):
+            caminho = os.path.join(diretorio, nome)
+            if os.path.exists(caminho):
+                recuperado += os.path.getsize(caminho)
+            _remover_com_capa(diretorio, nome)
+    return recuperado
+
+def executar_verificador_de_duplicatas(aplicar=False, relatorio=None, max_workers=4):
+    """
+    Job em lote: gera o relatório de duplicatas (JSON) e, se `aplicar`,
+    mescla as referências e recupera o espaço.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    cursor = conn.cursor()
+    cursor.execute("SELECT usuario, diretorio FROM usuario")
+    diretorios = dict(cursor.fetchall())
+    cursor.close()
+    conn.close()
+
+    inicio = time.monotonic()
+    grupos = escanear_duplicatas(diretorios, max_workers=max_workers)
+    grupos_origem = buscar_duplicatas_por_origem()
+    resultado = {
+        'gerado_em': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'duracao_s': round(time.monotonic() - inicio, 2),
+        'grupos_identicos': grupos,
+        'grupos_mesma_origem': grupos_origem,
+        'desperdicio_bytes': sum(g['desperdicio'] for g in grupos),
+        'aplicado': aplicar,
+    }
+    if aplicar:
+        resultado['recuperado_bytes'] = aplicar_deduplicacao(grupos, grupos_origem, diretorios)
+
+    relatorio = relatorio or f"duplicatas-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(relatorio, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=4, ensure_ascii=False)
+    logger.info(
+        f"Duplicatas: {len(grupos)} grupo(s) idêntico(s), {len(grupos_origem)} grupo(s) de mesma origem, "
+        f"{resultado['desperdicio_bytes'] / (1024 * 1024):.1f} MB desperdiçados. Relatório: {relatorio}"
+    )
+    return resultado
 
 #############################################################################
 #                     LOOP EM BACKGROUND: PROCESSAR FILA
 #############################################################################
 
-def processar_fila_loop():
-    while True:
-        try:
-            conn = get_db_connection()
-            if not conn:
-                logger.error("Conexão com o banco de dados falhou. Retentando em 10 segundos.")
-                time.sleep(10)
-                continue
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT id, usuario, caminho FROM fila WHERE status = 'em fila'")
-            registros_em_fila = cursor.fetchall()
-            cursor.close()
-            conn.close()
-
-            if registros_em_fila:
-                logger.info(f"{len(registros_em_fila)} item(ns) em fila. Iniciando processamento...")
-                threads = []
-
-                for registro in registros_em_fila:
-                    id_reg = registro['id']
-                    usuario = registro['usuario']
-                    caminho = registro['caminho']
-                    pasta_destino = get_diretorio_do_usuario(usuario)
-                    if not pasta_destino:
-                        logger.error(f"Não encontrei 'diretorio' para usuario '{usuario}'.")
-                        atualizar_status_fila(id_reg, 'Erro')
-                        continue
-
-                    thread = threading.Thread(target=processar_download, args=(id_reg, caminho, usuario, pasta_destino))
-                    threads.append(thread)
-                    thread.start()
+INTERVALO_ARQUIVAMENTO_FILA = 3600
 
-                for thread in threads:
-                    thread.join()
+def processar_fila_loop(parar=None):
+    """
+    Mantém até config.download_workers downloads em paralelo, escolhendo
+    cada próximo job pelo agendador (prioridade e partilha justa). Roda até
+    o evento `parar` (usado pelo benchmark) ser sinalizado.
+    """
+    ativos = {}
+    proximo_arquivamento = 0.0
+    proxima_reconciliacao = 0.0
+    while parar is None or not parar.is_set():
+        try:
+            for id_reg in [i for i, t in ativos.items() if not t.is_alive()]:
+                del ativos[id_reg]
+            manutencao_da_fila(ativos)
+            if time.monotonic() >= proximo_arquivamento:
+                arquivar_fila()
+                proximo_arquivamento = time.monotonic() + INTERVALO_ARQUIVAMENTO_FILA
+            if config.storage_reconcile_interval and time.monotonic() >= proxima_reconciliacao:
+                reconciliar_uso_de_armazenamento()
+                proxima_reconciliacao = time.monotonic() + config.storage_reconcile_interval
+
+            while len(ativos) < max(1, config.download_workers):
+                registro = proximo_job_da_fila()
+                if not registro:
+                    break
+                id_reg = registro['id']
+                usuario = registro['usuario']
+                pasta_destino = get_diretorio_do_usuario(usuario)
+                if not pasta_destino:
+                    logger.error(f"Não encontrei 'diretorio' para usuario '{usuario}'.")
+                    atualizar_status_fila(id_reg, 'Erro')
+                    continue
+
+                logger.info(f"Job {id_reg} de '{usuario}' escolhido (prioridade {registro['prioridade']}, "
+                            f"tamanho {registro['tamanho'] or '?'}).")
+                thread = threading.Thread(target=processar_download,
+                                          args=(id_reg, registro['caminho'], usuario, pasta_destino))
+                ativos[id_reg] = thread
+                thread.start()
 
         except Exception as e:
             logger.error(f"Erro no loop de processamento: {e}")
 
-        time.sleep(10)
+        fila_evento.wait(10)
+        fila_evento.clear()
 
 def processar_download(id_reg, caminho, usuario, pasta_destino):
+    iniciar_medicao(sortear_perfil())
     try:
         logger.info(f"Iniciando download para usuário '{usuario}' com URL: {caminho}")
-        atualizar_status_fila(id_reg, 'baixando')
-        baixar_videos_para_mp3(caminho, pasta_destino)
+        baixar_videos_para_mp3(caminho, pasta_destino, usuario, id_fila=id_reg)
+        contagem = encerrar_passada_do_job(id_reg)
+        sincronizar_tracks(usuario, pasta_destino)
+        agendar_picos_da_pasta(pasta_destino)
+        if contagem.get('pendente'):
+            raise ErroTransitorio(f"{contagem['pendente']} entrada(s) ainda pendente(s)")
+        if contagem.get('erro'):
+            if not contagem.get('concluida'):
+                raise RuntimeError("nenhuma entrada pôde ser baixada")
+            logger.warning(f"Job {id_reg}: {contagem['erro']} entrada(s) desistida(s) após "
+                           f"{config.download_max_retries} tentativas.")
         atualizar_status_fila(id_reg, 'Baixado')
         logger.info(f"Download concluído para ID {id_reg}.")
-    except Exception as e:
-        logger.error(f"Falha no download para ID {id_reg}: {e}")
+    except CotaExcedida as e:
+        logger.warning(f"Job {id_reg} interrompido: {e}")
         atualizar_status_fila(id_reg, 'Erro')
+    except Exception as e:
+        if _erro_transitorio(e) and agendar_nova_tentativa(id_reg):
+            logger.warning(f"Falha transitória no download para ID {id_reg}: {e}")
+        else:
+            logger.error(f"Falha no download para ID {id_reg}: {e}")
+            atualizar_status_fila(id_reg, 'Erro')
+    finally:
+        encerrar_medicao(f"job {id_reg} de '{usuario}'", 'download', config.slow_job_seconds, verificar=False)
+        fila_evento.set()
 
 #############################################################################
 #                  ROTAS PARA FAVORITOS
@@ -929,6 +5094,7 @@ def play_music(musica):
     if not os.path.isfile(musica_path):
         return jsonify({'status': 'error', 'message': 'Arquivo não encontrado.'}), 404
 
+    controle_de_banda.registrar_stream()
     return send_from_directory(diretorio_usuario, musica)
 
 @app.route('/toggle_favorite', methods=['POST'])
@@ -957,7 +5123,7 @@ def favorites():
 
     usuario_logado = session['usuario']
     favoritos = listar_favoritos(usuario_logado)
-    return render_template('favorites.html', favoritos=favoritos, usuario=usuario_logado)
+    return responder_com_etag(render_template('favorites.html', favoritos=favoritos, usuario=usuario_logado))
 
 #############################################################################
 #                  ROTAS PARA PLAYLISTS
@@ -1003,8 +5169,7 @@ def add_to_playlist():
     criar_playlist(usuario, playlist_name)
     # Agora obtém ID
     p_id = get_playlist_id(usuario, playlist_name)
-    if p_id:
-        adicionar_musica_playlist(p_id, musica)
+    if p_id and adicionar_musica_playlist(p_id, musica):
         return jsonify({'status': 'success', 'message': f"Música '{musica}' adicionada na playlist '{playlist_name}'."})
     else:
         return jsonify({'status': 'error', 'message': 'Não foi possível adicionar a música na playlist.'}), 500
@@ -1018,7 +5183,7 @@ def user_playlists():
         return jsonify([])  # Ou retornar erro
     usuario = session['usuario']
     playlists = listar_playlists_do_usuario(usuario)  # [{'id':1,'nome':'Rock'}...]
-    return jsonify(playlists)
+    return responder_com_etag(jsonify(playlists))
 
 @app.route('/get_playlist_songs/<int:playlist_id>', methods=['GET'])
 def get_playlist_songs(playlist_id):
@@ -1028,7 +5193,94 @@ def get_playlist_songs(playlist_id):
     if 'usuario' not in session:
         return jsonify([])
     songs = listar_musicas_da_playlist(playlist_id)
-    return jsonify(songs)
+    return responder_com_etag(jsonify(songs))
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """
+    Retorna as estatísticas do cache de playlists/favoritos, do cache de
+    fragmentos renderizados e do de resoluções de URL (taxa de acerto etc.).
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    estatisticas = library_cache.estatisticas()
+    estatisticas['fragments'] = fragment_cache.estatisticas()
+    estatisticas['metadata'] = metadata_cache.estatisticas()
+    return jsonify(estatisticas)
+
+#############################################################################
+#                  ROTAS PARA ÁLBUNS E ARTISTAS
+#############################################################################
+
+@app.route('/albums')
+def albums():
+    if 'usuario' not in session:
+        flash('Você precisa estar logado.', 'error')
+        return redirect(url_for('login'))
+    usuario = session['usuario']
+    return render_template(
+        'albums.html',
+        albums=listar_albuns_do_usuario(usuario),
+        artists=listar_artistas_do_usuario(usuario),
+        album_selecionado=None,
+        faixas=[]
+    )
+
+@app.route('/albums/<path:album>')
+def album_detail(album):
+    if 'usuario' not in session:
+        flash('Você precisa estar logado.', 'error')
+        return redirect(url_for('login'))
+    usuario = session['usuario']
+    return render_template(
+        'albums.html',
+        albums=listar_albuns_do_usuario(usuario),
+        artists=listar_artistas_do_usuario(usuario),
+        album_selecionado=album,
+        faixas=listar_faixas_por(usuario, 'album', album)
+    )
+
+@app.route('/user_albums', methods=['GET'])
+def user_albums():
+    """
+    Retorna os álbuns do usuário logado em JSON.
+    """
+    if 'usuario' not in session:
+        return jsonify([])
+    return jsonify(listar_albuns_do_usuario(session['usuario']))
+
+@app.route('/user_artists', methods=['GET'])
+def user_artists():
+    """
+    Retorna os artistas do usuário logado em JSON.
+    """
+    if 'usuario' not in session:
+        return jsonify([])
+    return jsonify(listar_artistas_do_usuario(session['usuario']))
+
+@app.route('/get_album_songs', methods=['GET'])
+def get_album_songs():
+    """
+    Retorna as faixas de um álbum (?album=...).
+    """
+    if 'usuario' not in session:
+        return jsonify([])
+    album = request.args.get('album', '')
+    if not album:
+        return jsonify([])
+    return jsonify(listar_faixas_por(session['usuario'], 'album', album))
+
+@app.route('/get_artist_songs', methods=['GET'])
+def get_artist_songs():
+    """
+    Retorna as faixas de um artista (?artist=...).
+    """
+    if 'usuario' not in session:
+        return jsonify([])
+    artist = request.args.get('artist', '')
+    if not artist:
+        return jsonify([])
+    return jsonify(listar_faixas_por(session['usuario'], 'artist', artist))
 
 #############################################################################
 #                  ROTAS PARA PESQUISA E SUGESTÕES
@@ -1044,13 +5296,7 @@ def search_suggestions():
 
     usuario = session['usuario']
     diretorio_usuario = session['diretorio']
-    try:
-        all_musicas = [
-            f for f in os.listdir(diretorio_usuario)
-            if f.lower().endswith(('.mp3', '.wav', '.ogg'))
-        ]
-    except FileNotFoundError:
-        all_musicas = []
+    all_musicas = musicas_da_biblioteca(usuario, diretorio_usuario)
     matching_musicas = [m for m in all_musicas if query in m.lower()]
     return jsonify(matching_musicas[:10])
 
@@ -1066,25 +5312,18 @@ def search():
 
     usuario = session['usuario']
     diretorio_usuario = session['diretorio']
-    try:
-        all_musicas = [
-            f for f in os.listdir(diretorio_usuario)
-            if f.lower().endswith(('.mp3', '.wav', '.ogg'))
-        ]
-    except FileNotFoundError:
-        all_musicas = []
+    all_musicas = musicas_da_biblioteca(usuario, diretorio_usuario)
 
     matching_musicas = [m for m in all_musicas if query in m.lower()]
-    matching_musicas.sort()
     favoritos = listar_favoritos(usuario)
 
-    return render_template(
+    return responder_com_etag(render_template(
         'search.html',
         query=query,
         matching_musicas=matching_musicas,
         usuario=usuario,
         favoritos=favoritos
-    )
+    ))
 
 #############################################################################
 #                       ROTAS FLASK (LOGIN, SIGNUP, ETC.)
@@ -1157,13 +5396,10 @@ def index(musica_selecionada):
         os.makedirs(diretorio_usuario)
 
     try:
-        musicas = [
-            f for f in os.listdir(diretorio_usuario)
-            if f.lower().endswith(('.mp3', '.wav', '.ogg'))
-        ]
+        snapshot = indice_de_bibliotecas.obter(usuario_logado, diretorio_usuario)
     except FileNotFoundError:
-        musicas = []
-    musicas.sort()
+        snapshot = None
+    musicas = snapshot.musicas if snapshot else ()
     favoritos = listar_favoritos(usuario_logado)
 
     if musica_selecionada not in musicas:
@@ -1178,22 +5414,10 @@ def index(musica_selecionada):
         if idx < len(musicas) - 1:
             next_file = musicas[idx + 1]
 
-    cover_exists = False
-    cover_filename = None
-    if musica_selecionada:
-        nome_sem_ext, _ = os.path.splitext(musica_selecionada)
-        capa_jpg_jpg = f"{nome_sem_ext}.jpg.jpg"
-        capa_jpg = f"{nome_sem_ext}.jpg"
-        caminho_jpg_jpg = os.path.join(diretorio_usuario, capa_jpg_jpg)
-        caminho_jpg = os.path.join(diretorio_usuario, capa_jpg)
-        if os.path.exists(caminho_jpg_jpg):
-            cover_filename = capa_jpg_jpg
-            cover_exists = True
-        elif os.path.exists(caminho_jpg):
-            cover_filename = capa_jpg
-            cover_exists = True
+    cover_filename = snapshot.capas.get(musica_selecionada) if musica_selecionada else None
+    cover_exists = cover_filename is not None
 
-    return render_template(
+    return responder_com_etag(render_template(
         'index.html',
         usuario=usuario_logado,
         musicas=musicas,
@@ -1203,7 +5427,7 @@ def index(musica_selecionada):
         cover_exists=cover_exists,
         cover_filename=cover_filename,
         favoritos=favoritos
-    )
+    ))
 
 @app.route('/edit_playlist', methods=['POST'])
 def edit_playlist():
@@ -1236,6 +5460,7 @@ def edit_playlist():
         # Atualizar o nome da playlist
         cursor.execute("UPDATE playlist SET nome = %s WHERE id = %s", (new_name, playlist_id))
         conn.commit()
+        library_cache.invalidar(_chave_playlists(usuario))
         cursor.close()
         conn.close()
         logger.info(f"Playlist ID {playlist_id} renomeada para '{new_name}' pelo usuário '{usuario}'.")
@@ -1276,6 +5501,7 @@ def delete_playlist():
         # Excluir a playlist
         cursor.execute("DELETE FROM playlist WHERE id = %s", (playlist_id,))
         conn.commit()
+        library_cache.invalidar(_chave_playlists(usuario), _chave_musicas_playlist(playlist_id))
         cursor.close()
         conn.close()
         logger.info(f"Playlist ID {playlist_id} excluída pelo usuário '{usuario}'.")
@@ -1316,24 +5542,118 @@ def delete_music():
         logger.error(f"Erro ao excluir a música '{musica}': {e}")
         return jsonify({'status': 'error', 'message': 'Erro ao excluir a música.'}), 500
 
-    # Remover da tabela favorites
-    remover_favorito(usuario, musica)
-
-    # Remover de playlists
-    try:
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM playlist_musica WHERE musica = %s AND playlist_id IN (SELECT id FROM playlist WHERE usuario = %s)", (musica, usuario))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            logger.info(f"Música '{musica}' removida das playlists do usuário '{usuario}'.")
-    except Exception as e:
-        logger.error(f"Erro ao remover música das playlists: {e}")
+    # Remover a faixa (favoritos e playlists caem por ON DELETE CASCADE)
+    if remover_tracks(usuario, [musica]) is not None:
+        logger.info(f"Música '{musica}' removida dos favoritos e playlists do usuário '{usuario}'.")
 
     return jsonify({'status': 'success', 'message': 'Música excluída com sucesso.'})
 
+#############################################################################
+#                  ROTAS PARA OPERAÇÕES EM LOTE
+#############################################################################
+
+def _lista_de_musicas(data):
+    """Extrai e valida a lista 'musicas' do JSON recebido."""
+    musicas = data.get('musicas') if data else None
+    if not isinstance(musicas, list):
+        return None
+    return [m for m in musicas if isinstance(m, str) and m]
+
+@app.route('/add_to_playlist_bulk', methods=['POST'])
+def add_to_playlist_bulk():
+    """
+    Recebe JSON com: { 'playlistName': 'Rock', 'musicas': ['a.mp3', 'b.mp3', ...] }
+    Adiciona todas as músicas à playlist numa única transação.
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    data = request.get_json()
+    playlist_name = data.get('playlistName') if data else None
+    musicas = _lista_de_musicas(data)
+    if not playlist_name or not musicas:
+        return jsonify({'status': 'error', 'message': 'Dados insuficientes (playlistName, musicas).'}), 400
+
+    usuario = session['usuario']
+    p_id, inseridas = adicionar_musicas_playlist_em_lote(usuario, playlist_name, musicas)
+    if p_id is None:
+        return jsonify({'status': 'error', 'message': 'Não foi possível adicionar as músicas na playlist.'}), 500
+    return jsonify({
+        'status': 'success',
+        'message': f"{inseridas} música(s) adicionada(s) na playlist '{playlist_name}'.",
+        'playlist_id': p_id,
+        'added': inseridas
+    })
+
+@app.route('/remove_from_playlist_bulk', methods=['POST'])
+def remove_from_playlist_bulk():
+    """
+    Recebe JSON com: { 'playlistName': 'Rock', 'musicas': ['a.mp3', ...] }
+    Remove as músicas da playlist do usuário numa única transação.
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    data = request.get_json()
+    playlist_name = data.get('playlistName') if data else None
+    musicas = _lista_de_musicas(data)
+    if not playlist_name or not musicas:
+        return jsonify({'status': 'error', 'message': 'Dados insuficientes (playlistName, musicas).'}), 400
+
+    usuario = session['usuario']
+    p_id = get_playlist_id(usuario, playlist_name)
+    if not p_id:
+        return jsonify({'status': 'error', 'message': 'Playlist não encontrada.'}), 404
+    removidas = remover_musicas_playlist_em_lote(p_id, musicas)
+    if removidas is None:
+        return jsonify({'status': 'error', 'message': 'Erro ao remover músicas da playlist.'}), 500
+    return jsonify({
+        'status': 'success',
+        'message': f"{removidas} música(s) removida(s) da playlist '{playlist_name}'.",
+        'removed': removidas
+    })
+
+@app.route('/delete_music_bulk', methods=['POST'])
+def delete_music_bulk():
+    """
+    Recebe JSON com: { 'musicas': ['a.mp3', 'b.mp3', ...] }
+    Remove as faixas (e, por cascata, favoritos/playlists) numa única
+    transação e exclui os arquivos em background.
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    data = request.get_json()
+    musicas = _lista_de_musicas(data)
+    if not musicas:
+        return jsonify({'status': 'error', 'message': 'Músicas não especificadas.'}), 400
+
+    usuario = session['usuario']
+    diretorio_usuario = session.get('diretorio')
+    if not diretorio_usuario:
+        return jsonify({'status': 'error', 'message': 'Diretório do usuário não encontrado.'}), 400
+
+    encontradas = []
+    nao_encontradas = []
+    for musica in dict.fromkeys(musicas):
+        music_path = os.path.join(diretorio_usuario, musica)
+        if os.path.basename(musica) == musica and os.path.isfile(music_path):
+            encontradas.append(musica)
+        else:
+            nao_encontradas.append(musica)
+
+    if not encontradas:
+        return jsonify({'status': 'error', 'message': 'Nenhum arquivo de música encontrado.', 'not_found': nao_encontradas}), 404
+
+    if remover_tracks(usuario, encontradas) is None:
+        return jsonify({'status': 'error', 'message': 'Erro ao remover músicas das listas.'}), 500
+
+    apagar_arquivos_em_background([os.path.join(diretorio_usuario, m) for m in encontradas])
+    logger.info(f"{len(encontradas)} música(s) agendada(s) para exclusão do diretório de '{usuario}'.")
+    return jsonify({
+        'status': 'success',
+        'message': f"{len(encontradas)} música(s) excluída(s) com sucesso.",
+        'deleted': encontradas,
+        'not_found': nao_encontradas
+    })
+
 #############################################################################
 #                  NOVA ROTA PARA REMOVER MÚSICAS DA LISTA
 #############################################################################
@@ -1351,29 +5671,11 @@ def remove_music_from_list():
 
     usuario = session['usuario']
 
-    try:
-        # Remover da tabela favorites
-        remover_favorito(usuario, musica)
-
-        # Remover da tabela playlist_musica
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'status': 'error', 'message': 'Erro de conexão com o banco.'}), 500
-        cursor = conn.cursor()
-        cursor.execute("""
-            DELETE FROM playlist_musica 
-            WHERE musica = %s AND playlist_id IN (
-                SELECT id FROM playlist WHERE usuario = %s
-            )
-        """, (musica, usuario))
-        conn.commit()
-        cursor.close()
-        conn.close()
-
+    # Remover das tabelas favorites e playlist_musica
+    if remover_musicas_das_listas_em_lote(usuario, [musica]):
         logger.info(f"Música '{musica}' removida das listas do usuário '{usuario}'.")
         return jsonify({'status': 'success', 'message': 'Música removida das listas com sucesso.'})
-    except Exception as e:
-        logger.error(f"Erro ao remover música das listas: {e}")
+    else:
         return jsonify({'status': 'error', 'message': 'Erro ao remover música das listas.'}), 500
 
 #############################################################################
@@ -1425,10 +5727,7 @@ def download_all():
             return redirect(url_for('index'))
     else:
         # Todas as músicas
-        all_songs = [
-            f for f in os.listdir(diretorio_usuario)
-            if f.lower().endswith(('.mp3', '.wav', '.ogg'))
-        ]
+        all_songs = musicas_da_biblioteca(usuario, diretorio_usuario)
         files_to_zip = [os.path.join(diretorio_usuario, f) for f in all_songs]
         zip_name = "todas_as_musicas.zip"
 
@@ -1437,7 +5736,7 @@ def download_all():
         return redirect(url_for('index'))
 
     memory_file = BytesIO()
-    with zipfile.ZipFile(memory_file, 'w') as zf:
+    with medir_fase('fs'), zipfile.ZipFile(memory_file, 'w') as zf:
         for file_path in files_to_zip:
             arcname = os.path.basename(file_path)
             zf.write(file_path, arcname=arcname)
@@ -1460,7 +5759,42 @@ def play_musica(nome_arquivo):
         flash('Você precisa estar logado.', 'error')
         return redirect(url_for('login'))
     diretorio_usuario = session['diretorio']
-    return send_from_directory(diretorio_usuario, nome_arquivo)
+    controle_de_banda.registrar_stream()
+    qualidade = request.args.get('quality')
+    if qualidade and qualidade != 'original':
+        if qualidade not in QUALIDADES_STREAM:
+            return jsonify({'status': 'error', 'message': 'Qualidade inválida.'}), 400
+        caminho = safe_join(diretorio_usuario, nome_arquivo)
+        if not caminho or not os.path.isfile(caminho):
+            abort(404)
+        try:
+            return responder_variante(caminho, qualidade)
+        except OSError as e:
+            logger.error(f"Erro ao transcodificar '{nome_arquivo}': {e}")
+            return jsonify({'status': 'error', 'message': 'Erro ao transcodificar a música.'}), 500
+    with medir_fase('fs'):
+        return send_from_directory(diretorio_usuario, nome_arquivo)
+
+@app.route('/peaks/<path:nome_arquivo>')
+def peaks_musica(nome_arquivo):
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    caminho = safe_join(session['diretorio'], nome_arquivo)
+    if not caminho or not os.path.isfile(caminho):
+        abort(404)
+    chave = _chave_picos(caminho)
+    # A URL versionada pela chave pode ficar em cache para sempre
+    if request.args.get('v') != chave:
+        resposta = redirect(url_for('peaks_musica', nome_arquivo=nome_arquivo, v=chave))
+        resposta.headers['Cache-Control'] = 'no-cache'
+        return resposta
+    sidecar = _caminho_picos(chave)
+    if not os.path.isfile(sidecar):
+        peaks_executor.submit(gerar_picos, caminho)
+        return jsonify({'status': 'error', 'message': 'Picos ainda não calculados.'}), 404
+    resposta = send_file(sidecar, mimetype='application/octet-stream', conditional=True)
+    resposta.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return resposta
 
 @app.route('/cover/<path:cover_name>')
 def get_cover(cover_name):
@@ -1469,7 +5803,8 @@ def get_cover(cover_name):
         return redirect(url_for('login'))
     diretorio_usuario = session['diretorio']
     try:
-        return send_from_directory(diretorio_usuario, cover_name)
+        with medir_fase('fs'):
+            return send_from_directory(diretorio_usuario, cover_name)
     except FileNotFoundError:
         flash('Arquivo de capa não encontrado.', 'error')
         referer = request.headers.get("Referer")
@@ -1485,13 +5820,7 @@ def random_track():
         return redirect(url_for('login'))
 
     diretorio_usuario = session['diretorio']
-    try:
-        musicas = [
-            f for f in os.listdir(diretorio_usuario)
-            if f.lower().endswith(('.mp3', '.wav', '.ogg'))
-        ]
-    except FileNotFoundError:
-        musicas = []
+    musicas = musicas_da_biblioteca(session['usuario'], diretorio_usuario)
     if not musicas:
         flash('Nenhuma música na pasta!', 'error')
         return redirect(url_for('index'))
@@ -1514,24 +5843,634 @@ def downloads():
     usuario_logado = session['usuario']
     if request.method == 'POST':
         caminho_digitado = request.form.get('caminho')
-        if caminho_digitado:
+        if caminho_digitado and cota_excedida(usuario_logado):
+            flash('Cota de armazenamento esgotada: exclua músicas para baixar novas.', 'error')
+        elif caminho_digitado:
             inserir_fila(usuario_logado, caminho_digitado)
             flash('Item adicionado à fila!', 'success')
         return redirect(url_for('downloads'))
     else:
-        items = listar_fila(usuario_logado)
-        return render_template('downloads.html', items=items)
+        status = request.args.get('status') or None
+        antes = request.args.get('antes', type=int)
+        items, proximo = listar_fila_paginada(usuario_logado, status, antes)
+        return render_template(
+            'downloads.html',
+            items=items,
+            proximo=proximo,
+            status=status,
+            resumo=resumo_da_fila(usuario_logado),
+            cota=estado_da_cota(usuario_logado),
+        )
+
+@app.route('/storage_usage')
+def storage_usage():
+    """Uso de armazenamento do usuário logado e sua cota (null = sem limite)."""
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    return jsonify(estado_da_cota(session['usuario']))
+
+PREVIA_MAX_ENTRADAS = 200
+
+@app.route('/downloads/preview')
+def downloads_preview():
+    """
+    Resolve a URL (ou usa a resolução em cache) e resume o que seria
+    enfileirado: quantidade de faixas, duração total e quantas já estão na
+    biblioteca ou no acervo compartilhado.
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    url = request.args.get('url', '').strip()
+    if not url:
+        return jsonify({'status': 'error', 'message': 'URL não informada.'}), 400
+    resolucao = resolver_url(url)
+    if not resolucao:
+        return jsonify({'status': 'error', 'message': 'Não foi possível resolver a URL.'}), 422
+
+    entradas = resolucao['entries']
+    ids = [e['id'] for e in entradas]
+    na_biblioteca = ids_na_biblioteca(session['usuario'], ids)
+    no_acervo = set(buscar_midias_no_acervo(set(ids) - na_biblioteca, perfil_configurado()))
+    duracoes = [e['duration'] for e in entradas if e.get('duration')]
+    return jsonify({
+        'title': resolucao['title'],
+        'playlist': resolucao['playlist'],
+        'count': len(entradas),
+        'duration': round(sum(duracoes)),
+        'duration_unknown': len(entradas) - len(duracoes),
+        'in_library': len(na_biblioteca),
+        'in_store': len(no_acervo),
+        'to_download': len(set(ids) - na_biblioteca - no_acervo),
+        'storage': estado_da_cota(session['usuario']),
+        'entries': [
+            {'id': e['id'], 'title': e['title'], 'duration': e['duration'], 'in_library': e['id'] in na_biblioteca}
+            for e in entradas[:PREVIA_MAX_ENTRADAS]
+        ],
+    })
+
+#############################################################################
+#                  ROTAS DO RÁDIO
+#############################################################################
+
+NOME_DE_RADIO = re.compile(r'^[\w-]{1,64}$')
+
+@app.route('/radio', methods=['GET', 'POST'])
+def radio():
+    """
+    GET lista as estações ativas. POST recebe JSON com:
+    { 'name': 'escritorio', 'playlistName': 'Rock', 'shuffle': false, 'quality': 'aac-medium' }
+    e cria uma estação da playlist (sem playlistName, da biblioteca embaralhada).
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    if request.method == 'GET':
+        return jsonify({'stations': estacoes_de_radio.listar()})
+
+    data = request.get_json() or {}
+    nome = data.get('name', '')
+    playlist = data.get('playlistName') or None
+    qualidade = data.get('quality', 'aac-medium')
+    if not NOME_DE_RADIO.match(nome):
+        return jsonify({'status': 'error', 'message': 'Nome de estação inválido.'}), 400
+    if qualidade not in QUALIDADES_RADIO:
+        return jsonify({'status': 'error', 'message': 'Qualidade inválida.'}), 400
+    usuario = session['usuario']
+    if playlist and not get_playlist_id(usuario, playlist):
+        return jsonify({'status': 'error', 'message': 'Playlist não encontrada.'}), 404
+    aleatorio = bool(data.get('shuffle', not playlist))
+    estacao = estacoes_de_radio.criar(nome, usuario, session['diretorio'], playlist, aleatorio, qualidade)
+    if not estacao:
+        return jsonify({'status': 'error', 'message': 'Já existe uma estação com esse nome.'}), 409
+    return jsonify({
+        'status': 'success',
+        'message': 'Estação criada.',
+        'stream_url': url_for('radio_stream', nome=nome),
+    })
+
+@app.route('/radio/<nome>/stream')
+def radio_stream(nome):
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    estacao = estacoes_de_radio.obter(nome)
+    if not estacao:
+        abort(404)
+    resposta = Response(stream_with_context(estacao.ouvir()),
+                        mimetype=QUALIDADES_STREAM[estacao.qualidade][4])
+    resposta.headers['Cache-Control'] = 'no-cache, no-store'
+    return resposta
+
+@app.route('/radio/<nome>/stop', methods=['POST'])
+def radio_stop(nome):
+    """Encerra a estação; só o criador ou um administrador."""
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    estacao = estacoes_de_radio.obter(nome)
+    if not estacao:
+        return jsonify({'status': 'error', 'message': 'Estação não encontrada.'}), 404
+    if estacao.usuario != session['usuario'] and not usuario_e_admin():
+        return jsonify({'status': 'error', 'message': 'Só quem criou a estação pode encerrá-la.'}), 403
+    estacoes_de_radio.encerrar(nome)
+    return jsonify({'status': 'success', 'message': 'Estação encerrada.'})
+
+#############################################################################
+#                  ROTAS DE ADMINISTRAÇÃO
+#############################################################################
+
+def usuario_e_admin():
+    return session.get('usuario') in config.admin_users
+
+@app.route('/admin/bandwidth', methods=['GET', 'POST'])
+def admin_bandwidth():
+    """
+    Consulta ou altera os limites de banda dos downloads em tempo de execução.
+    Recebe JSON com qualquer um de: download_rate_limit, download_job_rate_limit,
+    download_rate_limit_streaming (bytes/s, 0 = sem limite) e
+    download_rate_schedule ([{'start': '00:00', 'end': '06:00', 'limit': 0}, ...]).
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    if not usuario_e_admin():
+        return jsonify({'status': 'error', 'message': 'Acesso restrito a administradores.'}), 403
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        # Valida tudo antes de aplicar, para um campo inválido não deixar metade alterada
+        novos = {}
+        try:
+            for chave in ('download_rate_limit', 'download_job_rate_limit', 'download_rate_limit_streaming'):
+                if chave in data:
+                    novos[chave] = max(0, int(data[chave]))
+            if 'download_rate_schedule' in data:
+                novos['download_rate_schedule'] = [
+                    {
+                        'start': time.strftime('%H:%M', time.strptime(faixa['start'], '%H:%M')),
+                        'end': time.strftime('%H:%M', time.strptime(faixa['end'], '%H:%M')),
+                        'limit': max(0, int(faixa.get('limit', 0))),
+                    }
+                    for faixa in data['download_rate_schedule']
+                ]
+        except (TypeError, ValueError, KeyError, AttributeError):
+            return jsonify({'status': 'error', 'message': 'Limites de banda inválidos.'}), 400
+        for chave, valor in novos.items():
+            setattr(config, chave, valor)
+        save_db_config()
+        logger.info(f"Limites de banda alterados por '{session['usuario']}': {data}")
+    return jsonify(controle_de_banda.estado())
+
+@app.route('/admin/queue', methods=['GET'])
+def admin_queue():
+    """Lista os jobs em andamento, em fila e pausados de todos os usuários."""
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    if not usuario_e_admin():
+        return jsonify({'status': 'error', 'message': 'Acesso restrito a administradores.'}), 403
+    return jsonify({'jobs': listar_fila_admin(), 'agendador': agendador_da_fila.estado()})
+
+@app.route('/admin/queue/<int:id_reg>', methods=['POST'])
+def admin_queue_job(id_reg):
+    """
+    Recebe JSON com: { 'prioridade': 10 } e/ou { 'acao': 'pausar' | 'retomar' }.
+    Só altera jobs que ainda não começaram.
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    if not usuario_e_admin():
+        return jsonify({'status': 'error', 'message': 'Acesso restrito a administradores.'}), 403
+    data = request.get_json() or {}
+    acao = data.get('acao')
+    prioridade = data.get('prioridade')
+    if acao not in (None, 'pausar', 'retomar'):
+        return jsonify({'status': 'error', 'message': 'Ação inválida.'}), 400
+    try:
+        prioridade = int(prioridade) if prioridade is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Prioridade inválida.'}), 400
+    if not alterar_job_da_fila(id_reg, prioridade, acao):
+        return jsonify({'status': 'error', 'message': 'Job não encontrado ou já iniciado.'}), 409
+    logger.info(f"Job {id_reg} alterado por '{session['usuario']}': {data}")
+    return jsonify({'status': 'success', 'message': 'Job atualizado.'})
+
+@app.route('/admin/storage', methods=['GET', 'POST'])
+def admin_storage():
+    """
+    Uso de armazenamento e cotas de todos os usuários. Recebe JSON com
+    qualquer um de: storage_quota_bytes (cota padrão, 0 = sem limite),
+    { 'usuario': 'x', 'quota': 1073741824 } (null remove a cota específica)
+    e { 'reconcile': true } para recalcular os contadores agora.
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    if not usuario_e_admin():
+        return jsonify({'status': 'error', 'message': 'Acesso restrito a administradores.'}), 403
+    corrigidos = None
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        try:
+            padrao = max(0, int(data['storage_quota_bytes'])) if 'storage_quota_bytes' in data else None
+            quota = max(0, int(data['quota'])) if data.get('quota') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': 'Cota inválida.'}), 400
+        if padrao is not None:
+            config.storage_quota_bytes = padrao
+        if data.get('usuario'):
+            if quota is None:
+                config.storage_user_quotas.pop(data['usuario'], None)
+            else:
+                config.storage_user_quotas[data['usuario']] = quota
+        if 'storage_quota_bytes' in data or data.get('usuario'):
+            save_db_config()
+            logger.info(f"Cotas de armazenamento alteradas por '{session['usuario']}': {data}")
+        if data.get('reconcile'):
+            corrigidos = reconciliar_uso_de_armazenamento()
+    resposta = {'default_quota': config.storage_quota_bytes or None, 'users': listar_uso_de_armazenamento()}
+    if corrigidos is not None:
+        resposta['reconciled'] = corrigidos
+    return jsonify(resposta)
+
+@app.route('/admin/queries', methods=['GET', 'POST'])
+def admin_queries():
+    """
+    Agregados das consultas ao banco por impressão digital e por rota/job.
+    POST com { 'reset': true } zera os contadores.
+    """
+    if 'usuario' not in session:
+        return jsonify({'status': 'error', 'message': 'Usuário não está logado.'}), 401
+    if not usuario_e_admin():
+        return jsonify({'status': 'error', 'message': 'Acesso restrito a administradores.'}), 403
+    if request.method == 'POST' and (request.get_json(silent=True) or {}).get('reset'):
+        rastreador_de_consultas.reiniciar()
+        logger.info(f"Rastreamento de consultas zerado por '{session['usuario']}'.")
+    try:
+        limite = max(1, int(request.args.get('limit', 100)))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Limite inválido.'}), 400
+    return jsonify(rastreador_de_consultas.estado(limite))
 
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
     logger.info("Servidor Flask está desligando...")
+    parar_logging()
     os._exit(0)
 
+#############################################################################
+#                  BENCHMARK OFFLINE DO PIPELINE DE DOWNLOAD
+#############################################################################
+
+BENCH_TAXA_AMOSTRAGEM = 44100
+BENCH_INTERVALO_CONSULTA = 0.05
+BENCH_TEMPO_MAXIMO = 3600
+
+def gerar_wav_de_teste(segundos, taxa=BENCH_TAXA_AMOSTRAGEM):
+    """WAV estéreo com dois tons e ruído, para o encoder não ter trabalho trivial."""
+    t = np.arange(int(segundos * taxa)) / taxa
+    ruido = np.random.default_rng(0).normal(0, 0.05, t.size)
+    sinal = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.2 * np.sin(2 * np.pi * 659.25 * t) + ruido
+    amostras = (np.clip(sinal, -1, 1) * 32767).astype('<i2')
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(taxa)
+        wav.writeframes(np.repeat(amostras[:, None], 2, axis=1).tobytes())
+    return buffer.getvalue()
+
+class _ManipuladorBenchmark(http.server.BaseHTTPRequestHandler):
+    """
+    Servidor local do benchmark:
+      /bench/playlist/<lista>/<n>  -> JSON da playlist com n faixas
+      /bench/track/<id>            -> JSON da faixa
+      /bench/audio/<id>.wav        -> o áudio gerado
+    """
+
+    def _responder(self, corpo, tipo):
+        self.send_response(200)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_GET(self):
+        partes = self.path.split('?')[0].strip('/').split('/')
+        if len(partes) == 4 and partes[:2] == ['bench', 'playlist'] and partes[3].isdigit():
+            lista = partes[2]
+            dados = {
+                'id': lista,
+                'title': f"Benchmark {lista}",
+                'entries': [
+                    {'id': f"{lista}-{i:04d}", 'title': f"Faixa {i + 1}", 'duration': self.server.duracao}
+                    for i in range(int(partes[3]))
+                ],
+            }
+            return self._responder(json.dumps(dados).encode('utf-8'), 'application/json')
+        if len(partes) == 3 and partes[:2] == ['bench', 'track']:
+            dados = {
+                'id': partes[2],
+                'title': f"Faixa {partes[2]}",
+                'duration': self.server.duracao,
+                'audio': f"/bench/audio/{partes[2]}.wav",
+            }
+            return self._responder(json.dumps(dados).encode('utf-8'), 'application/json')
+        if len(partes) == 3 and partes[:2] == ['bench', 'audio']:
+            return self._responder(self.server.audio, 'audio/wav')
+        self.send_error(404)
+
+    def log_message(self, formato, *args):
+        pass
+
+def iniciar_servidor_benchmark(segundos):
+    """Sobe o servidor em 127.0.0.1 numa porta livre; retorna (servidor, URL base)."""
+    servidor = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _ManipuladorBenchmark)
+    servidor.daemon_threads = True
+    servidor.audio = gerar_wav_de_teste(segundos)
+    servidor.duracao = segundos
+    threading.Thread(target=servidor.serve_forever, daemon=True, name='bench-http').start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+class BenchmarkLocalIE(InfoExtractor):
+    """Extrator do yt-dlp para as playlists e faixas do servidor do benchmark."""
+    IE_NAME = 'spoti-tube:bench'
+    _VALID_URL = r'(?P<base>https?://127\.0\.0\.1:\d+)/bench/(?:playlist/(?P<lista>[\w-]+)/\d+|track/(?P<faixa>[\w-]+))'
+
+    def _real_extract(self, url):
+        base, lista, faixa = self._match_valid_url(url).group('base', 'lista', 'faixa')
+        if lista:
+            dados = self._download_json(url, lista)
+            entradas = [
+                self.url_result(f"{base}/bench/track/{e['id']}", BenchmarkLocalIE, e['id'], e['title'],
+                                duration=e['duration'])
+                for e in dados['entries']
+            ]
+            return self.playlist_result(entradas, dados['id'], dados['title'])
+        dados = self._download_json(url, faixa)
+        return {
+            'id': dados['id'],
+            'title': dados['title'],
+            'artist': 'Spoti-Tube Benchmark',
+            'duration': dados['duration'],
+            'formats': [{
+                'format_id': 'wav',
+                'url': base + dados['audio'],
+                'ext': 'wav',
+                'acodec': 'pcm_s16le',
+                'vcodec': 'none',
+                'abr': BENCH_TAXA_AMOSTRAGEM * 32 // 1000,
+                'asr': BENCH_TAXA_AMOSTRAGEM,
+                'audio_channels': 2,
+            }],
+        }
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+def _cenario_benchmark(usuario, base, lista, perfil, workers, tamanho, jobs):
+    """Enfileira `jobs` playlists de `tamanho` faixas e acompanha a fila até o fim."""
+    config.audio_profile = perfil
+    config.download_workers = workers
+    cpu_inicial = os.times()
+    inicio = time.monotonic()
+    enfileirados = {}
+    for j in range(jobs):
+        id_reg = inserir_fila(usuario, f"{base}/bench/playlist/{lista}-{j}/{tamanho}")
+        if id_reg is None:
+            raise RuntimeError("não foi possível enfileirar os jobs do benchmark")
+        enfileirados[id_reg] = time.monotonic()
+
+    parar = threading.Event()
+    laco = threading.Thread(target=processar_fila_loop, args=(parar,), daemon=True, name='bench-fila')
+    laco.start()
+    iniciados, finais = {}, {}
+    try:
+        while len(finais) < jobs and time.monotonic() - inicio < BENCH_TEMPO_MAXIMO:
+            time.sleep(BENCH_INTERVALO_CONSULTA)
+            conn = get_db_connection()
+            if not conn:
+                continue
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT id, status FROM fila WHERE id IN ({_placeholders(len(enfileirados))})",
+                    tuple(enfileirados)
+                )
+                agora = time.monotonic()
+                for id_reg, status in cursor.fetchall():
+                    if status != 'em fila':
+                        iniciados.setdefault(id_reg, agora)
+                    if status in ('Baixado', 'Erro'):
+                        finais.setdefault(id_reg, (agora, status))
+                cursor.close()
+            finally:
+                conn.close()
+    finally:
+        parar.set()
+        fila_evento.set()
+        laco.join(timeout=30)
+    cpu_final = os.times()
+
+    faixas = 0
+    conn = get_db_connection()
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT COUNT(*) FROM fila_entrada WHERE status = 'concluida' "
+                f"AND fila_id IN ({_placeholders(len(enfileirados))})",
+                tuple(enfileirados)
+            )
+            faixas = cursor.fetchone()[0]
+            cursor.close()
+        finally:
+            conn.close()
+
+    duracao = (max(t for t, _ in finais.values()) if finais else time.monotonic()) - inicio
+    cpu = sum(cpu_final[:4]) - sum(cpu_inicial[:4])
+    latencias = [iniciados[i] - enfileirados[i] for i in iniciados]
+    concluidos = sum(1 for _, status in finais.values() if status == 'Baixado')
+    return {
+        'profile': perfil,
+        'workers': workers,
+        'playlist_size': tamanho,
+        'jobs': jobs,
+        'jobs_ok': concluidos,
+        'jobs_error': sum(1 for _, status in finais.values() if status == 'Erro'),
+        'jobs_unfinished': jobs - len(finais),
+        'tracks': faixas,
+        'seconds': round(duracao, 2),
+        'jobs_per_hour': round(concluidos / duracao * 3600, 1) if duracao else None,
+        'tracks_per_minute': round(faixas / duracao * 60, 2) if duracao else None,
+        'cpu_seconds_per_track': round(cpu / faixas, 3) if faixas else None,
+        'queue_latency_avg_s': round(sum(latencias) / len(latencias), 3) if latencias else None,
+        'queue_latency_p50_s': _percentil(latencias, 50),
+        'queue_latency_max_s': max(latencias) if latencias else None,
+    }
+
+def _limpar_benchmark(usuario, listas):
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM fila WHERE usuario = %s", (usuario,))
+        cursor.execute("DELETE FROM fila_historico WHERE usuario = %s", (usuario,))
+        cursor.execute("DELETE FROM track WHERE usuario = %s", (usuario,))
+        cursor.execute("DELETE FROM uso_armazenamento WHERE usuario = %s", (usuario,))
+        for lista in listas:
+            cursor.execute("DELETE FROM media_store WHERE source_id LIKE %s", (f"{lista}-%",))
+        cursor.execute("DELETE FROM usuario WHERE usuario = %s", (usuario,))
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Erro ao limpar os dados do benchmark: {e}")
+    finally:
+        conn.close()
+
+def executar_benchmark(workers=(1, 2), tamanhos=(3, 10), perfis=('m4a',), jobs=4, segundos=20, relatorio=None):
+    """
+    Mede o pipeline de download de ponta a ponta (fila, agendador, yt-dlp,
+    ffmpeg, acervo e banco) sem internet: as playlists vêm de um servidor
+    HTTP local e são lidas pelo BenchmarkLocalIE. Usa o banco do config.json
+    com um usuário temporário, então deve rodar num banco de testes, e se
+    recusa a rodar com jobs de outros usuários na fila.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM fila WHERE status IN ('em fila', 'baixando', 'aguardando')")
+        ocupada = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        conn.close()
+    if ocupada:
+        logger.error(f"A fila tem {ocupada} job(s) ativo(s); o benchmark precisa da fila vazia.")
+        return None
+
+    originais = {
+        chave: getattr(config, chave)
+        for chave in ('file_path', 'media_store_path', 'peaks_path', 'library_snapshot_path',
+                      'audio_profile', 'download_workers')
+    }
+    pasta = tempfile.mkdtemp(prefix='spoti-tube-bench-')
+    usuario = f"bench-{os.getpid()}"
+    config.file_path = pasta
+    config.media_store_path = config.peaks_path = config.library_snapshot_path = ''
+    servidor, base = iniciar_servidor_benchmark(segundos)
+    EXTRATORES_EXTRAS.append(BenchmarkLocalIE)
+    listas, resultados = [], []
+    try:
+        diretorio = os.path.join(pasta, usuario)
+        os.makedirs(diretorio)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO usuario (usuario, senha, diretorio) VALUES (%s, %s, %s)",
+                       (usuario, os.urandom(16).hex(), diretorio))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+        for perfil in perfis:
+            for qtd_workers in workers:
+                for tamanho in tamanhos:
+                    # IDs novos a cada cenário: nada é reaproveitado do acervo
+                    lista = f"b{len(listas)}x{os.urandom(3).hex()}"
+                    listas.append(lista)
+                    logger.info(f"Benchmark: perfil {perfil}, {qtd_workers} worker(s), "
+                                f"{jobs} job(s) de {tamanho} faixa(s)...")
+                    resultado = _cenario_benchmark(usuario, base, lista, perfil, qtd_workers, tamanho, jobs)
+                    resultados.append(resultado)
+                    logger.info(
+                        f"  {resultado['jobs_per_hour']} jobs/h, {resultado['tracks_per_minute']} faixas/min, "
+                        f"{resultado['cpu_seconds_per_track']} s de CPU/faixa, latência da fila "
+                        f"média {resultado['queue_latency_avg_s']} s, máx. {resultado['queue_latency_max_s']} s "
+                        f"({resultado['jobs_error']} erro(s), {resultado['jobs_unfinished']} sem terminar)"
+                    )
+    finally:
+        EXTRATORES_EXTRAS.remove(BenchmarkLocalIE)
+        servidor.shutdown()
+        _limpar_benchmark(usuario, listas)
+        for chave, valor in originais.items():
+            setattr(config, chave, valor)
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    if relatorio:
+        with open(relatorio, 'w', encoding='utf-8') as f:
+            json.dump({'track_seconds': segundos, 'results': resultados}, f, ensure_ascii=False, indent=2)
+        logger.info(f"Relatório do benchmark gravado em '{relatorio}'.")
+    return resultados
+
 #############################################################################
 #                            MAIN
 #############################################################################
 
 def main():
+    parser = argparse.ArgumentParser(description="Spoti-Tube")
+    parser.add_argument(
+        'comando', nargs='?', choices=['migrate', 'explain', 'backfill-metadata', 'backfill-peaks', 'dedup',
+                                      'rebuild-library', 'bench-download'],
+        help="migrate: aplica as migrações de esquema; "
+             "explain: verifica os planos das consultas do hot path; "
+             "backfill-metadata: lê as tags das bibliotecas existentes; "
+             "backfill-peaks: gera a forma de onda das bibliotecas existentes; "
+             "dedup: procura músicas duplicadas nas bibliotecas; "
+             "rebuild-library: reescaneia as bibliotecas e regrava os snapshots; "
+             "bench-download: mede o pipeline de download offline, num banco de testes"
+    )
+    parser.add_argument('--apply', action='store_true',
+                        help="dedup: mescla as referências e remove as duplicatas")
+    parser.add_argument('--report', help="dedup/bench-download: caminho do relatório JSON")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="número de threads de leitura dos jobs em lote")
+    parser.add_argument('--bench-workers', default='1,2',
+                        help="bench-download: quantidades de workers, separadas por vírgula")
+    parser.add_argument('--bench-sizes', default='3,10',
+                        help="bench-download: tamanhos de playlist, separados por vírgula")
+    parser.add_argument('--bench-profiles', default='m4a',
+                        help="bench-download: perfis de codificação, separados por vírgula")
+    parser.add_argument('--bench-jobs', type=int, default=4,
+                        help="bench-download: jobs enfileirados por cenário")
+    parser.add_argument('--bench-track-seconds', type=int, default=20,
+                        help="bench-download: duração do áudio gerado para cada faixa")
+    args = parser.parse_args()
+
+    if args.comando:
+        ativar_log_no_console()
+        if not load_db_config():
+            logger.error("Nenhuma configuração encontrada em config.json.")
+            sys.exit(1)
+        if args.comando == 'migrate':
+            sys.exit(0 if aplicar_migracoes() else 1)
+        if args.comando == 'explain':
+            regressoes = verificar_planos_de_consulta()
+            sys.exit(1 if regressoes is None or regressoes else 0)
+        if args.comando == 'backfill-metadata':
+            backfill_metadados(max_workers=args.workers)
+            sys.exit(0)
+        if args.comando == 'backfill-peaks':
+            backfill_picos(max_workers=args.workers)
+            sys.exit(0)
+        if args.comando == 'dedup':
+            resultado = executar_verificador_de_duplicatas(args.apply, args.report, args.workers)
+            sys.exit(0 if resultado is not None else 1)
+        if args.comando == 'bench-download':
+            perfis = [p for p in args.bench_profiles.split(',') if p]
+            invalidos = [p for p in perfis if p not in PERFIS_DE_CODIFICACAO]
+            if invalidos:
+                logger.error(f"Perfil(is) desconhecido(s): {', '.join(invalidos)}.")
+                sys.exit(1)
+            resultado = executar_benchmark(
+                workers=[int(w) for w in args.bench_workers.split(',') if w],
+                tamanhos=[int(t) for t in args.bench_sizes.split(',') if t],
+                perfis=perfis, jobs=args.bench_jobs,
+                segundos=args.bench_track_seconds, relatorio=args.report
+            )
+            sys.exit(0 if resultado is not None else 1)
+        if args.comando == 'rebuild-library':
+            aquecer_bibliotecas(max_workers=args.workers, reconstruir=True)
+            sys.exit(0)
+
     if not load_db_config():
         logger.info("Nenhuma configuração encontrada. Abrindo interface para inserir configurações.")
     else: